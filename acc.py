@@ -8,10 +8,27 @@ with app.setup:
     import pandas as pd
     import numpy as np
     from pathlib import Path
-    from typing import Optional
+    from typing import Callable, Optional, Sequence
     import datetime
-
-    from electriflux.simple_reader import process_flux, iterative_process_flux
+    import time
+    import sys
+    import io
+    import contextlib
+    import cProfile
+    import pstats
+    import multiprocessing
+    from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    import hashlib
+    import uuid
+    import json
+    import os
+    import re
+    import warnings
+    import shutil
+    import threading
+    import functools
+    import importlib.util
+    import pyarrow as pa
 
 
 @app.cell(hide_code=True)
@@ -54,6 +71,7 @@ def configuration_section():
     - **Marimo** : Framework interactif pour les notebooks Python
     - **Pandas & Numpy** : Manipulation et analyse de données  
     - **Pandera** : Validation des schémas de données
+    - **Altair** : Graphiques interactifs des flux d'énergie
     - **Electriflux** : Traitement spécialisé des fichiers de flux électriques
 
     ### 🔧 Fonctions utilitaires
@@ -67,123 +85,3013 @@ def configuration_section():
     return
 
 
+@app.function(hide_code=True)
+@functools.cache
+def pandera_models() -> dict[str, type]:
+    """
+    Modèles Pandera des données du notebook, par nom.
+
+    Pandera n'est importé qu'à la première validation : les modèles sont construits
+    au premier appel, puis réutilisés.
+
+    - R15Model : relevés R15 typés (sortie de type_r15 / compact_r15)
+    - JournalVentesModel : journal des ventes détaillés, tel que chargé par load_journal_ventes
+    - PricePeriodModel : périodes de prix produites par identify_price_periods
+
+    Examples:
+        >>> sorted(pandera_models())
+        ['JournalVentesModel', 'PricePeriodModel', 'R15Model']
+    """
+    import pandera.pandas as pandera
+    from pandera.typing import Series
+
+    class R15Model(pandera.DataFrameModel):
+        """Relevés R15 typés (sortie de type_r15 / compact_r15)."""
+
+        pdl: Series[pd.CategoricalDtype] = pandera.Field(nullable=False, str_matches=r'^\d{14}$')
+        Date_Releve: Series[pd.DatetimeTZDtype] = pandera.Field(nullable=True, dtype_kwargs={'unit': 'ns', 'tz': 'UTC'})
+        Autoconsommation_Collective: Series[pd.Int8Dtype] = pandera.Field(nullable=True, isin=[0, 1])
+        energie: Series = pandera.Field(nullable=True, ge=0, alias=r'^EA_', regex=True)
+
+        class Config:
+            strict = False
+            coerce = False
+
+    class JournalVentesModel(pandera.DataFrameModel):
+        """Journal des ventes détaillés, tel que chargé par load_journal_ventes."""
+
+        CONTRAT: Series = pandera.Field(nullable=False)
+        CODE_ARTICLE: Series[str] = pandera.Field(nullable=False)
+        PUHT: Series[float] = pandera.Field(nullable=True)
+        DATEFACT: Series[pd.DatetimeTZDtype] = pandera.Field(nullable=False, dtype_kwargs={'unit': 'ns', 'tz': 'UTC'})
+        PÉRIODE: Optional[Series[str]] = pandera.Field(nullable=True)
+        PDS_CONTRAT: Optional[Series] = pandera.Field(nullable=True)
+
+        class Config:
+            strict = False
+            coerce = True
+
+    class PricePeriodModel(pandera.DataFrameModel):
+        """Périodes de prix produites par identify_price_periods."""
+
+        CONTRAT: Series = pandera.Field(nullable=False)
+        CODE_ARTICLE: Series[str] = pandera.Field(nullable=False)
+        PUHT: Series[float] = pandera.Field(nullable=False)
+        date_debut: Series[pd.DatetimeTZDtype] = pandera.Field(nullable=False, dtype_kwargs={'unit': 'ns', 'tz': 'UTC'})
+        date_fin: Series[pd.DatetimeTZDtype] = pandera.Field(nullable=False, dtype_kwargs={'unit': 'ns', 'tz': 'UTC'})
+        duree_jours: Series[int] = pandera.Field(ge=1)
+
+        @pandera.dataframe_check
+        def fin_apres_debut(cls, df: pd.DataFrame) -> pd.Series:
+            return df['date_fin'] >= df['date_debut']
+
+        class Config:
+            strict = True
+            coerce = True
+
+    return {model.__name__: model for model in (R15Model, JournalVentesModel, PricePeriodModel)}
+
+
+@app.function(hide_code=True)
+def validate_frame(
+    df: pd.DataFrame,
+    model: str,
+    mode: str = 'complet',
+    sample_size: int = 100_000,
+) -> tuple[pd.DataFrame, pd.DataFrame, float]:
+    """
+    Valide un DataFrame contre un modèle Pandera en mode paresseux (lazy).
+
+    Toutes les erreurs sont collectées en une seule passe vectorisée au lieu de
+    s'arrêter à la première. Pour les très gros volumes, `mode` restreint le contrôle
+    des valeurs à un échantillon aléatoire ('echantillon') ou aux premières lignes
+    ('entete') ; les colonnes et leurs types sont toujours contrôlés.
+
+    Si le modèle demande la conversion des types (coerce), elle est faite colonne par
+    colonne avant la validation : les données renvoyées sont les mêmes, que les
+    contrôles réussissent ou non. Une colonne non convertible est laissée telle quelle
+    et figure parmi les cas en échec.
+
+    Args:
+        df (pd.DataFrame): Données à valider
+        model (str): Nom du modèle Pandera (R15Model, JournalVentesModel, PricePeriodModel,
+            voir pandera_models)
+        mode (str): 'complet', 'echantillon' ou 'entete'
+        sample_size (int): Nombre de lignes contrôlées hors mode 'complet'
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame, float]: Les données (types convertis si le
+            modèle le demande, même en cas d'échec), les cas en échec (vide si la
+            validation réussit) et la durée de validation en secondes
+
+    Examples:
+        >>> periods = pd.DataFrame({
+        ...     'CONTRAT': ['C001'], 'CODE_ARTICLE': ['CONSO_HP'], 'PUHT': [0.18],
+        ...     'date_debut': pd.to_datetime(['2023-02-01'], utc=True),
+        ...     'date_fin': pd.to_datetime(['2023-01-01'], utc=True),
+        ...     'duree_jours': [0],
+        ... })
+        >>> _, failures, _ = validate_frame(periods, 'PricePeriodModel')
+        >>> sorted(set(failures['check'].astype(str)))
+        ['fin_apres_debut', 'greater_than_or_equal_to(1)']
+
+        >>> # Types convertis même en cas d'échec
+        >>> journal = pd.DataFrame({
+        ...     'CONTRAT': ['C001'], 'CODE_ARTICLE': ['CONSO_HP'], 'PUHT': [1],
+        ...     'DATEFACT': pd.to_datetime([None], utc=True),
+        ... })
+        >>> validated, failures, _ = validate_frame(journal, 'JournalVentesModel')
+        >>> len(failures), validated['PUHT'].dtype
+        (1, dtype('float64'))
+    """
+    if mode not in ('complet', 'echantillon', 'entete'):
+        raise ValueError(f"Mode de validation inconnu : {mode}")
+    options = {}
+    if mode == 'echantillon' and len(df) > sample_size:
+        options = {'sample': sample_size, 'random_state': 0}
+    elif mode == 'entete':
+        options = {'head': sample_size}
+
+    from pandera.errors import ParserError, SchemaErrors
+
+    schema = pandera_models()[model].to_schema()
+    start = time.perf_counter()
+    validated = df
+    if schema.coerce:
+        validated = df.copy(deep=False)
+        for name, column in schema.columns.items():
+            if name in df.columns and column.dtype is not None:
+                try:
+                    validated[name] = column.dtype.try_coerce(df[name])
+                except ParserError:
+                    pass
+    try:
+        schema.validate(validated, lazy=True, **options)
+        failure_cases = pd.DataFrame()
+    except SchemaErrors as e:
+        failure_cases = e.failure_cases
+    return validated, failure_cases, time.perf_counter() - start
+
+
+@app.function(hide_code=True)
+def peak_rss_mo() -> Optional[float]:
+    """Pic de mémoire résidente du processus en Mo (None si indisponible, par exemple sous Windows)."""
+    if importlib.util.find_spec('resource') is None:
+        return None
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets sous Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+@app.class_definition(hide_code=True)
+class PipelineProfiler:
+    """
+    Instrumentation des étapes du pipeline : temps mur, temps CPU, hausse du pic de
+    mémoire résidente et volumes en entrée / sortie.
+
+    Chaque étape est mesurée par le gestionnaire de contexte `stage`. Une nouvelle
+    mesure remplace la précédente du même nom (une cellule ré-exécutée ne se cumule
+    pas) et est ajoutée au journal JSON-lines `log_path` s'il est fourni. Avec
+    `profile=True`, chaque étape est aussi profilée par cProfile et le profil de
+    l'étape la plus lente est conservé dans `hottest_profile`.
+
+    Le temps CPU inclut celui des processus enfants terminés (analyse parallèle des
+    flux R15). Il est mesuré pour tout le processus : deux étapes concurrentes
+    (préchargement du R15 et du journal, voir Workspace.prefetch) comptent chacune
+    le temps CPU de l'autre. Le pic de mémoire étant un maximum depuis le démarrage
+    du processus, une étape qui reste sous le pic précédent affiche une hausse nulle.
+
+    Un seul profileur cProfile peut être actif à la fois dans un processus (Python
+    3.12 refuse le second) : avec `profile=True`, les étapes concurrentes s'exécutent
+    l'une après l'autre.
+
+    Examples:
+        >>> profiler = PipelineProfiler()
+        >>> with profiler.stage('somme', lignes_entree=3) as mesure:
+        ...     mesure['lignes_sortie'] = len([sum([1, 2, 3])])
+        >>> profiler.summary()[['etape', 'statut', 'lignes_entree', 'lignes_sortie']].values.tolist()
+        [['somme', 'ok', 3, 1]]
+    """
+
+    columns = ['etape', 'statut', 'mur_s', 'cpu_s', 'pic_rss_delta_mo', 'lignes_entree', 'lignes_sortie', 'debut']
+    # Partagé par tous les profileurs : cProfile est unique par processus
+    _profile_lock = threading.Lock()
+
+    def __init__(self, log_path: Optional[Path] = None, profile: bool = False, session: Optional[str] = None):
+        self.log_path = Path(log_path).expanduser() if log_path else None
+        self.profile = profile
+        self.session = session or datetime.datetime.now().isoformat(timespec='seconds')
+        self.records = {}
+        self.hottest_profile = None
+        self._hottest_seconds = -1.0
+
+    @staticmethod
+    def _cpu_seconds() -> float:
+        children = os.times()
+        return time.process_time() + children.children_user + children.children_system
+
+    @contextlib.contextmanager
+    def stage(self, name: str, lignes_entree: Optional[int] = None):
+        """Mesure le bloc ; `lignes_sortie` peut être renseigné dans le dictionnaire produit."""
+        # Étapes profilées sérialisées avant le début des mesures : l'attente n'est pas comptée
+        with self._profile_lock if self.profile else contextlib.nullcontext():
+            mesure = {'lignes_entree': lignes_entree, 'lignes_sortie': None}
+            profiler = cProfile.Profile() if self.profile else None
+            debut = datetime.datetime.now().isoformat(timespec='seconds')
+            peak_before = peak_rss_mo()
+            wall, cpu = time.perf_counter(), self._cpu_seconds()
+            statut = 'erreur'
+            if profiler:
+                profiler.enable()
+            try:
+                yield mesure
+                statut = 'ok'
+            finally:
+                if profiler:
+                    profiler.disable()
+                wall = time.perf_counter() - wall
+                cpu = self._cpu_seconds() - cpu
+                peak_after = peak_rss_mo()
+                record = {
+                    'etape': name,
+                    'statut': statut,
+                    'mur_s': round(wall, 4),
+                    'cpu_s': round(cpu, 4),
+                    'pic_rss_delta_mo': round(peak_after - peak_before, 1) if peak_before is not None else None,
+                    'lignes_entree': mesure['lignes_entree'],
+                    'lignes_sortie': mesure['lignes_sortie'],
+                    'debut': debut,
+                }
+                self.records.pop(name, None)
+                self.records[name] = record
+                if profiler and wall > self._hottest_seconds:
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+                    self._hottest_seconds = wall
+                    self.hottest_profile = (name, stream.getvalue())
+                self._log(record)
+
+    def _log(self, record: dict) -> None:
+        if not self.log_path:
+            return
+        try:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.log_path.open('a', encoding='utf-8') as f:
+                f.write(json.dumps({'session': self.session, **record}, ensure_ascii=False) + '\n')
+        except OSError:
+            # Le journal de performance ne doit jamais interrompre l'analyse
+            pass
+
+    def summary(self) -> pd.DataFrame:
+        """Mesures de chaque étape, dans l'ordre d'exécution."""
+        return pd.DataFrame(list(self.records.values()), columns=self.columns)
+
+
 @app.function(hide_code=True)
 def identify_price_periods(df: pd.DataFrame) -> pd.DataFrame:
     """
     Identifie les périodes de prix distinctes pour chaque combinaison CONTRAT-CODE_ARTICLE.
 
-    Cette fonction analyse les changements de prix unitaire HT (PUHT) dans le temps pour
-    chaque combinaison contrat-article et crée des périodes tarifaires cohérentes. Elle
-    utilise des opérations vectorisées pandas pour une performance optimale.
+    Cette fonction analyse les changements de prix unitaire HT (PUHT) dans le temps pour
+    chaque combinaison contrat-article et crée des périodes tarifaires cohérentes. Elle
+    est entièrement vectorisée : aucune boucle Python sur les groupes.
+
+    La plupart des contrats d'un même article suivent la même grille tarifaire : les
+    périodes ne sont calculées qu'une fois par grille distincte (même séquence
+    DATEFACT, PUHT), puis recopiées pour chaque contrat qui la partage.
+
+    Algorithme :
+    1. Codage entier des clés et tri global unique par CONTRAT, CODE_ARTICLE, DATEFACT
+    2. Détection des frontières de groupe CONTRAT-CODE_ARTICLE par comparaison de tableaux
+    3. Empreinte de la séquence (DATEFACT, PUHT) de chaque groupe, vérifiée ligne à
+       ligne contre le premier groupe de même empreinte (le représentant de la grille)
+    4. Sur les seuls représentants : points de rupture tarifaire (changement de prix
+       ou de groupe), dates de début/fin par décalage des points de rupture
+    5. Diffusion des périodes de chaque grille aux groupes qui la partagent
+
+    Args:
+        df (pd.DataFrame): DataFrame contenant les colonnes :
+            - CONTRAT (str) : Identifiant unique du contrat
+            - CODE_ARTICLE (str) : Code de l'article facturé
+            - PUHT (float) : Prix unitaire hors taxe
+            - DATEFACT (pd.Timestamp) : Date de facturation
+
+    Returns:
+        pd.DataFrame: DataFrame contenant les périodes de prix avec :
+            - CONTRAT (str) : Identifiant du contrat
+            - CODE_ARTICLE (str) : Code de l'article
+            - PUHT (float) : Prix unitaire de la période
+            - date_debut (pd.Timestamp) : Date de début de la période
+            - date_fin (pd.Timestamp) : Date de fin de la période
+            - duree_jours (int) : Durée de la période en jours (≥ 1)
+        Le taux de déduplication est dans `attrs['grilles']` : nombre de groupes,
+        nombre de grilles distinctes et ratio groupes / grilles.
+
+    Examples:
+        >>> # Données d'entrée avec changement de prix
+        >>> data = pd.DataFrame({
+        ...     'CONTRAT': ['C001', 'C001', 'C001'],
+        ...     'CODE_ARTICLE': ['ABONNEMENT', 'ABONNEMENT', 'ABONNEMENT'], 
+        ...     'PUHT': [12.0, 12.0, 15.0],
+        ...     'DATEFACT': pd.to_datetime(['2023-01-01', '2023-02-01', '2023-03-01'])
+        ... })
+        >>> periods = identify_price_periods(data)
+        >>> len(periods)
+        2
+        >>> int(periods.iloc[0]['duree_jours'])  # Première période
+        59
+        >>> float(periods.iloc[1]['PUHT'])  # Nouveau prix
+        15.0
+
+        >>> # Plusieurs groupes : les périodes ne débordent pas d'un groupe à l'autre
+        >>> data = pd.DataFrame({
+        ...     'CONTRAT': ['C002', 'C001', 'C001', 'C002'],
+        ...     'CODE_ARTICLE': ['CONSO_BASE'] * 4,
+        ...     'PUHT': [0.20, 0.18, 0.18, 0.22],
+        ...     'DATEFACT': pd.to_datetime(['2023-01-01', '2023-01-01', '2023-02-01', '2023-03-01'])
+        ... })
+        >>> identify_price_periods(data)[['CONTRAT', 'PUHT', 'duree_jours']].values.tolist()
+        [['C001', 0.18, 32], ['C002', 0.2, 59], ['C002', 0.22, 1]]
+
+        >>> # Deux contrats sur la même grille : périodes calculées une seule fois
+        >>> data = pd.DataFrame({
+        ...     'CONTRAT': ['C001', 'C002', 'C001', 'C002', 'C003'],
+        ...     'CODE_ARTICLE': ['CONSO_BASE'] * 5,
+        ...     'PUHT': [0.18, 0.18, 0.20, 0.20, 0.18],
+        ...     'DATEFACT': pd.to_datetime(['2023-01-01', '2023-01-01', '2023-02-01', '2023-02-01', '2023-01-01'])
+        ... })
+        >>> periods = identify_price_periods(data)
+        >>> periods[['CONTRAT', 'PUHT', 'duree_jours']].values.tolist()
+        [['C001', 0.18, 31], ['C001', 0.2, 1], ['C002', 0.18, 31], ['C002', 0.2, 1], ['C003', 0.18, 1]]
+        >>> periods.attrs['grilles']
+        {'groupes': 3, 'grilles': 2, 'ratio': 1.5}
+
+        >>> # Données vides
+        >>> empty_df = pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT'])
+        >>> result = identify_price_periods(empty_df)
+        >>> result.empty
+        True
+
+    Note:
+        - Les périodes sont calculées de manière inclusive (date_fin incluse)
+        - Pour la dernière période d'un groupe, date_fin = dernière DATEFACT du groupe
+        - Les données sont automatiquement triées par ordre chronologique
+        - La fonction gère les DataFrames vides en retournant une structure vide valide
+    """
+    colonnes = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours']
+    if df.empty:
+        # Retourner un DataFrame vide avec la structure attendue
+        return pd.DataFrame(columns=colonnes)
+
+    # Clés codées en entiers dans l'ordre trié ; -1 = clé manquante, ignorée comme par groupby
+    contrat_codes, contrat_valeurs = pd.factorize(df['CONTRAT'], sort=True)
+    article_codes, article_valeurs = pd.factorize(df['CODE_ARTICLE'], sort=True)
+    cle = contrat_codes.astype(np.int64) * max(len(article_valeurs), 1) + article_codes
+    dates_manquantes = df['DATEFACT'].isna().to_numpy()
+    instants = np.where(dates_manquantes, np.iinfo(np.int64).max, pd.DatetimeIndex(df['DATEFACT']).as_unit('ns').asi8)
+
+    # Un seul tri global (stable, dates manquantes en fin de groupe comme sort_values) :
+    # chaque groupe CONTRAT-CODE_ARTICLE devient un bloc contigu
+    order = np.lexsort((instants, cle))
+    order = order[(contrat_codes[order] >= 0) & (article_codes[order] >= 0)]
+    if len(order) == 0:
+        return pd.DataFrame(columns=colonnes)
+
+    cle, instants = cle[order], instants[order]
+    puht = df['PUHT'].to_numpy()[order]
+    dates = df['DATEFACT'].iloc[order].reset_index(drop=True)
+    n = len(order)
+
+    # Début de groupe : la clé diffère de la ligne précédente
+    debut_groupe = np.ones(n, dtype=bool)
+    debut_groupe[1:] = cle[1:] != cle[:-1]
+    groupe_ligne = np.cumsum(debut_groupe) - 1
+    groupe_starts = np.flatnonzero(debut_groupe)
+    taille_groupe = np.diff(np.append(groupe_starts, n))
+    position = np.arange(n) - groupe_starts[groupe_ligne]
+
+    # Empreinte de la grille (séquence DATEFACT, PUHT) de chaque groupe : somme des
+    # empreintes des lignes, position comprise, et taille du groupe
+    empreinte_ligne = pd.util.hash_pandas_object(
+        pd.DataFrame({'position': position, 'instant': instants, 'puht': puht}), index=False
+    ).to_numpy()
+    empreinte = np.add.reduceat(empreinte_ligne, groupe_starts).view(np.int64)
+    _, representant, grille = np.unique(
+        np.column_stack([taille_groupe, empreinte]), axis=0, return_index=True, return_inverse=True,
+    )
+    grille = grille.ravel()
+
+    # Vérification exacte contre le groupe représentant ; en cas de collision
+    # d'empreintes, le groupe concerné devient sa propre grille
+    ligne_ref = groupe_starts[representant[grille]][groupe_ligne] + position
+    identique = (instants == instants[ligne_ref]) & (
+        (puht == puht[ligne_ref]) | (pd.isna(puht) & pd.isna(puht[ligne_ref]))
+    )
+    collision = ~np.logical_and.reduceat(identique, groupe_starts)
+    if collision.any():
+        grille[collision] = len(representant) + np.arange(collision.sum())
+        representant = np.append(representant, np.flatnonzero(collision))
+
+    # Périodes calculées une seule fois par grille, sur les lignes des groupes représentants
+    est_representant = np.zeros(len(groupe_starts), dtype=bool)
+    est_representant[representant] = True
+    lignes = np.flatnonzero(est_representant[groupe_ligne])
+    debut_ref, groupe_ref, puht_ref = debut_groupe[lignes], groupe_ligne[lignes], puht[lignes]
+    dates_ref = dates.iloc[lignes].reset_index(drop=True)
+
+    # Changement de prix : premier élément du groupe ou PUHT différent du précédent
+    changements = debut_ref.copy()
+    changements[1:] |= puht_ref[1:] != puht_ref[:-1]
+    starts = np.flatnonzero(changements)
+
+    # Groupe de chaque période et dernière ligne de chaque groupe
+    groupe_start = groupe_ref[starts]
+    fin_groupe = np.append(np.flatnonzero(debut_ref)[1:], len(lignes)) - 1
+    fin_periode = fin_groupe[np.cumsum(debut_ref)[starts] - 1]
+
+    # Période suivante dans le même groupe ?
+    a_suivante = np.append(groupe_start[1:] == groupe_start[:-1], False)
+    suivante = np.append(starts[1:], 0)
+
+    date_debut = dates_ref.iloc[starts].reset_index(drop=True)
+    # Date de fin : début de la période suivante - 1 jour, sinon dernière date du groupe
+    date_fin = (dates_ref.iloc[suivante].reset_index(drop=True) - pd.Timedelta(days=1)).where(
+        a_suivante, dates_ref.iloc[fin_periode].reset_index(drop=True)
+    )
+
+    # Diffusion des périodes de chaque grille à tous les groupes qui la partagent
+    nb_periodes = np.bincount(groupe_start, minlength=len(groupe_starts))
+    premiere = np.cumsum(nb_periodes) - nb_periodes
+    source = representant[grille]
+    repetitions = nb_periodes[source]
+    rang = np.arange(repetitions.sum()) - np.repeat(np.cumsum(repetitions) - repetitions, repetitions)
+    take = np.repeat(premiere[source], repetitions) + rang
+    cle_groupe = np.repeat(cle[groupe_starts], repetitions)
+
+    periods = pd.DataFrame({
+        'CONTRAT': np.asarray(contrat_valeurs)[cle_groupe // max(len(article_valeurs), 1)],
+        'CODE_ARTICLE': np.asarray(article_valeurs)[cle_groupe % max(len(article_valeurs), 1)],
+        'PUHT': puht_ref[starts][take],
+        'date_debut': date_debut.iloc[take].reset_index(drop=True),
+        'date_fin': date_fin.iloc[take].reset_index(drop=True),
+    })
+    periods['duree_jours'] = (periods['date_fin'] - periods['date_debut']).dt.days + 1
+    periods.attrs['grilles'] = {
+        'groupes': len(groupe_starts),
+        'grilles': len(representant),
+        'ratio': round(len(groupe_starts) / len(representant), 1),
+    }
+    return periods
+
+
+@app.function(hide_code=True)
+def aggregate_r15_by_period(
+    r15: pd.DataFrame,
+    price_periods: pd.DataFrame,
+    contract_prm: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Agrège les relevés R15 sur chaque période de prix par jointure d'intervalles triée.
+
+    Les relevés sont triés une seule fois par Date_Releve, puis chaque période est
+    localisée par recherche dichotomique (searchsorted) sur ce tableau trié. Les sommes
+    sont obtenues par différence de sommes cumulées : chaque période coûte O(log n)
+    au lieu d'un parcours complet des relevés.
+
+    Avec `contract_prm`, l'agrégation se fait par contrat : les relevés sont triés une
+    seule fois par (pdl, Date_Releve) et chaque période ne considère que les relevés
+    des PRM de son contrat (jointure par clé puis par intervalle). Les contrats sans
+    PRM associé n'ont aucun relevé.
+
+    Args:
+        r15 (pd.DataFrame): Relevés R15 typés, avec Date_Releve (datetime), pdl et les
+            colonnes numériques (float64/float32/int64) à sommer
+        price_periods (pd.DataFrame): Périodes issues de identify_price_periods
+        contract_prm (pd.DataFrame, optional): Correspondance CONTRAT → pdl (voir
+            build_contract_prm_map) ; sans elle, chaque période somme tout le périmètre
+
+    Returns:
+        pd.DataFrame: Une ligne par période contenant au moins un relevé, avec :
+            - CONTRAT, CODE_ARTICLE, PUHT, date_debut, date_fin, duree_jours
+            - nb_lignes_r15 (int) : Nombre de relevés dans la période (bornes incluses)
+            - une colonne par colonne numérique de r15 : somme sur la période
+        DataFrame vide si aucune période ne contient de relevé.
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'pdl': ['P1', 'P2', 'P1'],
+        ...     'Date_Releve': pd.to_datetime(['2023-01-10', '2023-02-10', '2023-03-10'], utc=True),
+        ...     'EA_HP': [1.0, 2.0, 4.0],
+        ... })
+        >>> periods = pd.DataFrame({
+        ...     'CONTRAT': ['C001', 'C001', 'C001'],
+        ...     'CODE_ARTICLE': ['CONSO_HP'] * 3,
+        ...     'PUHT': [0.18, 0.20, 0.22],
+        ...     'date_debut': pd.to_datetime(['2023-01-01', '2023-03-01', '2024-01-01'], utc=True),
+        ...     'date_fin': pd.to_datetime(['2023-02-28', '2023-03-31', '2024-01-31'], utc=True),
+        ...     'duree_jours': [59, 31, 31],
+        ... })
+        >>> aggregate_r15_by_period(r15, periods)[['PUHT', 'nb_lignes_r15', 'EA_HP']].values.tolist()
+        [[0.18, 2.0, 3.0], [0.2, 1.0, 4.0]]
+
+        >>> # Par contrat : C001 n'est alimenté que par le PRM P1
+        >>> mapping = pd.DataFrame({'CONTRAT': ['C001'], 'pdl': ['P1']})
+        >>> aggregate_r15_by_period(r15, periods, mapping)[['PUHT', 'nb_lignes_r15', 'EA_HP']].values.tolist()
+        [[0.18, 1.0, 1.0], [0.2, 1.0, 4.0]]
+
+    Note:
+        - Les bornes date_debut et date_fin sont incluses
+        - Les valeurs manquantes sont ignorées dans les sommes (comme Series.sum())
+    """
+    if r15.empty or price_periods.empty:
+        return pd.DataFrame()
+    return periods_with_totals(price_periods, r15_period_totals(r15, price_periods, contract_prm))
+
+
+@app.function(hide_code=True)
+def r15_period_totals(
+    r15: pd.DataFrame,
+    price_periods: pd.DataFrame,
+    contract_prm: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Nombre de relevés et sommes des colonnes numériques de r15 pour chaque période.
+
+    Cœur de aggregate_r15_by_period (même jointure d'intervalles, mêmes arguments) :
+    une ligne par période, dans l'ordre de price_periods, y compris les périodes sans
+    relevé. Les totaux de plusieurs morceaux de relevés s'additionnent (voir
+    aggregate_r15_parquet).
+
+    Returns:
+        pd.DataFrame: nb_lignes_r15 puis une colonne par colonne numérique de r15
+    """
+    numeric_cols = r15.select_dtypes(include=['float64', 'float32', 'int64']).columns.tolist()
+    nb_periods = len(price_periods)
+    if r15.empty or price_periods.empty:
+        return pd.DataFrame(0, index=range(nb_periods), columns=['nb_lignes_r15', *numeric_cols])
+
+    if contract_prm is None:
+        # Tri unique par date ; les dates manquantes ne tombent dans aucune période.
+        # Une entrée déjà triée (vue d'un R15Store) est utilisée telle quelle.
+        if r15['Date_Releve'].is_monotonic_increasing and not r15['Date_Releve'].hasnans:
+            r15_sorted = r15
+        else:
+            r15_sorted = r15[r15['Date_Releve'].notna()].sort_values('Date_Releve', kind='stable')
+        dates = pd.DatetimeIndex(r15_sorted['Date_Releve'])
+
+        # Jointure d'intervalles : bornes [lo, hi) de chaque période dans le tableau trié
+        period_idx = np.arange(nb_periods)
+        lo = dates.searchsorted(price_periods['date_debut'], side='left')
+        hi = dates.searchsorted(price_periods['date_fin'], side='right')
+
+        def sorted_values(col):
+            return r15_sorted[col].to_numpy()
+    else:
+        # Jointure par clé : une paire (période, PRM) par PRM du contrat de la période
+        periods = price_periods[['CONTRAT', 'date_debut', 'date_fin']].reset_index(drop=True)
+        periods = periods[periods['date_debut'].notna() & periods['date_fin'].notna()]
+        pairs = periods[['CONTRAT']].reset_index().merge(contract_prm[['CONTRAT', 'pdl']], on='CONTRAT')
+        prms = pd.Index(pairs['pdl'].astype(str).unique())
+
+        # Relevés datés des PRM concernés, codés par PRM
+        r15_codes = prms.get_indexer(r15['pdl'].astype(str))
+        rows = (r15_codes >= 0) & r15['Date_Releve'].notna().to_numpy()
+        codes = r15_codes[rows]
+
+        # Rangs denses communs aux dates de relevé et aux bornes : clé exacte (PRM, rang) en int64
+        def instants(values):
+            return pd.DatetimeIndex(values).as_unit('ns').asi8
+
+        releves = instants(r15['Date_Releve'][rows])
+        _, ranks = np.unique(
+            np.concatenate([releves, instants(price_periods['date_debut']), instants(price_periods['date_fin'])]),
+            return_inverse=True,
+        )
+        span = ranks.max() + 1 if len(ranks) else 1
+        rank_debut = ranks[len(releves):len(releves) + nb_periods]
+        rank_fin = ranks[len(releves) + nb_periods:]
+
+        # Tri unique par (PRM, date), puis recherche dichotomique des bornes de chaque paire
+        keys = codes.astype(np.int64) * span + ranks[:len(releves)]
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        period_idx = pairs['index'].to_numpy()
+        pair_codes = prms.get_indexer(pairs['pdl'].astype(str)).astype(np.int64)
+        lo = np.searchsorted(keys, pair_codes * span + rank_debut[period_idx], side='left')
+        hi = np.searchsorted(keys, pair_codes * span + rank_fin[period_idx], side='right')
+
+        def sorted_values(col):
+            return r15[col].to_numpy()[rows][order]
+
+    hi = np.maximum(hi, lo)
+    nb_lignes = np.zeros(nb_periods, dtype=np.int64)
+    np.add.at(nb_lignes, period_idx, hi - lo)
+
+    # Sommes par différence de sommes cumulées (NaN comptés comme 0), cumulées par période
+    sums = {'nb_lignes_r15': nb_lignes}
+    for col in numeric_cols:
+        values = sorted_values(col)
+        if values.dtype.kind == 'f':
+            # Sommes cumulées en float64, y compris pour des énergies stockées en float32
+            values = np.nan_to_num(values.astype(np.float64), nan=0.0)
+        cumsum = np.concatenate([np.zeros(1, dtype=values.dtype), np.cumsum(values)])
+        totals = np.zeros(nb_periods, dtype=cumsum.dtype)
+        np.add.at(totals, period_idx, cumsum[hi] - cumsum[lo])
+        sums[col] = totals
+
+    return pd.DataFrame(sums)
+
+
+@app.function(hide_code=True)
+def update_period_totals(
+    totals: pd.DataFrame,
+    price_periods: pd.DataFrame,
+    contract_prm: Optional[pd.DataFrame],
+    ajoutes: pd.DataFrame,
+    retires: pd.DataFrame,
+    debut: pd.Timestamp,
+    debut_precedent: pd.Timestamp,
+    fin: pd.Timestamp,
+) -> pd.DataFrame:
+    """
+    Totaux par période (r15_period_totals) après l'ajout et le retrait de relevés.
+
+    Les totaux sont additifs : ceux des relevés ajoutés, filtrés sur [debut, fin], sont
+    ajoutés ; ceux des relevés retirés, filtrés sur la fenêtre [debut_precedent, fin]
+    des totaux d'origine, sont retranchés. Seuls les relevés reçus ou retirés sont
+    parcourus. Un début ACC qui recule ne fait entrer dans la fenêtre que des relevés
+    reçus (aucun relevé ACC plus ancien n'existait) ; un début qui avance n'en fait
+    sortir que des relevés retirés.
+    """
+    def period_totals(r15: pd.DataFrame, start: pd.Timestamp) -> pd.DataFrame:
+        r15 = filter_r15(r15, start, fin) if not r15.empty else r15
+        return r15_period_totals(r15, price_periods, contract_prm)
+
+    plus, moins = period_totals(ajoutes, debut), period_totals(retires, debut_precedent)
+    columns = [*totals.columns, *plus.columns.difference(totals.columns, sort=False)]
+    return totals.add(plus, fill_value=0).sub(moins, fill_value=0).reindex(columns=columns)
+
+
+@app.function(hide_code=True)
+def periods_with_totals(price_periods: pd.DataFrame, totals: pd.DataFrame) -> pd.DataFrame:
+    """Périodes contenant au moins un relevé, suivies de leurs totaux (voir r15_period_totals)."""
+    info_cols = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours']
+    keep = (totals['nb_lignes_r15'] > 0).to_numpy()
+    if not keep.any():
+        return pd.DataFrame()
+    result = price_periods.loc[keep, info_cols].reset_index(drop=True)
+    return pd.concat([result, totals[keep].reset_index(drop=True)], axis=1)
+
+
+@app.function(hide_code=True)
+def build_contract_prm_map(
+    journal: pd.DataFrame,
+    prms: pd.Series,
+    mapping: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Construit la correspondance entre les contrats du journal et les PRM des relevés R15.
+
+    Par ordre de priorité :
+    1. `mapping` explicite (colonnes CONTRAT et pdl), par exemple lu depuis un CSV
+    2. PDS_CONTRAT du journal, lorsqu'il désigne un PRM présent dans les relevés
+    3. CONTRAT lui-même, lorsqu'il désigne un PRM présent dans les relevés
+
+    Les identifiants sont normalisés (texte, suffixe Excel '.0' retiré, complétés à 14
+    chiffres) avant comparaison avec les pdl R15.
+
+    Args:
+        journal (pd.DataFrame): Journal des ventes (CONTRAT, éventuellement PDS_CONTRAT)
+        prms (pd.Series): Identifiants pdl présents dans les relevés R15
+        mapping (pd.DataFrame, optional): Correspondance explicite CONTRAT → pdl
+
+    Returns:
+        pd.DataFrame: Couples uniques (CONTRAT, pdl) ; vide si rien ne correspond
+
+    Raises:
+        ValueError: Si `mapping` n'a pas les colonnes CONTRAT et pdl
+
+    Examples:
+        >>> journal = pd.DataFrame({'CONTRAT': ['C1', 'C2', 'C3'], 'PDS_CONTRAT': [14000000000001.0, 6, None]})
+        >>> build_contract_prm_map(journal, pd.Series(['14000000000001'])).values.tolist()
+        [['C1', '14000000000001']]
+    """
+    def normalize(ids: pd.Series) -> pd.Series:
+        ids = ids.astype('string').str.strip().str.replace(r'\.0$', '', regex=True)
+        return ids.where(~ids.str.fullmatch(r'\d{1,14}', na=False), ids.str.zfill(14))
+
+    if mapping is not None and (missing := [col for col in ['CONTRAT', 'pdl'] if col not in mapping.columns]):
+        raise ValueError(
+            f"Correspondance CONTRAT → PRM : colonne(s) manquante(s) {', '.join(missing)} "
+            f"(colonnes trouvées : {', '.join(map(str, mapping.columns))})"
+        )
+
+    known = set(normalize(pd.Series(pd.unique(prms))).dropna())
+    candidates = []
+    if mapping is not None:
+        # Les contrats du CSV sont ramenés aux valeurs (et au type) du journal
+        contrats = pd.Series(pd.unique(journal['CONTRAT']))
+        by_text = dict(zip(contrats.astype(str).str.strip().str.replace(r'\.0$', '', regex=True), contrats))
+        contrat = mapping['CONTRAT'].astype(str).str.strip().str.replace(r'\.0$', '', regex=True).map(by_text)
+        candidates.append(pd.DataFrame({'CONTRAT': contrat, 'pdl': normalize(mapping['pdl'])}).dropna())
+    for col in ['PDS_CONTRAT', 'CONTRAT']:
+        if col in journal.columns:
+            # Une ligne par couple distinct : le journal répète chaque contrat à chaque facture
+            pairs = pd.DataFrame({'CONTRAT': journal['CONTRAT'], 'pdl': journal[col]}).drop_duplicates()
+            candidates.append(pairs.assign(pdl=normalize(pairs['pdl'])))
+
+    retained, mapped = [], set()
+    for candidate in candidates:
+        candidate = candidate[candidate['pdl'].isin(known)].drop_duplicates()
+        # Une source de moindre priorité ne complète que les contrats encore sans PRM
+        candidate = candidate[~candidate['CONTRAT'].isin(mapped)]
+        mapped.update(candidate['CONTRAT'])
+        retained.append(candidate)
+
+    if not retained:
+        return pd.DataFrame({'CONTRAT': pd.Series(dtype=object), 'pdl': pd.Series(dtype=str)})
+    return pd.concat(retained, ignore_index=True).astype({'pdl': str})
+
+
+@app.function(hide_code=True)
+def unmapped_contracts(price_periods: pd.DataFrame, contract_prm: pd.DataFrame) -> list:
+    """
+    Contrats ayant des périodes de prix mais aucun PRM dans la correspondance.
+
+    Avec une correspondance partielle, leurs périodes n'ont aucun relevé et sont
+    absentes de r15_by_period. Sans correspondance du tout (contract_prm vide),
+    chaque période somme tout le périmètre : aucun contrat n'est alors écarté.
+
+    Examples:
+        >>> periods = pd.DataFrame({'CONTRAT': ['C1', 'C2', 'C2', 'C3']})
+        >>> unmapped_contracts(periods, pd.DataFrame({'CONTRAT': ['C1'], 'pdl': ['P1']}))
+        ['C2', 'C3']
+        >>> unmapped_contracts(periods, pd.DataFrame(columns=['CONTRAT', 'pdl']))
+        []
+    """
+    if contract_prm.empty or price_periods.empty:
+        return []
+    contrats = pd.Series(pd.unique(price_periods['CONTRAT'].dropna()))
+    return sorted(contrats[~contrats.isin(contract_prm['CONTRAT'])].tolist(), key=str)
+
+
+@app.function(hide_code=True)
+def r15_schema(columns: Sequence[str], float32: bool = False) -> dict[str, str]:
+    """
+    Schéma déclaré des relevés R15 : type cible de chaque colonne de process_flux.
+
+    - EA* : 'float64' (ou 'float32')
+    - Date_Releve : 'datetime' (instant UTC, formats explicites : voir type_r15)
+    - Autoconsommation_Collective : 'Int8' (0 = ACC active)
+    - Identifiants et codes répétés (pdl, Id_Affaire, calendriers, statuts…) : 'category'
+    - Autres colonnes : 'string' (chaînes Arrow)
+
+    Examples:
+        >>> r15_schema(['pdl', 'Date_Releve', 'Autoconsommation_Collective', 'EA_Autoconsommee_HP', 'Id_Releve'])
+        {'pdl': 'category', 'Date_Releve': 'datetime', 'Autoconsommation_Collective': 'Int8', 'EA_Autoconsommee_HP': 'float64', 'Id_Releve': 'string'}
+    """
+    category_cols = {
+        'pdl', 'Id_Affaire', 'Id_Calendrier', 'Id_Calendrier_Distributeur', 'Ref_Situation_Contractuelle',
+        'Motif_Releve', 'Nature_Index', 'Statut_Releve', 'Type_Compteur', 'Unité',
+    }
+
+    def declared(col: str) -> str:
+        if col.startswith('EA'):
+            return 'float32' if float32 else 'float64'
+        if col == 'Date_Releve':
+            return 'datetime'
+        if col == 'Autoconsommation_Collective':
+            return 'Int8'
+        return 'category' if col in category_cols else 'string'
+
+    return {col: declared(col) for col in columns}
+
+
+@app.function(hide_code=True)
+def compact_r15(r15: pd.DataFrame, float32: bool = False) -> pd.DataFrame:
+    """
+    Applique une représentation mémoire compacte aux relevés R15.
+
+    - Autoconsommation_Collective : entier nullable Int8 (0 = ACC active)
+    - Identifiants et codes répétés (pdl, Id_Affaire, calendriers, statuts…) : category
+    - Autres colonnes texte : chaînes Arrow (string[pyarrow])
+    - Colonnes EA* en float32 si demandé (sinon float64)
+
+    Les types cibles sont ceux de r15_schema. La conversion est idempotente : elle peut
+    être réappliquée après une concaténation, qui ramène en object les catégories qui
+    diffèrent entre les morceaux.
+
+    Args:
+        r15 (pd.DataFrame): Relevés R15 typés
+        float32 (bool): Stocker les énergies en float32 (moitié moins de mémoire,
+            ~7 chiffres significatifs)
+
+    Returns:
+        pd.DataFrame: Le même DataFrame, converti en place
+
+    Examples:
+        >>> r15 = pd.DataFrame({'pdl': ['A', 'A', 'B'], 'Autoconsommation_Collective': ['0', '1', None]})
+        >>> compact_r15(r15).dtypes.astype(str).tolist()
+        ['category', 'Int8']
+    """
+    schema = r15_schema(r15.columns, float32)
+
+    if 'Autoconsommation_Collective' in r15.columns and r15['Autoconsommation_Collective'].dtype != 'Int8':
+        r15['Autoconsommation_Collective'] = pd.to_numeric(
+            r15['Autoconsommation_Collective'], errors='coerce'
+        ).astype('Int8')
+
+    for col, target in schema.items():
+        if target == 'category' and not isinstance(r15[col].dtype, pd.CategoricalDtype):
+            r15[col] = r15[col].astype('category')
+        elif r15[col].dtype == object:
+            r15[col] = r15[col].astype('string[pyarrow]')
+        elif target == 'float32' and r15[col].dtype == 'float64':
+            r15[col] = r15[col].astype('float32')
+
+    return r15
+
+
+@app.function(hide_code=True)
+def read_r15_parquet(path: Path) -> pd.DataFrame:
+    """
+    Relit un fichier Parquet de relevés R15 en conservant les chaînes Arrow.
+
+    compact_r15 est réappliqué pour les colonnes entièrement vides, que Parquet
+    stocke sans type et relit en object.
+    """
+    import pyarrow.parquet as pq
+
+    string_types = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+    return compact_r15(pq.read_table(path).to_pandas(types_mapper=string_types.get))
+
+
+@app.function(hide_code=True)
+def concat_r15(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatène des relevés R15 compacts sans repasser les catégories en object.
+
+    Les catégories de chaque colonne sont d'abord unifiées (celles du premier morceau
+    en tête, leurs codes inchangés) : le résultat reste compact sans réencoder les
+    valeurs, là où compact_r15 après pd.concat hacherait à nouveau chaque ligne.
+
+    Examples:
+        >>> a = compact_r15(pd.DataFrame({'pdl': ['A', 'B'], 'EA_HP': [1.0, 2.0]}))
+        >>> b = compact_r15(pd.DataFrame({'pdl': ['C'], 'EA_HP': [3.0]}))
+        >>> r15 = concat_r15([a, b])
+        >>> r15['pdl'].cat.categories.tolist(), r15['EA_HP'].tolist()
+        (['A', 'B', 'C'], [1.0, 2.0, 3.0])
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    category_cols = {
+        col for frame in frames for col in frame.columns if isinstance(frame[col].dtype, pd.CategoricalDtype)
+    }
+    dtypes = {}
+    for col in category_cols:
+        categories = pd.Index([])
+        for frame in frames:
+            if col in frame.columns:
+                values = frame[col]
+                values = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else pd.Index(values.dropna().unique())
+                categories = categories.append(values.difference(categories, sort=False))
+        dtypes[col] = pd.CategoricalDtype(categories)
+
+    unified = []
+    for frame in frames:
+        # Copie superficielle : les morceaux d'origine (l'historique en mémoire) ne sont pas modifiés
+        frame = frame.copy(deep=False)
+        for col, dtype in dtypes.items():
+            if col in frame.columns and frame[col].dtype != dtype:
+                frame[col] = frame[col].astype(dtype)
+        unified.append(frame)
+    return compact_r15(pd.concat(unified, ignore_index=True))
+
+
+@app.function(hide_code=True)
+def atomic_write(path: Path, write: Callable[[Path], None]) -> None:
+    """
+    Écrit `path` via un fichier temporaire propre à l'appel, puis le renomme.
+
+    Le renommage est atomique : un lecteur voit l'ancien fichier ou le nouveau, jamais
+    un fichier partiel. Deux sessions qui reconstruisent le même cache en même temps
+    n'écrivent pas dans le même fichier temporaire, et la dernière à renommer l'emporte ;
+    une session qui a projeté l'ancien fichier en mémoire le garde jusqu'à sa fermeture.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex[:12]}.tmp')
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+@app.function(hide_code=True)
+@contextlib.contextmanager
+def file_lock(path: Path):
+    """
+    Verrou exclusif entre sessions et processus sur `path`, le temps d'un bloc with.
+
+    Protège la lecture-modification-écriture d'un manifeste partagé : sans lui, deux
+    sessions qui le relisent en même temps publient chacune leur version et la dernière
+    efface les entrées de l'autre. flock sous POSIX, msvcrt.locking sous Windows ; le
+    verrou est libéré à la fermeture du fichier, même si le processus s'interrompt.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK abandonne après 10 s d'attente : on réessaie
+                    continue
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@app.function(hide_code=True)
+def write_arrow_cache(df: pd.DataFrame, path: Path) -> None:
+    """
+    Écrit un DataFrame en Arrow IPC non compressé, projetable en mémoire (read_arrow_cache).
+
+    Les NaN des colonnes flottantes et les NaT des dates sont stockés comme valeurs et
+    non comme valeurs nulles : pandas peut alors relire ces colonnes directement dans
+    les pages du fichier, sans copie.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if values.dtype.kind == 'f':
+            table = table.set_column(i, table.field(i), pa.array(values.to_numpy(), from_pandas=False))
+        elif isinstance(values.dtype, pd.DatetimeTZDtype):
+            instants = values.dt.tz_convert('UTC').to_numpy(dtype='datetime64[ns]').view('i8')
+            table = table.set_column(i, table.field(i), pa.array(instants).cast(table.field(i).type))
+
+    def write(tmp_path):
+        with pa.OSFile(str(tmp_path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    atomic_write(path, write)
+
+
+@app.function(hide_code=True)
+def read_arrow_cache(path: Path) -> pd.DataFrame:
+    """
+    Relit un fichier écrit par write_arrow_cache en le projetant en mémoire (mmap).
+
+    Les colonnes numériques, les dates et les chaînes Arrow restent adossées aux pages
+    du fichier, partagées par le cache du système entre toutes les sessions qui lisent
+    le même fichier ; elles sont en lecture seule.
+
+    Examples:
+        >>> import tempfile
+        >>> df = pd.DataFrame({
+        ...     'd': pd.to_datetime(['2023-01-01', None], utc=True),
+        ...     'x': [1.5, np.nan],
+        ...     'pdl': pd.Categorical(['P1', 'P2']),
+        ... })
+        >>> path = Path(tempfile.mkdtemp()) / 'cache.arrow'
+        >>> write_arrow_cache(df, path)
+        >>> read_arrow_cache(path).equals(df)
+        True
+    """
+    string_types = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+    table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=string_types.get)
+
+
+@app.function(hide_code=True)
+def memory_report(df: pd.DataFrame, sample_size: int = 10_000) -> pd.DataFrame:
+    """
+    Mémoire occupée par colonne, comparée à une représentation texte/float64.
+
+    La représentation de référence (object pour le texte, float64 pour les nombres,
+    comme en sortie brute de process_flux) est estimée sur un échantillon.
+
+    Returns:
+        pd.DataFrame: colonne, dtype, memoire_mo (actuelle), memoire_objet_mo (estimée)
+    """
+    sample = df.sample(min(len(df), sample_size), random_state=0) if len(df) else df
+    legacy = sample.astype({
+        col: 'float64' if pd.api.types.is_numeric_dtype(dtype) else object
+        for col, dtype in sample.dtypes.items()
+        if not pd.api.types.is_datetime64_any_dtype(dtype)
+    })
+    scale = len(df) / len(sample) if len(sample) else 0
+    return pd.DataFrame({
+        'colonne': df.columns,
+        'dtype': df.dtypes.astype(str).to_numpy(),
+        'memoire_mo': df.memory_usage(deep=True, index=False).to_numpy() / 1e6,
+        'memoire_objet_mo': legacy.memory_usage(deep=True, index=False).to_numpy() * scale / 1e6,
+    })
+
+
+@app.function(hide_code=True)
+def frame_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Résumé d'un DataFrame : une ligne par colonne avec dtype, mémoire et, pour les
+    dates, la plus ancienne et la plus récente.
+
+    La mémoire est l'occupation superficielle (memory_usage sans deep), en O(colonnes) :
+    les chaînes d'une colonne object n'y sont pas comptées. Les plages de dates
+    parcourent en revanche chaque colonne de dates (O(lignes)) ; paged_table ne les
+    calcule qu'à l'ouverture du résumé.
+
+    Examples:
+        >>> df = pd.DataFrame({'d': pd.to_datetime(['2023-01-02', '2023-01-01']), 'x': [1.0, 2.0]})
+        >>> frame_summary(df)[['colonne', 'dtype', 'min', 'max']].astype(str).values.tolist()
+        [['d', 'datetime64[ns]', '2023-01-01', '2023-01-02'], ['x', 'float64', 'NaT', 'NaT']]
+    """
+    dates = df.select_dtypes(include=['datetime', 'datetimetz'])
+    return pd.DataFrame({
+        'colonne': df.columns,
+        'dtype': df.dtypes.astype(str).to_numpy(),
+        'memoire_mo': (df.memory_usage(index=False).to_numpy() / 1e6).round(2),
+        'min': [dates[col].min() if col in dates else None for col in df.columns],
+        'max': [dates[col].max() if col in dates else None for col in df.columns],
+    })
+
+
+@app.function(hide_code=True)
+def paged_table(df: pd.DataFrame, title: str, page_size: int = 25):
+    """
+    Affichage d'un grand DataFrame : résumé, puis table paginée côté serveur.
+
+    Seule la première page est envoyée au navigateur ; les pages suivantes, le tri et
+    les filtres sont calculés par le noyau à la demande. Les résumés de colonnes
+    (statistiques sur jusqu'à un million de lignes par colonne) et le téléchargement
+    intégral sont désactivés, et le résumé par colonne (frame_summary, qui parcourt
+    les dates) n'est calculé qu'à l'ouverture de son panneau : le coût d'affichage ne
+    dépend plus de la taille du tableau.
+    """
+    memoire_mo = df.memory_usage(index=False).sum() / 1e6
+    return mo.vstack([
+        mo.md(
+            f"**{title}** : {len(df):,} lignes × {df.shape[1]} colonnes, "
+            f"{memoire_mo:,.1f} Mo".replace(',', ' ')
+        ),
+        mo.accordion({"Colonnes, types et plages de dates": lambda: frame_summary(df)}, lazy=True),
+        mo.ui.table(
+            df,
+            page_size=page_size,
+            selection=None,
+            show_column_summaries=False,
+            show_download=False,
+        ),
+    ])
+
+
+@app.function(hide_code=True)
+def type_r15(
+    r15: pd.DataFrame,
+    date_formats: Sequence[str] = ('%Y-%m-%dT%H:%M:%S%z', 'ISO8601'),
+) -> pd.DataFrame:
+    """
+    Convertit les colonnes brutes (texte) issues de process_flux en types exploitables.
+
+    Le schéma déclaré (r15_schema) est appliqué en une passe :
+
+    - Colonnes EA* : cast Arrow texte → float64, colonne par colonne ; une colonne
+      contenant des valeurs non numériques repasse par pd.to_numeric (valeurs
+      invalides en NaN)
+    - Date_Releve : chaque horodatage distinct n'est analysé qu'une fois, avec les
+      formats `date_formats` essayés dans l'ordre (sans inférence)
+    - Autoconsommation_Collective : cast en Int8
+
+    Le nombre de valeurs non vides rendues manquantes par la conversion est enregistré
+    par colonne dans `attrs['conversions']` (indicateur de qualité des données).
+
+    Args:
+        r15 (pd.DataFrame): Relevés R15 tels que renvoyés par electriflux
+        date_formats (Sequence[str]): Formats acceptés pour Date_Releve (voir
+            pd.to_datetime), du plus courant au plus permissif
+
+    Returns:
+        pd.DataFrame: Le même DataFrame, avec les colonnes EA* en numérique (valeurs
+            invalides en NaN), Date_Releve en datetime UTC et la représentation
+            compacte de compact_r15
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'Date_Releve': ['2023-01-01T00:00:00+01:00', '2023-07-01T00:00:00+02:00', 'inconnue'],
+        ...     'Autoconsommation_Collective': ['0', '1', None],
+        ...     'EA_Autoconsommee_HP': ['12', 'n/a', None],
+        ...     'EA_Alloproduite_HP': ['1', '2', '3'],
+        ... })
+        >>> typed = type_r15(r15)
+        >>> typed['Date_Releve'].dt.strftime('%Y-%m-%d %H:%M').tolist()[:2]
+        ['2022-12-31 23:00', '2023-06-30 22:00']
+        >>> typed.attrs['conversions']
+        {'EA_Autoconsommee_HP': 1, 'EA_Alloproduite_HP': 0, 'Date_Releve': 1, 'Autoconsommation_Collective': 0}
+    """
+    schema = r15_schema(r15.columns)
+    conversions = {}
+
+    def to_float(values: pd.Series) -> tuple[np.ndarray, int]:
+        """Valeurs en float64 et nombre de valeurs non vides rendues manquantes."""
+        try:
+            # Cast strict : réussit si toutes les valeurs sont numériques, rien n'est perdu
+            array = pa.array(values, type=pa.string(), from_pandas=True).cast(pa.float64())
+            return array.to_numpy(zero_copy_only=False), 0
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            converted = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64')
+            return converted, int(np.count_nonzero(values.notna().to_numpy() & np.isnan(converted)))
+
+    for col in [col for col, target in schema.items() if target.startswith('float')]:
+        if not pd.api.types.is_numeric_dtype(r15[col]):
+            r15[col], conversions[col] = to_float(r15[col])
+
+    if 'Date_Releve' in r15.columns and pd.api.types.is_datetime64_any_dtype(r15['Date_Releve']):
+        r15['Date_Releve'] = pd.to_datetime(r15['Date_Releve'], utc=True)
+    elif 'Date_Releve' in r15.columns:
+        codes, uniques = pd.factorize(r15['Date_Releve'])
+        instants = pd.Series(pd.NaT, index=range(len(uniques)), dtype='datetime64[ns, UTC]')
+        for date_format in date_formats:
+            todo = instants.isna().to_numpy()
+            if not todo.any():
+                break
+            instants[todo] = pd.to_datetime(uniques[todo], format=date_format, errors='coerce', utc=True)
+        dates = pd.DatetimeIndex(instants).take(codes, allow_fill=True, fill_value=pd.NaT)
+        r15['Date_Releve'] = dates
+        conversions['Date_Releve'] = int(np.count_nonzero((codes >= 0) & dates.isna()))
+
+    if 'Autoconsommation_Collective' in r15.columns and not pd.api.types.is_numeric_dtype(r15['Autoconsommation_Collective']):
+        flag, conversions['Autoconsommation_Collective'] = to_float(r15['Autoconsommation_Collective'])
+        r15['Autoconsommation_Collective'] = pd.array(flag, dtype='Float64').astype('Int8')
+
+    r15 = compact_r15(r15)
+    r15.attrs['conversions'] = conversions
+    return r15
+
+
+@app.function(hide_code=True)
+def r15_flux_config() -> dict:
+    """Configuration electriflux du flux R15_ACC (la même que celle utilisée par process_flux)."""
+    from electriflux import simple_reader
+
+    return simple_reader.load_flux_config('R15_ACC', Path(simple_reader.__file__).parent / 'simple_flux.yaml')
+
+
+@app.function(hide_code=True)
+def list_r15_files(folder: Path) -> list[Path]:
+    """Liste les fichiers de flux R15 d'un dossier, dans l'ordre où process_flux les lit."""
+    from electriflux.simple_reader import find_xml_files
+
+    return find_xml_files(Path(folder), r15_flux_config().get('file_regex'))
+
+
+@app.function(hide_code=True)
+def parse_r15_files(
+    files: list[Path],
+    max_workers: int = 1,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    by_file: bool = False,
+) -> pd.DataFrame:
+    """
+    Analyse une liste explicite de fichiers de flux R15 et renvoie les relevés typés.
+
+    Équivaut à type_r15(process_flux('R15_ACC', dossier)) restreint aux fichiers donnés.
+    Avec max_workers > 1, les fichiers sont répartis en lots contigus sur un pool de
+    processus ; les lots sont réassemblés dans l'ordre des fichiers, si bien que le
+    résultat est identique à l'analyse séquentielle.
+
+    Args:
+        files (list[Path]): Fichiers de flux à analyser, dans l'ordre de lecture
+        max_workers (int): Nombre de processus d'analyse (1 = séquentiel)
+        on_progress (Callable, optional): Appelée avec (fichiers analysés, total)
+            à chaque lot terminé
+        by_file (bool): Analyser chaque fichier séparément (un lot par fichier) et
+            compter ses relevés dans `attrs['lignes_par_fichier']`
+
+    Returns:
+        pd.DataFrame: Relevés R15 typés (voir type_r15), fichier après fichier
+    """
+    from electriflux.simple_reader import process_xml_files
+
+    config = r15_flux_config()
+    args = (config['row_level'], config['metadata_fields'], config['data_fields'], config['nested_fields'])
+
+    if by_file:
+        lots = [[path] for path in files]
+    elif max_workers <= 1 or len(files) <= 1:
+        df = process_xml_files(files, *args)
+        if on_progress:
+            on_progress(len(files), len(files))
+        return type_r15(df)
+    else:
+        # Plusieurs lots par processus pour équilibrer la charge et suivre la progression
+        nb_lots = min(len(files), max_workers * 4)
+        lots = [list(lot) for lot in np.array_split(np.array(files, dtype=object), nb_lots)]
+
+    chunks = [None] * len(lots)
+    done = 0
+    if max_workers <= 1 or len(lots) <= 1:
+        for i, lot in enumerate(lots):
+            chunks[i] = process_xml_files(lot, *args)
+            done += len(lot)
+            if on_progress:
+                on_progress(done, len(files))
+    else:
+        # 'spawn' : le noyau Marimo est multi-thread, fork n'y est pas sûr
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(process_xml_files, lot, *args): i for i, lot in enumerate(lots)}
+            for future in as_completed(futures):
+                i = futures[future]
+                chunks[i] = future.result()
+                done += len(lots[i])
+                if on_progress:
+                    on_progress(done, len(files))
+
+    # Une seule concaténation, dans l'ordre des fichiers, puis typage unique
+    counts = [len(chunk) for chunk in chunks]
+    chunks = [chunk for chunk in chunks if not chunk.empty]
+    df = type_r15(pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame())
+    if by_file:
+        df.attrs['lignes_par_fichier'] = counts
+    return df
+
+
+@app.function(hide_code=True)
+def fingerprint_flux_files(folder: Path, files: list[Path], previous: Optional[dict] = None) -> dict:
+    """
+    Calcule l'empreinte des fichiers de flux d'un dossier.
+
+    Chaque fichier est identifié par son chemin relatif, sa taille, sa date de
+    modification et le SHA-256 de son contenu. Le hash d'un fichier dont la taille et
+    la date de modification n'ont pas changé depuis `previous` est réutilisé sans
+    relire le fichier.
+
+    Args:
+        folder (Path): Dossier contenant les fichiers de flux
+        files (list[Path]): Fichiers de flux du dossier (voir list_r15_files)
+        previous (dict, optional): Empreinte précédente (même format que le retour)
+
+    Returns:
+        dict: {chemin_relatif: {'size': int, 'mtime_ns': int, 'sha256': str}}
+    """
+    previous = previous or {}
+
+    fingerprint = {}
+    for path in files:
+        rel = path.relative_to(folder).as_posix()
+        stat = path.stat()
+        known = previous.get(rel)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            sha256 = known['sha256']
+        else:
+            with open(path, 'rb') as f:
+                sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+        fingerprint[rel] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return fingerprint
+
+
+@app.function(hide_code=True)
+def acc_cache_dir(folder: Path, cache_dir: Optional[Path] = None) -> Path:
+    """
+    Renvoie le dossier de cache associé à un dossier de données (R15, journal des ventes).
+
+    Par défaut le cache est rangé à côté des données (`<dossier>/.acc_cache`). Si un
+    dossier de cache est fourni (ou via la variable d'environnement ACC_CACHE_DIR),
+    chaque dossier de données y dispose d'un sous-dossier dédié, nommé d'après son chemin.
+    """
+    folder = Path(folder).expanduser().resolve()
+    if cache_dir is None and os.environ.get('ACC_CACHE_DIR'):
+        cache_dir = Path(os.environ['ACC_CACHE_DIR'])
+    if cache_dir is None:
+        return folder / '.acc_cache'
+    key = hashlib.sha256(str(folder).encode()).hexdigest()[:16]
+    return Path(cache_dir).expanduser() / f'{folder.name}-{key}'
+
+
+@app.function(hide_code=True)
+def energy_cube_dir(folder: Path, cache_dir: Optional[Path] = None, incremental: bool = False) -> Path:
+    """Dossier du cube d'énergie persisté avec le cache R15 (complet ou incrémental)."""
+    cache = acc_cache_dir(Path(folder).expanduser(), cache_dir)
+    return (cache / 'r15_history' if incremental else cache) / 'energy_cube'
+
+
+@app.function(hide_code=True)
+def downsample_lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices des points retenus par Largest-Triangle-Three-Buckets.
+
+    Le premier et le dernier point sont conservés ; les points intermédiaires sont
+    répartis en `n_out - 2` paquets et, dans chaque paquet, on garde le point qui forme
+    le plus grand triangle avec le point retenu précédemment et la moyenne du paquet
+    suivant. Les pics et creux de la série survivent à la réduction, contrairement à
+    une moyenne par paquet.
+
+    Args:
+        x (np.ndarray): Abscisses croissantes (numériques)
+        y (np.ndarray): Ordonnées
+        n_out (int): Nombre de points à conserver
+
+    Returns:
+        np.ndarray: Indices croissants des points conservés (tous si n_out >= len(x))
+
+    Examples:
+        >>> x = np.arange(10.0)
+        >>> y = np.array([0, 1, 0, 9, 0, 1, 0, -7, 0, 1.0])
+        >>> downsample_lttb(x, y, 4).tolist()
+        [0, 3, 7, 9]
+        >>> len(downsample_lttb(x, y, 20))
+        10
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bornes = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    retenus = np.empty(n_out, dtype=np.int64)
+    retenus[0], retenus[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bornes[i], bornes[i + 1]
+        suivant = slice(hi, bornes[i + 2]) if i + 2 < len(bornes) else slice(n - 1, n)
+        moy_x, moy_y = x[suivant].mean(), y[suivant].mean()
+        aires = np.abs((x[a] - moy_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (moy_y - y[a]))
+        a = lo + int(np.argmax(aires))
+        retenus[i + 1] = a
+    return retenus
+
+
+@app.function(hide_code=True)
+def energy_flows(
+    energy_cube: 'EnergyCube',
+    debut: Optional[pd.Timestamp] = None,
+    fin: Optional[pd.Timestamp] = None,
+    pdl: Optional[str] = None,
+    max_points: int = 2_000,
+) -> pd.DataFrame:
+    """
+    Énergie autoconsommée et alloproduite par jour, réduite à `max_points` points au plus.
+
+    La série journalière est lue dans le cube (aucun relevé R15 n'est relu), les
+    colonnes EA_Autoconsommee_* et EA_Alloproduite_* sont sommées par flux, puis
+    chaque flux est réduit par LTTB. Le graphique reçoit donc au plus `max_points`
+    points quelle que soit la longueur de l'historique.
+
+    Returns:
+        pd.DataFrame: Format long (jour, flux, energie)
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'pdl': ['P1'] * 3,
+        ...     'Date_Releve': pd.date_range('2023-01-01 23:00', periods=3, freq='D', tz='UTC'),
+        ...     'Autoconsommation_Collective': [0, 0, 0],
+        ...     'EA_Autoconsommee_HP': [1.0, 2.0, 3.0],
+        ...     'EA_Alloproduite_HP': [4.0, 5.0, 6.0],
+        ... })
+        >>> flows = energy_flows(EnergyCube.from_r15(r15))
+        >>> flows.groupby('flux')['energie'].sum().to_dict()
+        {'Alloproduite': 15.0, 'Autoconsommée': 6.0}
+    """
+    daily = energy_cube.daily(debut, fin, pdl)
+    flux_cols = {
+        'Autoconsommée': [col for col in daily.columns if col.startswith('EA_Autoconsommee')],
+        'Alloproduite': [col for col in daily.columns if col.startswith('EA_Alloproduite')],
+    }
+    x = pd.DatetimeIndex(daily['jour']).as_unit('ns').asi8
+    series = []
+    for flux, cols in flux_cols.items():
+        if not cols:
+            continue
+        energie = daily[cols].sum(axis=1).to_numpy()
+        keep = downsample_lttb(x, energie, max_points // len(flux_cols))
+        series.append(pd.DataFrame({'jour': daily['jour'].to_numpy()[keep], 'flux': flux, 'energie': energie[keep]}))
+    if not series:
+        return pd.DataFrame({'jour': pd.Series(dtype=daily['jour'].dtype), 'flux': pd.Series(dtype=str), 'energie': pd.Series(dtype=float)})
+    return pd.concat(series, ignore_index=True)
+
+
+@app.function(hide_code=True)
+def price_bands(
+    price_periods: pd.DataFrame,
+    code_article: Optional[str] = None,
+    debut: Optional[pd.Timestamp] = None,
+    fin: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """
+    Bandes de prix à superposer aux graphiques : une par plage continue d'un même PUHT.
+
+    Les périodes de tous les contrats d'un article qui se chevauchent ou se touchent
+    à prix égal sont fusionnées, de sorte qu'une grille tarifaire commune donne une
+    bande par palier plutôt qu'une par contrat et par facture.
+
+    Returns:
+        pd.DataFrame: CODE_ARTICLE, PUHT, date_debut, date_fin, nb_contrats
+
+    Examples:
+        >>> periods = pd.DataFrame({
+        ...     'CONTRAT': ['C1', 'C2', 'C1'],
+        ...     'CODE_ARTICLE': ['CONSO_HP'] * 3,
+        ...     'PUHT': [0.2, 0.2, 0.25],
+        ...     'date_debut': pd.to_datetime(['2023-01-01', '2023-01-05', '2023-03-01'], utc=True),
+        ...     'date_fin': pd.to_datetime(['2023-02-28', '2023-03-01', '2023-06-30'], utc=True),
+        ... })
+        >>> price_bands(periods)[['PUHT', 'nb_contrats']].values.tolist()
+        [[0.2, 2.0], [0.25, 1.0]]
+    """
+    columns = ['CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'nb_contrats']
+    periods = price_periods.dropna(subset=['date_debut', 'date_fin'])
+    if code_article is not None:
+        periods = periods[periods['CODE_ARTICLE'] == code_article]
+    if debut is not None:
+        periods = periods[periods['date_fin'] >= debut].assign(date_debut=lambda d: d['date_debut'].clip(lower=debut))
+    if fin is not None:
+        periods = periods[periods['date_debut'] <= fin].assign(date_fin=lambda d: d['date_fin'].clip(upper=fin))
+    if periods.empty:
+        return pd.DataFrame(columns=columns)
+
+    periods = periods.sort_values(['CODE_ARTICLE', 'PUHT', 'date_debut'])
+    # Nouvelle bande quand l'article ou le prix change, ou quand le début dépasse la fin
+    # la plus tardive des périodes précédentes de la même bande
+    fin_max = periods.groupby(['CODE_ARTICLE', 'PUHT'])['date_fin'].cummax()
+    meme_prix = periods[['CODE_ARTICLE', 'PUHT']].eq(periods[['CODE_ARTICLE', 'PUHT']].shift()).all(axis=1)
+    nouvelle = ~meme_prix | (periods['date_debut'] > fin_max.shift())
+    bandes = periods.groupby(nouvelle.cumsum().to_numpy()).agg(
+        CODE_ARTICLE=('CODE_ARTICLE', 'first'),
+        PUHT=('PUHT', 'first'),
+        date_debut=('date_debut', 'min'),
+        date_fin=('date_fin', 'max'),
+        nb_contrats=('CONTRAT', 'nunique'),
+    )
+    return bandes.sort_values(['date_debut', 'CODE_ARTICLE']).reset_index(drop=True)[columns]
+
+
+@app.function(hide_code=True)
+def energy_flow_chart(
+    flows: pd.DataFrame,
+    bands: Optional[pd.DataFrame] = None,
+    titre: str = '',
+    zoom: bool = False,
+) -> 'alt.Chart':
+    """
+    Courbes autoconsommé / alloproduit, avec les bandes de prix en arrière-plan.
+
+    Avec zoom=True, le graphique porte une sélection d'intervalle sur les dates,
+    nommée 'zoom', pour piloter un graphique détaillé.
+    """
+    import altair as alt
+
+    lignes = alt.Chart(flows).mark_line(interpolate='monotone').encode(
+        x=alt.X('jour:T', title=None),
+        y=alt.Y('energie:Q', title='Énergie journalière'),
+        color=alt.Color('flux:N', title='Flux', scale=alt.Scale(domain=['Autoconsommée', 'Alloproduite'])),
+        tooltip=[alt.Tooltip('jour:T', title='Jour'), 'flux:N', alt.Tooltip('energie:Q', format=',.0f')],
+    )
+    if zoom:
+        lignes = lignes.add_params(alt.selection_interval(encodings=['x'], name='zoom'))
+    if bands is None or bands.empty:
+        return lignes.properties(title=titre, width='container', height=300)
+    fond = alt.Chart(bands).mark_rect(opacity=0.15).encode(
+        x='date_debut:T',
+        x2='date_fin:T',
+        color=alt.Color('PUHT:Q', title='PUHT', scale=alt.Scale(scheme='greys')),
+        tooltip=['CODE_ARTICLE:N', 'PUHT:Q', alt.Tooltip('date_debut:T', title='Début'),
+                 alt.Tooltip('date_fin:T', title='Fin'), alt.Tooltip('nb_contrats:Q', title='Contrats')],
+    )
+    return alt.layer(fond, lignes).resolve_scale(color='independent').properties(title=titre, width='container', height=300)
+
+
+@app.function(hide_code=True)
+def billed_energy_columns(code_article: str, value_cols: list[str]) -> list[str]:
+    """
+    Colonnes d'énergie facturées par un article CONSO.
+
+    L'énergie facturée est l'énergie autoconsommée (EA_Autoconsommee_*). Un article
+    qui désigne un poste (CONSO_HP → EA_Autoconsommee_HP) ne facture que ce poste ;
+    les autres (CONSO_BASE, ...) facturent tous les postes. Sans colonne
+    EA_Autoconsommee_*, toutes les colonnes d'énergie sont candidates.
+
+    Examples:
+        >>> cols = ['nb_lignes_r15', 'EA_Alloproduite_HP', 'EA_Autoconsommee_HP', 'EA_Autoconsommee_HC']
+        >>> billed_energy_columns('CONSO_HP', cols)
+        ['EA_Autoconsommee_HP']
+        >>> billed_energy_columns('CONSO_BASE', cols)
+        ['EA_Autoconsommee_HP', 'EA_Autoconsommee_HC']
+    """
+    energie = [col for col in value_cols if col != 'nb_lignes_r15']
+    candidates = [col for col in energie if col.startswith('EA_Autoconsommee')] or energie
+    poste = str(code_article).removeprefix('CONSO').strip('_')
+    return [col for col in candidates if poste and col.endswith(f'_{poste}')] or candidates
+
+
+@app.function(hide_code=True)
+def simulate_tariffs(
+    energy_cube: 'EnergyCube',
+    price_periods: pd.DataFrame,
+    grilles,
+    contract_prm: Optional[pd.DataFrame] = None,
+    debut: Optional[pd.Timestamp] = None,
+    fins: Sequence[Optional[pd.Timestamp]] = (None,),
+) -> pd.DataFrame:
+    """
+    Montants facturés par contrat pour K scénarios tarifaires évalués d'un coup.
+
+    Les énergies facturées de chaque période (voir billed_energy_columns) sont
+    obtenues une seule fois par date de régularisation, en un appel vectorisé au
+    cube. Les montants de tous les scénarios sont ensuite un produit diffusé
+    (K, P) prix × (K ou 1, P) énergies, sommé par contrat : des centaines de grilles
+    coûtent à peu près le temps d'une seule.
+
+    Args:
+        energy_cube (EnergyCube): Cube d'énergie du périmètre
+        price_periods (pd.DataFrame): Périodes issues de identify_price_periods
+        grilles: PUHT de chaque période par scénario : DataFrame aligné sur les
+            lignes de price_periods (une colonne par scénario), ou tableau (K, P) ou (P,)
+        contract_prm (pd.DataFrame, optional): Correspondance CONTRAT → pdl ; sans
+            elle, chaque période porte sur tout le périmètre
+        debut (pd.Timestamp, optional): Début ACC
+        fins: Dates de régularisation, une pour toutes les grilles ou une par grille
+
+    Returns:
+        pd.DataFrame: Une ligne par CONTRAT, une colonne de montants par scénario
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'pdl': ['P1', 'P1', 'P1'],
+        ...     'Date_Releve': pd.to_datetime(['2023-01-09 23:00', '2023-02-09 23:00', '2023-03-09 23:00'], utc=True),
+        ...     'Autoconsommation_Collective': [0, 0, 0],
+        ...     'EA_Autoconsommee_HP': [10.0, 20.0, 40.0],
+        ... })
+        >>> periods = pd.DataFrame({
+        ...     'CONTRAT': ['C1', 'C1'], 'CODE_ARTICLE': ['CONSO_HP'] * 2, 'PUHT': [0.1, 0.2],
+        ...     'date_debut': pd.to_datetime(['2023-01-01', '2023-02-01'], utc=True),
+        ...     'date_fin': pd.to_datetime(['2023-01-31', '2023-03-31'], utc=True),
+        ... })
+        >>> cube = EnergyCube.from_r15(r15)
+        >>> grilles = pd.DataFrame({'actuel': periods['PUHT'], 'hausse': periods['PUHT'] * 1.5})
+        >>> simulate_tariffs(cube, periods, grilles).round(2).values.tolist()
+        [[13.0, 19.5]]
+        >>> fins = pd.to_datetime(['2023-02-28', '2023-03-31'], utc=True)
+        >>> simulate_tariffs(cube, periods, periods['PUHT'], fins=fins).round(2).values.tolist()
+        [[5.0, 13.0]]
+    """
+    periods = price_periods.reset_index(drop=True)
+    if isinstance(grilles, pd.DataFrame):
+        noms = [str(nom) for nom in grilles.columns]
+        prix = grilles.to_numpy(dtype=np.float64).T
+    else:
+        prix = np.atleast_2d(np.asarray(grilles, dtype=np.float64))
+        noms = None
+    if prix.shape[1] != len(periods):
+        raise ValueError(f"Les grilles doivent donner un PUHT par période ({len(periods)}), pas {prix.shape[1]}")
+    nb_scenarios = max(len(prix), len(fins))
+    if {len(prix), len(fins)} - {1, nb_scenarios}:
+        raise ValueError(f"{len(prix)} grilles et {len(fins)} dates de fin : l'un des deux doit valoir 1")
+    if noms is None or len(noms) != nb_scenarios:
+        noms = [f'scenario_{k}' for k in range(nb_scenarios)]
+
+    # Énergie facturée par (date de fin, période) : colonnes de l'article de chaque période
+    totals = energy_cube.period_totals(periods, contract_prm, debut, fins)
+    article_codes, articles = pd.factorize(periods['CODE_ARTICLE'])
+    poids = np.array([
+        [col in billed_energy_columns(article, energy_cube.value_cols) for col in energy_cube.value_cols]
+        for article in articles
+    ], dtype=np.float64).reshape(len(articles), len(energy_cube.value_cols))
+    poids = np.vstack([poids, np.zeros(len(energy_cube.value_cols))])[article_codes]
+    energie = np.einsum('kpc,pc->kp', totals, poids)
+
+    # Tous les scénarios d'un coup : (K, P) × (K ou 1, P), puis somme par contrat
+    montants = prix * energie
+    contrat_codes, contrats = pd.factorize(periods['CONTRAT'], sort=True)
+    order = np.argsort(contrat_codes, kind='stable')
+    order = order[contrat_codes[order] >= 0]
+    if len(order) == 0:
+        return pd.DataFrame(columns=noms, index=pd.Index([], name='CONTRAT'))
+    starts = np.flatnonzero(np.diff(contrat_codes[order], prepend=-1))
+    par_contrat = np.add.reduceat(np.broadcast_to(montants, (nb_scenarios, len(periods)))[:, order], starts, axis=1)
+    return pd.DataFrame(par_contrat.T, index=pd.Index(contrats, name='CONTRAT'), columns=noms)
+
+
+@app.function(hide_code=True)
+def simulation_chart(totaux: pd.DataFrame, x: str, x_title: str, titre: str) -> 'alt.Chart':
+    """Montant total simulé (colonne montant_total) en fonction du paramètre `x` (encodage Altair)."""
+    import altair as alt
+
+    return alt.Chart(totaux).mark_line(point=True).encode(
+        x=alt.X(x, title=x_title),
+        y=alt.Y('montant_total:Q', title='Montant total'),
+    ).properties(title=titre, width=350, height=250)
+
+
+@app.function(hide_code=True)
+def load_r15_cached(
+    folder: Path,
+    cache_dir: Optional[Path] = None,
+    force: bool = False,
+    max_workers: int = 1,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[pd.DataFrame, bool]:
+    """
+    Charge les données R15 typées d'un dossier, via un cache Parquet persistant.
+
+    Le cache est valide tant que l'ensemble des fichiers de flux du dossier (taille,
+    date de modification, contenu) est identique à celui enregistré lors de sa
+    construction. Tout ajout, suppression ou modification d'un fichier le reconstruit.
+
+    Le cube d'énergie (voir EnergyCube) est construit à chaque reconstruction et écrit
+    dans energy_cube_dir(folder), ou construit au premier chargement s'il manque.
+
+    Les relevés sont aussi écrits en Arrow IPC (r15.arrow, dans l'ordre de R15Store),
+    relu par projection en mémoire : les sessions qui ouvrent le même dossier partagent
+    les mêmes pages au lieu d'en garder chacune une copie.
+
+    Args:
+        folder (Path): Dossier contenant les fichiers de flux R15
+        cache_dir (Path, optional): Dossier de cache (voir acc_cache_dir)
+        force (bool): Ignorer le cache existant et reconstruire
+        max_workers (int): Nombre de processus d'analyse (voir parse_r15_files)
+        on_progress (Callable, optional): Suivi de l'analyse (voir parse_r15_files)
+
+    Returns:
+        tuple[pd.DataFrame, bool]: Les relevés R15 typés, dans l'ordre de R15Store
+            (avec attrs['conversions'], voir type_r15), et True s'ils proviennent du
+            cache
+    """
+    status = r15_cache_status(folder, cache_dir)
+    cache = status['cache']
+
+    if not force and status['valide']:
+        if (cache / 'r15.arrow').exists():
+            r15 = compact_r15(read_arrow_cache(cache / 'r15.arrow'))
+        else:
+            # Cache sans copie Arrow (construit en flux, ou par une version précédente)
+            r15 = R15Store(read_r15_parquet(cache / 'r15.parquet')).frame
+            write_arrow_cache(r15, cache / 'r15.arrow')
+        if EnergyCube.read(cache / 'energy_cube') is None:
+            EnergyCube.from_r15(r15).write(cache / 'energy_cube')
+        r15.attrs['conversions'] = status['conversions']
+        return r15, True
+
+    r15 = R15Store(parse_r15_files(status['files'], max_workers, on_progress)).frame
+
+    # Écritures atomiques : un cache interrompu n'est jamais lu comme valide
+    cache.mkdir(parents=True, exist_ok=True)
+    atomic_write(cache / 'r15.parquet', lambda tmp_path: r15.to_parquet(tmp_path, index=False))
+    write_arrow_cache(r15, cache / 'r15.arrow')
+    # Le cube précède le manifeste : un manifeste valide implique un cube à jour
+    EnergyCube.from_r15(r15).write(cache / 'energy_cube')
+    status['publier'](r15.attrs.get('conversions'))
+
+    return r15, False
+
+
+@app.function(hide_code=True)
+def r15_cache_status(folder: Path, cache_dir: Optional[Path] = None) -> dict:
+    """
+    État du cache R15 Parquet d'un dossier (voir load_r15_cached), sans le relire.
+
+    Returns:
+        dict: cache (dossier), files (fichiers de flux), valide (le cache r15.parquet
+            correspond aux fichiers), conversions (valeurs rendues manquantes par
+            type_r15 lors de la construction du cache, par colonne), publier (écrit le
+            manifeste des fichiers actuels et les conversions données, à appeler une
+            fois r15.parquet et le cube à jour)
+    """
+    folder = Path(folder).expanduser()
+    if not folder.is_dir():
+        raise FileNotFoundError(f"Dossier R15 introuvable : {folder}")
+    cache = acc_cache_dir(folder, cache_dir)
+    data_path = cache / 'r15.parquet'
+    manifest_path = cache / 'r15_manifest.json'
+
+    # Version du format typé : à incrémenter quand type_r15 change
+    schema = 3
+
+    manifest = {}
+    if manifest_path.exists() and data_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get('schema') != schema:
+            manifest = {}
+
+    files = list_r15_files(folder)
+    fingerprint = fingerprint_flux_files(folder, files, manifest.get('files'))
+
+    def publier(conversions: Optional[dict] = None):
+        content = {'schema': schema, 'files': fingerprint, 'conversions': conversions or {}}
+        atomic_write(manifest_path, lambda tmp_path: tmp_path.write_text(json.dumps(content, indent=1)))
+
+    # Seuls le contenu et la taille comptent ; la date de modification sert à éviter de re-hasher
+    def contents(files):
+        return {rel: (f['size'], f['sha256']) for rel, f in (files or {}).items()}
+
+    valide = bool(manifest) and contents(manifest['files']) == contents(fingerprint)
+    conversions = manifest.get('conversions', {}) if valide else {}
+    if valide and manifest['files'] != fingerprint:
+        publier(conversions)
+    return {'cache': cache, 'files': files, 'valide': valide, 'conversions': conversions, 'publier': publier}
+
+
+@app.function(hide_code=True)
+def stream_r15_to_parquet(
+    files: list[Path],
+    path: Path,
+    files_per_chunk: int = 20,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[int, dict]:
+    """
+    Analyse les fichiers de flux R15 par lots et écrit les relevés typés dans un Parquet.
+
+    Chaque lot de `files_per_chunk` fichiers est analysé, typé (type_r15) puis écrit
+    dans un fichier partiel et libéré ; les parties sont ensuite recopiées une à une
+    dans `path`, sous un schéma commun (les colonnes absentes d'un lot sont nulles).
+    La mémoire occupée dépend de la taille d'un lot, pas de l'historique, et le
+    fichier relu par read_r15_parquet équivaut au résultat de parse_r15_files.
+
+    Returns:
+        tuple[int, dict]: Nombre de relevés écrits, et valeurs rendues manquantes par
+            type_r15 par colonne, cumulées sur les lots
+    """
+    import pyarrow.parquet as pq
+    from electriflux.simple_reader import process_xml_files
+
+    config = r15_flux_config()
+    args = (config['row_level'], config['metadata_fields'], config['data_fields'], config['nested_fields'])
+    path = Path(path)
+    parts_dir = path.with_name(path.name + '.parts')
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    parts_dir.mkdir(parents=True)
+
+    # Catégories en dictionnaire à index int32 : même type Arrow quel que soit le lot
+    def normalise(table):
+        return table.cast(pa.schema([
+            field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+            for field in table.schema
+        ]))
+
+    parts, conversions = [], {}
+    for start in range(0, len(files), files_per_chunk):
+        lot = files[start:start + files_per_chunk]
+        chunk = type_r15(process_xml_files(lot, *args))
+        for col, count in chunk.attrs['conversions'].items():
+            conversions[col] = conversions.get(col, 0) + count
+        if not chunk.empty:
+            parts.append(parts_dir / f'part-{len(parts):05d}.parquet')
+            pq.write_table(normalise(pa.Table.from_pandas(chunk, preserve_index=False)), parts[-1])
+        del chunk
+        if on_progress:
+            on_progress(start + len(lot), len(files))
+
+    nb_rows = 0
+
+    def write(tmp_path):
+        nonlocal nb_rows
+        if not parts:
+            pd.DataFrame().to_parquet(tmp_path, index=False)
+            return
+        schema = pa.unify_schemas([pq.read_schema(part).remove_metadata() for part in parts])
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for part in parts:
+                table = pq.read_table(part).replace_schema_metadata(None)
+                for field in schema:
+                    if field.name not in table.column_names:
+                        table = table.append_column(field, pa.nulls(len(table), field.type))
+                writer.write_table(table.select(schema.names).cast(schema))
+                nb_rows += len(table)
+
+    atomic_write(path, write)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    return nb_rows, conversions
+
+
+@app.function(hide_code=True)
+def r15_parquet_cached(
+    folder: Path,
+    cache_dir: Optional[Path] = None,
+    force: bool = False,
+    files_per_chunk: int = 20,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[Path, bool, dict]:
+    """
+    Cache R15 Parquet d'un dossier, reconstruit en flux au besoin, relevés non chargés.
+
+    Même cache que load_r15_cached ; une reconstruction passe par
+    stream_r15_to_parquet, dont la mémoire est bornée par la taille d'un lot. Le cube
+    d'énergie et la copie Arrow, qui demanderaient l'historique complet, ne sont pas
+    construits : ils le sont au prochain load_r15_cached.
+
+    Returns:
+        tuple[Path, bool, dict]: Le fichier r15.parquet, True si le cache était
+            valide, et les valeurs rendues manquantes par type_r15 par colonne
+            (attrs['conversions'] de load_r15_cached)
+    """
+    status = r15_cache_status(folder, cache_dir)
+    cache = status['cache']
+    if not force and status['valide']:
+        return cache / 'r15.parquet', True, status['conversions']
+
+    cache.mkdir(parents=True, exist_ok=True)
+    _, conversions = stream_r15_to_parquet(status['files'], cache / 'r15.parquet', files_per_chunk, on_progress)
+    # Cube et copie Arrow d'une version précédente des fichiers ne doivent pas survivre au manifeste
+    shutil.rmtree(cache / 'energy_cube', ignore_errors=True)
+    (cache / 'r15.arrow').unlink(missing_ok=True)
+    status['publier'](conversions)
+    return cache / 'r15.parquet', False, conversions
+
+
+@app.function(hide_code=True)
+def iter_r15_parquet(path: Path, columns: Optional[list[str]] = None, batch_size: int = 500_000):
+    """Relevés d'un Parquet R15 par morceaux de `batch_size` lignes (DataFrames typés)."""
+    import pyarrow.parquet as pq
+
+    string_types = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+    parquet = pq.ParquetFile(path)
+    columns = [col for col in columns if col in parquet.schema_arrow.names] if columns else None
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        yield compact_r15(batch.to_pandas(types_mapper=string_types.get))
+
+
+@app.function(hide_code=True)
+def aggregate_r15_parquet(
+    path: Path,
+    price_periods: pd.DataFrame,
+    contract_prm: Optional[pd.DataFrame] = None,
+    debut: Optional[pd.Timestamp] = None,
+    fin: Optional[pd.Timestamp] = None,
+    batch_size: int = 500_000,
+) -> pd.DataFrame:
+    """
+    aggregate_r15_by_period(filter_r15(r15, debut, fin), ...) en flux sur un Parquet R15.
+
+    Seules les colonnes utiles sont lues, par morceaux de `batch_size` lignes : chaque
+    morceau est filtré (relevés ACC de [debut, fin]) puis replié dans les totaux par
+    période (r15_period_totals), qui s'additionnent. La mémoire est bornée par la taille
+    d'un morceau. Les sommes sont identiques à l'agrégation en mémoire, à l'ordre des
+    additions flottantes près (exactes pour des énergies entières).
+
+    Examples:
+        >>> import tempfile
+        >>> r15 = pd.DataFrame({
+        ...     'pdl': ['P1', 'P2', 'P1', 'P1'],
+        ...     'Date_Releve': pd.to_datetime(['2023-01-10', '2023-02-10', '2023-03-10', '2023-01-05'], utc=True),
+        ...     'Autoconsommation_Collective': [0, 0, 0, 1],
+        ...     'EA_HP': [1.0, 2.0, 4.0, 8.0],
+        ... })
+        >>> periods = pd.DataFrame({
+        ...     'CONTRAT': ['C001', 'C001'], 'CODE_ARTICLE': ['CONSO_HP'] * 2, 'PUHT': [0.18, 0.20],
+        ...     'date_debut': pd.to_datetime(['2023-01-01', '2023-03-01'], utc=True),
+        ...     'date_fin': pd.to_datetime(['2023-02-28', '2023-03-31'], utc=True),
+        ...     'duree_jours': [59, 31],
+        ... })
+        >>> path = Path(tempfile.mkdtemp()) / 'r15.parquet'
+        >>> r15.to_parquet(path, index=False)
+        >>> aggregate_r15_parquet(path, periods, batch_size=2).equals(
+        ...     aggregate_r15_by_period(filter_r15(compact_r15(r15), r15['Date_Releve'].min(), r15['Date_Releve'].max()), periods))
+        True
+    """
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    numeric_cols = [
+        field.name for field in schema
+        if field.name != 'Autoconsommation_Collective'
+        and (pa.types.is_floating(field.type) or pa.types.is_int64(field.type))
+    ]
+    columns = ['pdl', 'Date_Releve', 'Autoconsommation_Collective', *numeric_cols]
+    debut = pd.Timestamp.min.tz_localize('UTC') if debut is None else debut
+    fin = pd.Timestamp.max.tz_localize('UTC') if fin is None else fin
+
+    totals = None
+    for chunk in iter_r15_parquet(path, columns, batch_size):
+        chunk_totals = r15_period_totals(filter_r15(chunk, debut, fin), price_periods, contract_prm)
+        totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+    if totals is None or price_periods.empty:
+        return pd.DataFrame()
+    return periods_with_totals(price_periods, totals.reindex(columns=['nb_lignes_r15', *numeric_cols]))
+
+
+@app.function(hide_code=True)
+def ingest_r15_incremental(
+    folder: Path,
+    cache_dir: Optional[Path] = None,
+    reset: bool = False,
+    max_workers: int = 1,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    history: Optional[pd.DataFrame] = None,
+    changes: Optional[dict] = None,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Ingestion incrémentale des flux R15 dans un historique colonnaire persistant.
+
+    Un manifeste conserve l'empreinte des fichiers déjà ingérés et, pour chacun, la
+    partie Parquet et la plage de lignes qui contiennent ses relevés. Seuls les
+    fichiers nouveaux ou modifiés sont analysés et typés, une seule fois ; leurs
+    relevés sont écrits dans une nouvelle partie, sans réécrire les précédentes.
+    L'ancienne plage d'un fichier modifié est marquée comme supprimée (tombstone) :
+    les relevés que sa nouvelle version ne contient plus quittent l'historique.
+
+    Les fichiers supprimés du dossier restent dans l'historique : celui-ci conserve
+    toutes les données déjà reçues.
+
+    Les parties portent un nom unique et le manifeste est relu puis réécrit sous
+    verrou (voir file_lock) : plusieurs sessions peuvent partager le même cache.
+
+    Le cube d'énergie de l'historique (voir EnergyCube) est mis à jour après chaque
+    ingestion de nouveaux fichiers, dans energy_cube_dir(folder, incremental=True) :
+    seuls les PRM dont les relevés ont changé sont ré-agrégés.
+
+    L'historique renvoyé porte dans `attrs['parties']` et `attrs['tombstones']` l'état
+    du manifeste qu'il reflète, et dans `attrs['conversions']` les valeurs rendues
+    manquantes par type_r15 depuis le début de l'historique. Repassé en `history` à
+    l'appel suivant (mode surveillance), il n'est ni relu ni retypé : seules les
+    parties et plages supprimées publiées depuis sont lues, et seuls les relevés des
+    PRM concernés sont comparés aux nouveaux pour le dédoublonnage. Un PRM dont un
+    relevé est supprimé sans être remplacé est relu depuis les parties.
+
+    Args:
+        folder (Path): Dossier contenant les fichiers de flux R15
+        cache_dir (Path, optional): Dossier de cache (voir acc_cache_dir)
+        reset (bool): Supprimer l'historique existant et tout ré-ingérer
+        max_workers (int): Nombre de processus d'analyse (voir parse_r15_files)
+        on_progress (Callable, optional): Suivi de l'analyse (voir parse_r15_files)
+        history (pd.DataFrame, optional): Historique renvoyé par un appel précédent
+            sur le même dossier (ignoré s'il ne porte pas attrs['parties'])
+        changes (dict, optional): Rempli lorsque `history` a été mis à jour sur place :
+            ajoutes (relevés ajoutés ou remplaçants), retires (relevés sortis de
+            l'historique) et nb_conserves (l'historique renvoyé commence par ses
+            nb_conserves premières lignes, dans leur ordre d'origine, suivies des
+            relevés ajoutés) ; laissé vide si l'historique a été relu en entier
+
+    Returns:
+        tuple[pd.DataFrame, int]: L'historique complet des relevés typés,
+            dédoublonné par (pdl, Date_Releve) en gardant le relevé ingéré le plus
+            récemment, et le nombre de fichiers analysés lors de cet appel
+    """
+    import pyarrow.parquet as pq
+
+    folder = Path(folder).expanduser()
+    if not folder.is_dir():
+        raise FileNotFoundError(f"Dossier R15 introuvable : {folder}")
+    history_dir = acc_cache_dir(folder, cache_dir) / 'r15_history'
+    manifest_path = history_dir / 'manifest.json'
+    # Hors de history_dir : une reconstruction (reset) ne supprime pas le verrou tenu
+    lock_path = history_dir.with_name('r15_history.lock')
+    keys = ['pdl', 'Date_Releve']
+
+    def read_manifest() -> dict:
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        return {'files': {}, 'parts': [], 'tombstones': {}, 'conversions': {}, **manifest}
+
+    def tombstoned(part: str, ranges: list) -> np.ndarray:
+        """Masque des lignes de la partie couvertes par les plages supprimées."""
+        rows = np.zeros(pq.read_metadata(history_dir / part).num_rows, dtype=bool)
+        for start, stop in ranges:
+            rows[start:stop] = True
+        return rows
+
+    def read_part(part: str, pdls=None) -> pd.DataFrame:
+        """Relevés encore valides d'une partie, éventuellement limités à quelques PRM."""
+        df = read_r15_parquet(history_dir / part)
+        keep = ~tombstoned(part, manifest['tombstones'].get(part, []))
+        if pdls is not None:
+            keep &= df['pdl'].isin(pdls).to_numpy()
+        return df if keep.all() else df[keep].reset_index(drop=True)
+
+    def removed_keys(ranges: dict) -> pd.DataFrame:
+        """Clés (pdl, Date_Releve) des plages supprimées, partie par partie."""
+        return pd.concat(
+            [pd.read_parquet(history_dir / part, columns=keys)[tombstoned(part, part_ranges)] for part, part_ranges in ranges.items()]
+            or [pd.DataFrame(columns=keys)],
+            ignore_index=True,
+        )
+
+    def dedup(df: pd.DataFrame) -> pd.DataFrame:
+        return df if df.empty else df.drop_duplicates(subset=keys, keep='last').reset_index(drop=True)
+
+    def overlap(df: pd.DataFrame, other: pd.DataFrame) -> np.ndarray:
+        """Lignes de df dont la clé figure dans other ; seuls les PRM de other sont comparés."""
+        def key_index(frame):
+            return pd.MultiIndex.from_arrays([
+                frame['pdl'].astype(str).to_numpy(), pd.DatetimeIndex(frame['Date_Releve']).as_unit('ns').asi8,
+            ])
+
+        mask = df['pdl'].isin(other['pdl'].astype(str).unique()).to_numpy()
+        candidates = np.flatnonzero(mask)
+        if len(candidates):
+            mask[candidates] = key_index(df.iloc[candidates]).isin(key_index(other))
+        return mask
+
+    if reset:
+        with file_lock(lock_path):
+            shutil.rmtree(history_dir, ignore_errors=True)
+    manifest = read_manifest()
+
+    # Delta : fichiers absents du manifeste ou dont le contenu a changé
+    files = list_r15_files(folder)
+    fingerprint = fingerprint_flux_files(folder, files, manifest['files'])
+    new_files = [
+        path for path in files
+        if (rel := path.relative_to(folder).as_posix()) not in manifest['files']
+        or manifest['files'][rel]['sha256'] != fingerprint[rel]['sha256']
+    ]
+
+    touched_pdls, cube = [], None
+    if new_files:
+        # Typage unique du delta, avant écriture : les parties sont déjà typées
+        delta = parse_r15_files(new_files, max_workers, on_progress, by_file=True)
+        bounds = np.cumsum([0, *delta.attrs['lignes_par_fichier']]).tolist()
+        history_dir.mkdir(parents=True, exist_ok=True)
+        # Nom unique : deux sessions qui ingèrent en même temps n'écrivent pas la même partie
+        part = f'part-{uuid.uuid4().hex}.parquet' if not delta.empty else None
+        if part:
+            atomic_write(history_dir / part, lambda tmp_path: delta.to_parquet(tmp_path, index=False))
+        cube = EnergyCube.read(history_dir / 'energy_cube')
+        seen = (manifest['parts'], manifest['tombstones'])
+
+        stale = {}
+        with file_lock(lock_path):
+            # Relu sous verrou : une autre session a pu publier depuis la première lecture
+            manifest = read_manifest()
+            if (manifest['parts'], manifest['tombstones']) != seen:
+                # Le cube lu ne reflète pas ses ajouts : il sera reconstruit
+                cube = None
+            if part:
+                manifest['parts'].append(part)
+            for i, path in enumerate(new_files):
+                rel = path.relative_to(folder).as_posix()
+                previous = manifest['files'].get(rel, {})
+                if previous.get('part'):
+                    # Ancienne version du fichier : sa plage est retirée de l'historique
+                    manifest['tombstones'].setdefault(previous['part'], []).append(previous['lignes'])
+                    stale.setdefault(previous['part'], []).append(previous['lignes'])
+                start, stop = bounds[i], bounds[i + 1]
+                manifest['files'][rel] = {**fingerprint[rel], 'part': part if stop > start else None, 'lignes': [start, stop]}
+            for col, count in delta.attrs.get('conversions', {}).items():
+                manifest['conversions'][col] = manifest['conversions'].get(col, 0) + count
+
+            # Le cube périmé est retiré avant la publication du manifeste qui l'invalide
+            shutil.rmtree(history_dir / 'energy_cube', ignore_errors=True)
+            # Le manifeste n'est publié qu'après l'écriture de la partie qu'il référence
+            atomic_write(manifest_path, lambda tmp_path: tmp_path.write_text(json.dumps(manifest, indent=1)))
+
+        touched_pdls = [
+            *(delta['pdl'].astype(str).unique() if 'pdl' in delta.columns else []),
+            *removed_keys(stale)['pdl'].astype(str).unique(),
+        ]
+
+    if not manifest['parts']:
+        return pd.DataFrame(), len(new_files)
+
+    covered = history.attrs.get('parties') if history is not None and not reset and 'pdl' in history.columns else None
+    if covered is None or not set(covered) <= set(manifest['parts']):
+        # Premier chargement : toutes les parties, dédoublonnées en une fois
+        history = dedup(concat_r15([read_part(part) for part in manifest['parts']]))
+    else:
+        # Historique déjà en mémoire : parties publiées et plages supprimées depuis
+        added = dedup(concat_r15([read_part(part) for part in manifest['parts'] if part not in covered]))
+        applied = history.attrs.get('tombstones', {})
+        removed = removed_keys({
+            part: [r for r in manifest['tombstones'].get(part, []) if r not in applied.get(part, [])]
+            for part in covered if len(manifest['tombstones'].get(part, [])) > len(applied.get(part, []))
+        })
+        # Relevés supprimés sans remplaçant : leurs PRM sont relus depuis les parties
+        orphans = removed if added.empty else removed[~overlap(removed, added)]
+        retired = []
+        if not orphans.empty:
+            reload = orphans['pdl'].astype(str).unique()
+            dropped = history['pdl'].isin(reload).to_numpy()
+            retired.append(history[dropped])
+            history = history[~dropped]
+            added = concat_r15([
+                added[~added['pdl'].isin(reload).to_numpy()] if not added.empty else added,
+                dedup(concat_r15([read_part(part, reload) for part in manifest['parts']])),
+            ])
+        nb_kept = len(history)
+        if not added.empty:
+            replaced = overlap(history, added)
+            if replaced.any():
+                retired.append(history[replaced])
+                history = history[~replaced]
+            nb_kept = len(history)
+            history = concat_r15([history, added])
+        if changes is not None:
+            changes.update(ajoutes=added, retires=concat_r15(retired), nb_conserves=nb_kept)
+
+    history.attrs['parties'] = list(manifest['parts'])
+    history.attrs['tombstones'] = {part: list(ranges) for part, ranges in manifest['tombstones'].items()}
+    history.attrs['conversions'] = manifest.get('conversions', {})
+    if EnergyCube.read(history_dir / 'energy_cube') is None:
+        # Cube précédent mis à jour pour les seuls PRM touchés, sinon reconstruit
+        cube = cube.update(history, touched_pdls) if cube is not None else EnergyCube.from_r15(history)
+        cube.write(history_dir / 'energy_cube')
+    return history, len(new_files)
+
+
+@app.function(hide_code=True)
+def load_journal_ventes(
+    path: Path,
+    cache_dir: Optional[Path] = None,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> tuple[pd.DataFrame, bool]:
+    """
+    Charge le journal des ventes détaillés (Excel) avec un cache sur disque.
+
+    La lecture utilise le moteur calamine lorsque python-calamine est installé (bien
+    plus rapide qu'openpyxl), sinon le moteur par défaut de pandas. Seules les colonnes
+    utilisées par l'analyse sont lues (`usecols`) : les colonnes de référence (CONTRAT,
+    CODE_ARTICLE, PUHT, DATEFACT, PÉRIODE, PDS_CONTRAT) et les colonnes numériques,
+    sommées lors du groupement, repérées sur les premières lignes du fichier puis
+    confirmées après lecture. DATEFACT est converti en datetime UTC et PUHT en
+    numérique (valeurs invalides en NaN).
+
+    Le résultat est enregistré à côté du fichier (voir acc_cache_dir), en Arrow IPC
+    relu par projection en mémoire (voir read_arrow_cache), sous un nom dérivé du
+    SHA-256 de son contenu : un fichier modifié est relu automatiquement.
+
+    Args:
+        path (Path): Fichier Excel du journal des ventes
+        cache_dir (Path, optional): Dossier de cache (voir acc_cache_dir)
+        executor (ProcessPoolExecutor, optional): Pool dans lequel lire le fichier
+            Excel, pour que la lecture ne dispute pas le GIL aux autres chargements
+
+    Returns:
+        tuple[pd.DataFrame, bool]: Le journal typé, et True s'il provient du cache
+    """
+    path = Path(path).expanduser()
+    with open(path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    cache = acc_cache_dir(path.parent, cache_dir)
+    data_path = cache / f'journal_{path.stem}_{sha256[:16]}.arrow'
+
+    if data_path.exists():
+        return read_arrow_cache(data_path), True
+
+    engine = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+    def read_excel(**kwargs) -> pd.DataFrame:
+        if executor is not None:
+            return executor.submit(pd.read_excel, path, engine=engine, **kwargs).result()
+        return pd.read_excel(path, engine=engine, **kwargs)
+
+    # Projection : colonnes de référence et colonnes numériques
+    reference_cols = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT', 'PÉRIODE', 'PDS_CONTRAT']
+
+    def projection(df: pd.DataFrame) -> list:
+        return [col for col in df.columns if col in reference_cols or df[col].dtype in ['int64', 'float64']]
+
+    # Colonnes repérées sur un échantillon et lues seules ; une colonne numérique sur
+    # l'échantillon mais pas sur tout le fichier est retirée après lecture
+    journal = read_excel(usecols=projection(read_excel(nrows=1000)))
+    journal = journal[projection(journal)]
+
+    # Convertir DATEFACT en format date avec UTC (même approche que R15)
+    if 'DATEFACT' in journal.columns:
+        journal['DATEFACT'] = pd.to_datetime(journal['DATEFACT'], errors='coerce', utc=True)
+    if 'PUHT' in journal.columns:
+        journal['PUHT'] = pd.to_numeric(journal['PUHT'], errors='coerce')
+
+    # Caches périmés de ce journal seulement : le préfixe seul couvrirait aussi
+    # d'autres journaux (ventes.xlsx et ventes_2024.xlsx)
+    stale_name = re.compile(rf'journal_{re.escape(path.stem)}_[0-9a-f]{{16}}\.(parquet|arrow)')
+    cache.mkdir(parents=True, exist_ok=True)
+    for stale in cache.iterdir():
+        if stale_name.fullmatch(stale.name):
+            stale.unlink(missing_ok=True)
+    try:
+        write_arrow_cache(journal, data_path)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        # Colonnes de types mixtes non sérialisables : le journal reste utilisable sans cache
+        warnings.warn(f"Journal des ventes non mis en cache ({path.name}) : {e}", stacklevel=2)
+
+    return journal, False
+
+
+@app.function(hide_code=True)
+def detect_debut_acc(r15: pd.DataFrame) -> pd.Timestamp:
+    """Date de début de l'ACC : premier relevé avec Autoconsommation_Collective = 0."""
+    return r15.loc[r15['Autoconsommation_Collective'].eq(0).fillna(False), 'Date_Releve'].min()
+
+
+@app.function(hide_code=True)
+def filter_r15(r15: pd.DataFrame, debut_acc: pd.Timestamp, date_regularisation: pd.Timestamp) -> pd.DataFrame:
+    """
+    Relevés ACC (flag 0) entre debut_acc et date_regularisation, bornes incluses.
+
+    La sélection n'est pas recopiée une seconde fois : le résultat ne doit pas être
+    modifié en place.
+    """
+    return r15[
+        (r15['Date_Releve'] >= debut_acc) &
+        (r15['Date_Releve'] <= date_regularisation) &
+        r15['Autoconsommation_Collective'].eq(0).fillna(False)
+    ]
+
+
+@app.class_definition(hide_code=True)
+class R15Store:
+    """
+    Relevés R15 triés par date et partitionnés par flag ACC, découpables en O(log n).
+
+    Les relevés sont triés une seule fois en trois blocs contigus : relevés hors ACC,
+    relevés ACC (flag 0), chacun trié par Date_Releve, puis relevés sans date. Une plage
+    [start, end] est localisée par recherche dichotomique dans le bloc voulu et renvoyée
+    comme vue (iloc) sur le tableau trié, sans copie : son coût dépend de la taille du
+    résultat, pas de l'historique.
+
+    Attributes:
+        frame (pd.DataFrame): Tous les relevés, dans l'ordre des blocs décrit ci-dessus
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'Date_Releve': pd.to_datetime(['2023-03-01', '2023-01-01', '2023-02-01', None], utc=True),
+        ...     'Autoconsommation_Collective': pd.array([0, 1, 0, 0], dtype='Int8'),
+        ... })
+        >>> store = R15Store(r15)
+        >>> str(store.debut_acc.date())
+        '2023-02-01'
+        >>> len(store.slice(pd.Timestamp('2023-01-01', tz='UTC'), pd.Timestamp('2023-02-28', tz='UTC')))
+        1
+    """
+
+    def __init__(self, r15: pd.DataFrame, sorted_prefix: int = 0):
+        """
+        Trie les relevés ; les `sorted_prefix` premières lignes, déjà dans l'ordre des
+        blocs (frame d'un R15Store précédent), ne sont pas retriées : seules les lignes
+        suivantes le sont, puis insérées par recherche dichotomique.
+        """
+        dates = r15['Date_Releve']
+        is_acc = r15['Autoconsommation_Collective'].eq(0).fillna(False).to_numpy(dtype=bool)
+        undated = dates.isna().to_numpy()
+
+        # Bloc 0 : hors ACC, bloc 1 : ACC, bloc 2 : sans date ; tri stable par date dans chaque bloc
+        block = np.where(undated, 2, is_acc.astype(np.int8))
+        instants = dates.to_numpy(dtype='datetime64[ns]', na_value=np.datetime64(0, 'ns'))
+        if sorted_prefix:
+            order = self._merge_order(block, instants, sorted_prefix)
+        else:
+            order = np.lexsort((instants, block))
+        if (np.diff(order) == 1).all() and r15.index.equals(pd.RangeIndex(len(r15))):
+            # Déjà dans l'ordre des blocs (cache Arrow) : aucune copie, les colonnes
+            # restent adossées au fichier projeté en mémoire
+            self.frame = r15
+        else:
+            self.frame = r15.take(order).reset_index(drop=True)
+
+        counts = np.bincount(block, minlength=3)
+        self._bounds = {False: (0, counts[0]), True: (counts[0], counts[0] + counts[1])}
+        self._dates = pd.DatetimeIndex(self.frame['Date_Releve'])
+
+    @staticmethod
+    def _merge_order(block: np.ndarray, instants: np.ndarray, nb_sorted: int) -> np.ndarray:
+        """Ordre des blocs quand les nb_sorted premières lignes y sont déjà."""
+        tail = nb_sorted + np.lexsort((instants[nb_sorted:], block[nb_sorted:]))
+        # Position d'insertion de chaque nouvelle ligne : après les lignes triées de son
+        # bloc de date inférieure ou égale (les ajouts suivent, comme dans un tri stable)
+        head_bounds = np.concatenate([[0], np.cumsum(np.bincount(block[:nb_sorted], minlength=3))])
+        positions = np.empty(len(tail), dtype=np.int64)
+        tail_bounds = np.concatenate([[0], np.cumsum(np.bincount(block[tail], minlength=3))])
+        for b in range(3):
+            lo, hi = head_bounds[b], head_bounds[b + 1]
+            rows = slice(tail_bounds[b], tail_bounds[b + 1])
+            positions[rows] = lo + np.searchsorted(instants[lo:hi], instants[tail[rows]], side='right')
+
+        order = np.empty(len(block), dtype=np.int64)
+        order[positions + np.arange(len(tail))] = tail
+        head = np.arange(nb_sorted)
+        order[head + np.searchsorted(positions, head, side='right')] = head
+        return order
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def slice(self, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None, acc: bool = True) -> pd.DataFrame:
+        """Vue sur les relevés ACC (ou hors ACC) dont Date_Releve est dans [start, end]."""
+        base, stop = self._bounds[acc]
+        dates = self._dates[base:stop]
+        lo = base + (dates.searchsorted(start, side='left') if start is not None else 0)
+        hi = base + (dates.searchsorted(end, side='right') if end is not None else len(dates))
+        return self.frame.iloc[lo:max(lo, hi)]
+
+    @property
+    def debut_acc(self) -> pd.Timestamp:
+        """Date du premier relevé ACC (NaT s'il n'y en a aucun)."""
+        lo, hi = self._bounds[True]
+        return self._dates[lo] if hi > lo else pd.NaT
+
+
+@app.class_definition(hide_code=True)
+class EnergyCube:
+    """
+    Cube d'énergie ACC pré-agrégé par PRM × jour, avec sommes cumulées.
+
+    Construit une fois à l'ingestion et persisté avec le cache R15, il répond à toute
+    plage de dates par deux recherches dichotomiques et une soustraction de sommes
+    cumulées : déplacer la date de régularisation, tracer les flux d'énergie ou simuler
+    des grilles tarifaires ne relit plus les relevés.
+
+    Seuls les relevés ACC (Autoconsommation_Collective == 0) datés sont agrégés. Les
+    jours sont calendaires (Europe/Paris). Un jour est compté dans une plage lorsque
+    tous ses relevés y tombent (premier_releve / dernier_releve) : avec au plus un
+    relevé par PRM et par jour, le résultat est celui du filtrage des relevés R15 ;
+    sinon, un jour coupé par une borne est écarté en entier. r15_by_period est donc
+    calculé sur les relevés eux-mêmes (aggregate_r15_by_period), le cube servant aux
+    graphiques, aux résumés et aux simulations.
+
+    Attributes:
+        jour (pd.DataFrame): Une ligne par (pdl, jour) : premier_releve, dernier_releve,
+            nb_lignes_r15, sommes des colonnes numériques et leurs cumuls par PRM (cumul_*)
+        jour_total (pd.DataFrame): Même structure par jour, tous PRM confondus (pdl = '*')
+
+    Examples:
+        >>> r15 = pd.DataFrame({
+        ...     'pdl': ['P1', 'P1', 'P2', 'P1'],
+        ...     'Date_Releve': pd.to_datetime(['2023-01-09 23:00', '2023-01-10 23:00', '2023-01-10 23:00', '2023-02-10 23:00'], utc=True),
+        ...     'Autoconsommation_Collective': [1, 0, 0, 0],
+        ...     'EA_HP': [8.0, 1.0, 2.0, 4.0],
+        ... })
+        >>> cube = EnergyCube.from_r15(r15)
+        >>> len(cube.jour), len(cube.jour_total)
+        (3, 2)
+        >>> cube.total(pd.Timestamp('2023-01-01', tz='UTC'), pd.Timestamp('2023-01-31', tz='UTC')).tolist()
+        [2.0, 3.0]
+        >>> cube.total(pdl='P1').tolist()
+        [2.0, 5.0]
+        >>> cube.daily(pdl='P1')['EA_HP'].tolist()
+        [1.0, 4.0]
+        >>> r15.loc[len(r15)] = ['P2', pd.Timestamp('2023-02-10 23:00', tz='UTC'), 0, 16.0]
+        >>> cube.update(r15, ['P2']).total(pdl='P2').tolist()
+        [2.0, 18.0]
+    """
+
+    key_cols = ['premier_releve', 'dernier_releve']
+
+    def __init__(self, jour: pd.DataFrame):
+        self.jour = jour
+        self.value_cols = [
+            col for col in jour.columns
+            if col not in ['pdl', 'jour', *self.key_cols] and not col.startswith('cumul_')
+        ]
+        self.jour_total = self._rollup(jour.assign(pdl='*'), ['pdl', 'jour'], self.value_cols)
+        # Index de recherche : par PRM, et tous PRM confondus
+        self._par_prm = self._index(jour)
+        self._global = self._index(self.jour_total)
+
+    @classmethod
+    def from_r15(cls, r15: pd.DataFrame) -> 'EnergyCube':
+        """Agrège les relevés R15 typés en cube journalier."""
+        numeric_cols = r15.select_dtypes(include=['float64', 'float32', 'int64']).columns.drop(
+            'Autoconsommation_Collective', errors='ignore'
+        ).tolist()
+        acc = r15[r15['Autoconsommation_Collective'].eq(0).fillna(False).to_numpy(dtype=bool) & r15['Date_Releve'].notna().to_numpy()]
+
+        releves = acc[numeric_cols].astype('float64')
+        releves.insert(0, 'nb_lignes_r15', np.ones(len(acc), dtype=np.int64))
+        releves['pdl'] = acc['pdl'].astype(str)
+        releves['jour'] = acc['Date_Releve'].dt.tz_convert('Europe/Paris').dt.normalize()
+        releves['premier_releve'] = releves['dernier_releve'] = acc['Date_Releve']
+
+        value_cols = ['nb_lignes_r15', *numeric_cols]
+        return cls(cls._rollup(releves, ['pdl', 'jour'], value_cols))
+
+    @staticmethod
+    def _rollup(frame: pd.DataFrame, keys: list[str], value_cols: list[str]) -> pd.DataFrame:
+        """Somme `value_cols` par `keys` (pdl en tête), bornes des relevés et cumuls par PRM."""
+        agg = {col: 'sum' for col in value_cols}
+        agg.update(premier_releve='min', dernier_releve='max')
+        rolled = frame.groupby(keys, sort=True).agg(agg).reset_index()
+        cumuls = rolled.groupby('pdl', sort=False)[value_cols].cumsum().add_prefix('cumul_')
+        return pd.concat([rolled, cumuls], axis=1)
+
+    def update(self, r15: pd.DataFrame, pdls) -> 'EnergyCube':
+        """
+        Cube après l'ajout de relevés : seuls les PRM de `pdls` sont ré-agrégés depuis
+        r15 (tous les relevés), les lignes des autres PRM sont reprises telles quelles.
+
+        Le coût est proportionnel aux relevés des PRM touchés. Si les colonnes
+        d'énergie ont changé, le cube est reconstruit en entier.
+        """
+        pdls = pd.Index(pd.unique(np.asarray(pdls, dtype=str)))
+        partiel = EnergyCube.from_r15(r15[r15['pdl'].astype(str).isin(pdls).to_numpy()])
+        if partiel.value_cols != self.value_cols:
+            return EnergyCube.from_r15(r15)
+
+        garde = self.jour[~self.jour['pdl'].isin(pdls)]
+        jour = pd.concat([garde, partiel.jour], ignore_index=True).sort_values(['pdl', 'jour'], kind='stable', ignore_index=True)
+        return EnergyCube(jour)
+
+    def _index(self, frame: pd.DataFrame) -> dict:
+        """Clés de recherche (PRM, rang de l'instant) et cumuls décalés d'une ligne de zéros."""
+        codes, prms = pd.factorize(frame['pdl'], sort=False)
+        premier = pd.DatetimeIndex(frame['premier_releve']).as_unit('ns').asi8
+        dernier = pd.DatetimeIndex(frame['dernier_releve']).as_unit('ns').asi8
+        # Rangs denses des instants : clé exacte (PRM, rang) en int64, triée par PRM puis par jour
+        instants, ranks = np.unique(np.concatenate([premier, dernier]), return_inverse=True)
+        span = len(instants) + 1
+        cumuls = frame[[f'cumul_{col}' for col in self.value_cols]].to_numpy(dtype=np.float64)
+        return {
+            'codes': codes.astype(np.int64),
+            'prms': pd.Index(prms).astype(str),
+            'instants': instants,
+            'span': span,
+            'cle_premier': codes * span + ranks[:len(premier)],
+            'cle_dernier': codes * span + ranks[len(premier):],
+            'cumuls': np.vstack([np.zeros((1, len(self.value_cols))), cumuls]),
+        }
+
+    def _sums(self, index: dict, prm_codes: np.ndarray, debut: np.ndarray, fin: np.ndarray) -> np.ndarray:
+        """Sommes de value_cols sur [debut, fin] pour chaque requête (PRM, debut, fin)."""
+        # premier >= debut ⟺ rang(premier) >= rang gauche de debut ; dernier <= fin de même à droite
+        rang_debut = np.searchsorted(index['instants'], debut, side='left')
+        rang_fin = np.searchsorted(index['instants'], fin, side='right') - 1
+        lo = np.searchsorted(index['cle_premier'], prm_codes * index['span'] + rang_debut, side='left')
+        hi = np.searchsorted(index['cle_dernier'], prm_codes * index['span'] + rang_fin, side='right')
+
+        # Cumuls par PRM : la ligne précédant lo n'est soustraite que si elle est du même PRM
+        start = np.searchsorted(index['codes'], prm_codes, side='left')
+        before = np.where((lo > start)[:, None], index['cumuls'][lo], 0.0)
+        return np.where((hi > lo)[:, None], index['cumuls'][np.maximum(hi, lo)] - before, 0.0)
+
+    def total(
+        self,
+        debut: Optional[pd.Timestamp] = None,
+        fin: Optional[pd.Timestamp] = None,
+        pdl: Optional[str] = None,
+    ) -> pd.Series:
+        """Nombre de relevés et énergies sur [debut, fin], pour un PRM ou tout le périmètre."""
+        index = self._global if pdl is None else self._par_prm
+        code = 0 if pdl is None else index['prms'].get_indexer([str(pdl)])[0]
+        if code < 0:
+            return pd.Series(0.0, index=self.value_cols)
+        bounds = [
+            np.iinfo(np.int64).min + 1 if debut is None else pd.Timestamp(debut).as_unit('ns').value,
+            np.iinfo(np.int64).max if fin is None else pd.Timestamp(fin).as_unit('ns').value,
+        ]
+        sums = self._sums(index, np.array([code]), np.array(bounds[:1]), np.array(bounds[1:]))
+        return pd.Series(sums[0], index=self.value_cols)
+
+    def daily(
+        self,
+        debut: Optional[pd.Timestamp] = None,
+        fin: Optional[pd.Timestamp] = None,
+        pdl: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Série journalière (jour, value_cols) sur [debut, fin], pour un PRM ou tout le périmètre."""
+        if pdl is None:
+            frame = self.jour_total
+        else:
+            # jour est trié par PRM : les lignes du PRM sont contiguës
+            code = self._par_prm['prms'].get_indexer([str(pdl)])[0]
+            bornes = np.searchsorted(self._par_prm['codes'], [code, code + 1]) if code >= 0 else [0, 0]
+            frame = self.jour.iloc[bornes[0]:bornes[1]]
+        mask = np.ones(len(frame), dtype=bool)
+        if debut is not None:
+            mask &= (frame['premier_releve'] >= debut).to_numpy()
+        if fin is not None:
+            mask &= (frame['dernier_releve'] <= fin).to_numpy()
+        return frame.loc[mask, ['jour', *self.value_cols]].reset_index(drop=True)
+
+    def period_totals(
+        self,
+        price_periods: pd.DataFrame,
+        contract_prm: Optional[pd.DataFrame] = None,
+        debut: Optional[pd.Timestamp] = None,
+        fins: Sequence[Optional[pd.Timestamp]] = (None,),
+    ) -> np.ndarray:
+        """
+        Sommes de value_cols par période, pour chaque date de fin de `fins`.
+
+        Chaque période est bornée à [debut, fin] ; avec `contract_prm`, seuls les PRM
+        du contrat de la période sont sommés. Toutes les dates de fin sont résolues par
+        un seul appel vectorisé au cube.
+
+        Returns:
+            np.ndarray: Tableau (len(fins), len(price_periods), len(value_cols))
+        """
+        periods = price_periods.reset_index(drop=True)
+        nb_periods, nb_fins = len(periods), len(fins)
+        if self.jour.empty or periods.empty:
+            return np.zeros((nb_fins, nb_periods, len(self.value_cols)))
+
+        valid = (periods['date_debut'].notna() & periods['date_fin'].notna()).to_numpy()
+        period_debut = pd.DatetimeIndex(periods['date_debut']).as_unit('ns').asi8
+        period_fin = pd.DatetimeIndex(periods['date_fin']).as_unit('ns').asi8
+        if debut is not None:
+            period_debut = np.maximum(period_debut, pd.Timestamp(debut).as_unit('ns').value)
+        bornes_fin = np.array([
+            np.iinfo(np.int64).max if fin is None else pd.Timestamp(fin).as_unit('ns').value for fin in fins
+        ])
+
+        if contract_prm is None:
+            index = self._global
+            period_idx = np.flatnonzero(valid)
+            prm_codes = np.zeros(len(period_idx), dtype=np.int64)
+        else:
+            index = self._par_prm
+            pairs = periods.loc[valid, ['CONTRAT']].reset_index().merge(contract_prm[['CONTRAT', 'pdl']], on='CONTRAT')
+            prm_codes = index['prms'].get_indexer(pairs['pdl'].astype(str)).astype(np.int64)
+            period_idx = pairs['index'].to_numpy()[prm_codes >= 0]
+            prm_codes = prm_codes[prm_codes >= 0]
+
+        # Requêtes (fin, période, PRM) à plat : une ligne par paire et par date de fin
+        sums = self._sums(
+            index,
+            np.tile(prm_codes, nb_fins),
+            np.tile(period_debut[period_idx], nb_fins),
+            np.minimum(period_fin[period_idx][None, :], bornes_fin[:, None]).ravel(),
+        )
+        cible = (np.arange(nb_fins)[:, None] * nb_periods + period_idx[None, :]).ravel()
+        totals = np.column_stack([
+            np.bincount(cible, weights=sums[:, i], minlength=nb_fins * nb_periods)
+            for i in range(len(self.value_cols))
+        ])
+        return totals.reshape(nb_fins, nb_periods, len(self.value_cols))
+
+    def write(self, directory: Path) -> None:
+        """Écrit le cube (jour.parquet) de façon atomique."""
+        directory.mkdir(parents=True, exist_ok=True)
+        atomic_write(directory / 'jour.parquet', lambda tmp_path: self.jour.to_parquet(tmp_path, index=False))
+
+    @classmethod
+    def read(cls, directory: Path) -> Optional['EnergyCube']:
+        """Relit un cube écrit par write ; None s'il est absent."""
+        if not (directory / 'jour.parquet').exists():
+            return None
+        return cls(pd.read_parquet(directory / 'jour.parquet'))
+
 
-    Algorithme :
-    1. Tri chronologique des données par CONTRAT, CODE_ARTICLE, DATEFACT
-    2. Groupement par combinaison CONTRAT-CODE_ARTICLE
-    3. Détection des changements de prix avec pandas.shift(1)
-    4. Identification des points de rupture tarifaire
-    5. Calcul des dates de début/fin et durées pour chaque période
+@app.function(hide_code=True)
+def filter_journal(journal: pd.DataFrame, debut_acc: pd.Timestamp, date_regularisation: pd.Timestamp) -> pd.DataFrame:
+    """Lignes du journal facturées entre debut_acc et date_regularisation, bornes incluses."""
+    return journal[
+        (journal['DATEFACT'] >= debut_acc) &
+        (journal['DATEFACT'] <= date_regularisation)
+    ]
 
-    Args:
-        df (pd.DataFrame): DataFrame contenant les colonnes :
-            - CONTRAT (str) : Identifiant unique du contrat
-            - CODE_ARTICLE (str) : Code de l'article facturé
-            - PUHT (float) : Prix unitaire hors taxe
-            - DATEFACT (pd.Timestamp) : Date de facturation
 
-    Returns:
-        pd.DataFrame: DataFrame contenant les périodes de prix avec :
-            - CONTRAT (str) : Identifiant du contrat
-            - CODE_ARTICLE (str) : Code de l'article
-            - PUHT (float) : Prix unitaire de la période
-            - date_debut (pd.Timestamp) : Date de début de la période
-            - date_fin (pd.Timestamp) : Date de fin de la période
-            - duree_jours (int) : Durée de la période en jours (≥ 1)
+@app.function(hide_code=True)
+def select_conso(journal: pd.DataFrame) -> pd.DataFrame:
+    """Lignes du journal dont le CODE_ARTICLE commence par 'CONSO'."""
+    return journal[journal['CODE_ARTICLE'].str.startswith('CONSO', na=False)]
 
-    Examples:
-        >>> # Données d'entrée avec changement de prix
-        >>> data = pd.DataFrame({
-        ...     'CONTRAT': ['C001', 'C001', 'C001'],
-        ...     'CODE_ARTICLE': ['ABONNEMENT', 'ABONNEMENT', 'ABONNEMENT'], 
-        ...     'PUHT': [12.0, 12.0, 15.0],
-        ...     'DATEFACT': pd.to_datetime(['2023-01-01', '2023-02-01', '2023-03-01'])
-        ... })
-        >>> periods = identify_price_periods(data)
-        >>> len(periods)
-        2
-        >>> periods.iloc[0]['duree_jours']  # Première période
-        59
-        >>> periods.iloc[1]['PUHT']  # Nouveau prix
-        15.0
 
-        >>> # Données vides
-        >>> empty_df = pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT'])
-        >>> result = identify_price_periods(empty_df)
-        >>> result.empty
-        True
+@app.function(hide_code=True)
+def group_journal(journal: pd.DataFrame) -> pd.DataFrame:
+    """
+    Groupe le journal par CONTRAT, PÉRIODE, CODE_ARTICLE et PUHT.
 
-    Note:
-        - Les périodes sont calculées de manière inclusive (date_fin incluse)
-        - Pour la dernière période d'un groupe, date_fin = dernière DATEFACT du groupe
-        - Les données sont automatiquement triées par ordre chronologique
-        - La fonction gère les DataFrames vides en retournant une structure vide valide
+    Les colonnes numériques sont sommées, PDS_CONTRAT conserve sa première valeur
+    (elle devrait être la même pour un contrat).
     """
-    if df.empty:
-        # Retourner un DataFrame vide avec la structure attendue
-        return pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours'])
+    groupby_cols = ['CONTRAT', 'PÉRIODE', 'CODE_ARTICLE', 'PUHT']
 
-    # Trier par contrat, article et date pour avoir une séquence temporelle cohérente
-    df_sorted = df.sort_values(['CONTRAT', 'CODE_ARTICLE', 'DATEFACT']).copy()
+    # Colonnes numériques à sommer (exclure PDS_CONTRAT et les colonnes de groupby)
+    numeric_cols = [col for col in journal.columns
+                    if journal[col].dtype in ['int64', 'float64']
+                    and col not in ['PDS_CONTRAT'] + groupby_cols]
 
-    # Grouper par contrat et article
-    grouped = df_sorted.groupby(['CONTRAT', 'CODE_ARTICLE'])
+    # Créer le dictionnaire d'agrégation
+    agg_dict = {col: 'sum' for col in numeric_cols}
+    if 'PDS_CONTRAT' in journal.columns:
+        agg_dict['PDS_CONTRAT'] = 'first'
 
-    periods_list = []
+    return journal.groupby(groupby_cols).agg(agg_dict).reset_index()
 
-    for (contrat, article), group in grouped:
-        # Détecter les changements de prix avec shift() - opération vectorisée
-        price_changes = group['PUHT'] != group['PUHT'].shift(1)
-        # Le premier élément est toujours un "changement"
-        price_changes.iloc[0] = True
 
-        # Identifier les indices où il y a changement de prix
-        change_indices = group[price_changes].index
+@app.class_definition(hide_code=True)
+class Workspace:
+    """
+    Espace de travail multi-périmètres : registre des opérations ACC et données chargées.
+
+    Le registre est un CSV (nom, r15, journal, et optionnellement mapping), au format du
+    manifeste d'acc_batch.py ; les chemins relatifs sont résolus depuis son dossier. Les
+    autres colonnes (date_regularisation d'acc_batch.py…) sont conservées telles quelles
+    à chaque réécriture : un même fichier peut servir de registre et de manifeste.
+    Chaque périmètre garde ses propres caches sur disque, rangés avec ses données (R15
+    typé, cube d'énergie, journal : voir acc_cache_dir). Le workspace y ajoute un cache
+    mémoire des derniers dossiers chargés : revenir à un périmètre déjà ouvert ne relit
+    rien tant que ses fichiers n'ont pas changé (taille, date de modification).
+
+    prefetch lance les chargements en arrière-plan : le R15 et le journal d'un
+    périmètre se chargent en même temps, et le noyau n'attend que le plus long. Les
+    chargements sont orchestrés par des threads ; le fichier Excel est lu dans un
+    processus dédié (s'il y a plus d'un cœur) et les flux R15 par le pool de
+    parse_r15_files (max_workers > 1), si bien que les deux lectures ne se disputent
+    pas le GIL.
+
+    Attributes:
+        registry (Path): Fichier CSV du registre
+        perimetres (pd.DataFrame): Périmètres enregistrés (nom, r15, journal, mapping,
+            puis les autres colonnes du registre)
 
-        # Créer les périodes de prix
-        for i, start_idx in enumerate(change_indices):
-            # Date de début de la période
-            date_debut = group.loc[start_idx, 'DATEFACT']
-            # Prix de la période
-            puht = group.loc[start_idx, 'PUHT']
+    Examples:
+        >>> import tempfile
+        >>> tmp = Path(tempfile.mkdtemp())
+        >>> workspace = Workspace(tmp / 'perimetres.csv')
+        >>> workspace.register('Nord', tmp / 'nord' / 'R15', 'nord/journal.xlsx')
+        >>> workspace.register('Sud', 'sud/R15', 'sud/journal.xlsx', mapping='sud/pdl.csv', date_regularisation='2024-12-31')
+        >>> Workspace(tmp / 'perimetres.csv').noms
+        ['Nord', 'Sud']
+        >>> Workspace(tmp / 'perimetres.csv').perimetres['date_regularisation'].tolist()
+        [nan, '2024-12-31']
+        >>> workspace.perimetre('Sud')['mapping'] == tmp / 'sud' / 'pdl.csv'
+        True
+        >>> workspace.summary(['Nord'])[['nom', 'statut']].values.tolist()
+        [['Nord', 'cube absent']]
+    """
 
-            # Date de fin : dernière date du groupe ou début de la période suivante - 1 jour
-            if i < len(change_indices) - 1:
-                # Il y a une période suivante
-                next_start_idx = change_indices[i + 1]
-                date_fin = group.loc[next_start_idx, 'DATEFACT'] - pd.Timedelta(days=1)
+    columns = ['nom', 'r15', 'journal', 'mapping']
+
+    def __init__(self, registry: Path, cache_dir: Optional[Path] = None, max_loaded: int = 3):
+        self.registry = Path(registry).expanduser()
+        self.cache_dir = cache_dir
+        self.max_loaded = max_loaded
+        self._loaded = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='acc-chargement')
+        self._pending = {}
+        self._excel_pool = None
+        if self.registry.exists():
+            perimetres = pd.read_csv(self.registry, dtype=str)
+            # Colonnes inconnues du workspace conservées après les siennes
+            extra = [col for col in perimetres.columns if col not in self.columns]
+            self.perimetres = perimetres.reindex(columns=[*self.columns, *extra])
+        else:
+            self.perimetres = pd.DataFrame(columns=self.columns, dtype=str)
+
+    @classmethod
+    def default(cls) -> 'Workspace':
+        """Registre $ACC_WORKSPACE, par défaut ~/data/ACC/perimetres.csv."""
+        return cls(os.environ.get('ACC_WORKSPACE', '~/data/ACC/perimetres.csv'))
+
+    @property
+    def noms(self) -> list[str]:
+        return self.perimetres['nom'].tolist()
+
+    def register(
+        self,
+        nom: str,
+        r15: Path,
+        journal: Path,
+        mapping: Optional[Path] = None,
+        date_regularisation: Optional[str] = None,
+    ) -> None:
+        """
+        Ajoute ou remplace un périmètre et réécrit le registre de façon atomique.
+
+        Un périmètre remplacé garde les valeurs de ses autres colonnes ; date_regularisation
+        (AAAA-MM-JJ, pour acc_batch.py) n'est modifiée que si elle est donnée.
+        """
+        previous = self.perimetres[self.perimetres['nom'] == nom]
+        values = previous.iloc[0].to_dict() if not previous.empty else {}
+        values.update(nom=nom, r15=str(r15), journal=str(journal), mapping=str(mapping) if mapping else None)
+        if date_regularisation is not None:
+            values['date_regularisation'] = pd.Timestamp(date_regularisation).strftime('%Y-%m-%d')
+        row = pd.DataFrame([values], dtype=object)
+        columns = [*self.perimetres.columns, *(col for col in row.columns if col not in self.perimetres.columns)]
+        self.perimetres = pd.concat(
+            [df for df in [self.perimetres[self.perimetres['nom'] != nom], row] if not df.empty], ignore_index=True
+        ).reindex(columns=columns)
+        self.registry.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.registry, lambda tmp_path: self.perimetres.to_csv(tmp_path, index=False))
+
+    def perimetre(self, nom: str) -> dict:
+        """Chemins résolus d'un périmètre enregistré : r15, journal, mapping (ou None)."""
+        row = self.perimetres.set_index('nom').loc[nom]
+        base = self.registry.parent
+        return {
+            col: base / Path(row[col]).expanduser() if pd.notna(row[col]) else None
+            for col in ['r15', 'journal', 'mapping']
+        }
+
+    @staticmethod
+    def _stat(paths: list[Path]) -> tuple:
+        """Taille et date de modification des fichiers : change dès qu'un fichier change."""
+        return tuple((str(path), path.stat().st_size, path.stat().st_mtime_ns) for path in paths)
+
+    def _remember(self, key: tuple, entry: dict) -> dict:
+        # Le plus récent en dernier ; au-delà de max_loaded dossiers, le plus ancien est oublié
+        with self._lock:
+            self._loaded.pop(key, None)
+            self._loaded[key] = entry
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.pop(next(iter(self._loaded)))
+        return entry
+
+    def prefetch(self, method: str, *args, **kwargs) -> Future:
+        """
+        Lance load_r15 ou load_journal en arrière-plan ; le Future donne (résultat, secondes).
+
+        Un appel identique (hors rappels et profiler) dont le chargement est encore en
+        cours renvoie le même Future au lieu de relancer la lecture. Les exceptions du
+        chargement sont relevées par Future.result().
+        """
+        options = sorted((name, repr(value)) for name, value in kwargs.items()
+                         if not callable(value) and not isinstance(value, PipelineProfiler))
+        key = (method, repr(args), tuple(options))
+
+        def run():
+            start = time.perf_counter()
+            result = getattr(self, method)(*args, **kwargs)
+            return result, time.perf_counter() - start
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None or future.done():
+                future = self._pending[key] = self._executor.submit(run)
+        return future
+
+    def load_r15(
+        self,
+        folder: Path,
+        incremental: bool = False,
+        force: bool = False,
+        float32: bool = False,
+        max_workers: int = 1,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        profiler: Optional[PipelineProfiler] = None,
+    ) -> dict:
+        """
+        Relevés R15 triés (R15Store) et cube d'énergie d'un dossier, depuis la mémoire si possible.
+
+        En ingestion incrémentale, un historique déjà en mémoire est mis à jour sans
+        être retrié : seuls les relevés reçus sont triés puis insérés dans R15Store.
+
+        Returns:
+            dict: r15, r15_store, energy_cube, debut_acc, source ('memoire', 'cache' ou
+                'analyse'), nb_nouveaux_fichiers (ingestion incrémentale), generation
+                (jeton propre à chaque chargement) et changes : None, ou pour un
+                historique mis à jour en mémoire, les relevés ajoutes et retires depuis
+                le chargement `depuis` (sa generation)
+        """
+        folder = Path(folder).expanduser().resolve()
+        if not folder.is_dir():
+            raise FileNotFoundError(f"Dossier R15 introuvable : {folder}")
+        profiler = profiler or PipelineProfiler()
+        key = ('r15', str(folder), incremental, float32)
+        stat = self._stat(list_r15_files(folder))
+        entry = self._loaded.get(key)
+        if entry is not None and not force and entry['stat'] == stat:
+            for name in ['chargement_r15', 'cube_energie', 'store_r15']:
+                with profiler.stage(name, len(entry['r15'])) as mesure:
+                    mesure['lignes_sortie'] = len(entry['energy_cube'].jour if name == 'cube_energie' else entry['r15'])
+            return self._remember(key, {**entry, 'source': 'memoire', 'nb_nouveaux_fichiers': 0, 'changes': None})
+
+        nb_new_files, changes = 0, {}
+        with profiler.stage('chargement_r15') as mesure:
+            if incremental:
+                # Historique déjà en mémoire (hors float32) : seules les nouvelles parties sont relues
+                r15, nb_new_files = ingest_r15_incremental(
+                    folder, self.cache_dir, reset=force, max_workers=max_workers, on_progress=on_progress,
+                    history=entry['r15'] if entry is not None and not float32 else None, changes=changes,
+                )
+                source = 'cache' if nb_new_files == 0 else 'analyse'
+            else:
+                r15, from_cache = load_r15_cached(
+                    folder, self.cache_dir, force=force, max_workers=max_workers, on_progress=on_progress
+                )
+                source = 'cache' if from_cache else 'analyse'
+            mesure['lignes_sortie'] = len(r15)
+
+        # Cube d'énergie persisté avec le cache (construit ici si l'historique est vide)
+        with profiler.stage('cube_energie', len(r15)) as mesure:
+            energy_cube = EnergyCube.read(energy_cube_dir(folder, self.cache_dir, incremental)) or EnergyCube.from_r15(r15)
+            mesure['lignes_sortie'] = len(energy_cube.jour)
+
+        # Tri unique par flag ACC et date : les filtrages suivants sont des vues. Un
+        # historique mis à jour en mémoire garde son ordre : seuls les ajouts sont triés
+        with profiler.stage('store_r15', len(changes['ajoutes']) if changes else len(r15)) as mesure:
+            if changes:
+                r15_store = R15Store(r15, sorted_prefix=changes['nb_conserves'])
             else:
-                # Dernière période : prendre la dernière date du groupe
-                date_fin = group['DATEFACT'].iloc[-1]
-
-            # Calculer la durée en jours
-            duree_jours = (date_fin - date_debut).days + 1
-
-            periods_list.append({
-                'CONTRAT': contrat,
-                'CODE_ARTICLE': article, 
-                'PUHT': puht,
-                'date_debut': date_debut,
-                'date_fin': date_fin,
-                'duree_jours': duree_jours
+                r15_store = R15Store(compact_r15(r15, float32=True) if float32 else r15)
+            mesure['lignes_sortie'] = len(r15_store)
+
+        debut_acc = r15_store.debut_acc
+        if changes:
+            # Début ACC : min(début précédent, premier relevé ACC reçu), sans parcourir
+            # l'historique ; repris de R15Store si le premier relevé ACC a été retiré
+            ajoutes, retires = changes['ajoutes'], changes['retires']
+            if retires.empty or not detect_debut_acc(retires) <= entry['debut_acc']:
+                recus = [entry['debut_acc'], detect_debut_acc(ajoutes) if not ajoutes.empty else pd.NaT]
+                debut_acc = min([date for date in recus if pd.notna(date)], default=pd.NaT)
+            changes = {'ajoutes': ajoutes, 'retires': retires, 'depuis': entry['generation']}
+
+        return self._remember(key, {
+            'r15': r15_store.frame, 'r15_store': r15_store, 'energy_cube': energy_cube, 'debut_acc': debut_acc,
+            'stat': stat, 'source': source, 'nb_nouveaux_fichiers': nb_new_files,
+            'generation': uuid.uuid4().hex, 'changes': changes or None,
+        })
+
+    def load_journal(self, path: Path, profiler: Optional[PipelineProfiler] = None) -> tuple[pd.DataFrame, bool]:
+        """Journal des ventes typé (voir load_journal_ventes), depuis la mémoire si possible."""
+        path = Path(path).expanduser().resolve()
+        key = ('journal', str(path))
+        profiler = profiler or PipelineProfiler()
+        with profiler.stage('chargement_journal') as mesure:
+            stat = self._stat([path])
+            entry = self._loaded.get(key)
+            if entry is not None and entry['stat'] == stat:
+                journal, from_cache = self._remember(key, entry)['journal'], True
+            else:
+                # Processus créé au premier fichier Excel à lire, puis réutilisé ; sur un
+                # seul cœur, rien à paralléliser : lecture dans le thread appelant
+                # ('spawn' : le noyau Marimo est multi-thread, fork n'y est pas sûr)
+                with self._lock:
+                    if self._excel_pool is None and (os.cpu_count() or 1) > 1:
+                        self._excel_pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+                journal, from_cache = load_journal_ventes(path, self.cache_dir, self._excel_pool)
+                self._remember(key, {'journal': journal, 'stat': stat})
+            mesure['lignes_sortie'] = len(journal)
+        return journal, from_cache
+
+    def summary(
+        self,
+        noms: Optional[list[str]] = None,
+        debut: Optional[pd.Timestamp] = None,
+        fin: Optional[pd.Timestamp] = None,
+    ) -> pd.DataFrame:
+        """
+        Synthèse par périmètre sur [debut, fin] : PRM, jours couverts, relevés et énergies.
+
+        Seuls les cubes d'énergie des périmètres demandés sont lus (ou repris de la
+        mémoire) ; les relevés R15 et les journaux ne sont pas ouverts. Un périmètre
+        dont le cube n'a pas encore été construit est signalé comme « cube absent ».
+        """
+        rows = []
+        for nom in (self.noms if noms is None else noms):
+            folder = self.perimetre(nom)['r15'].expanduser().resolve()
+            memoire = [e['energy_cube'] for k, e in self._loaded.items() if k[0] == 'r15' and k[1] == str(folder)]
+            cube = memoire[-1] if memoire else (
+                EnergyCube.read(energy_cube_dir(folder, self.cache_dir))
+                or EnergyCube.read(energy_cube_dir(folder, self.cache_dir, incremental=True))
+            )
+            if cube is None:
+                rows.append({'nom': nom, 'statut': 'cube absent'})
+                continue
+            jours = cube.daily(debut, fin)['jour']
+            rows.append({
+                'nom': nom,
+                'statut': 'ok',
+                'nb_prm': cube.jour['pdl'].nunique(),
+                'premier_jour': jours.min(),
+                'dernier_jour': jours.max(),
+                **cube.total(debut, fin).to_dict(),
             })
+        return pd.DataFrame(rows)
 
-    # Créer le DataFrame résultat
-    result_df = pd.DataFrame(periods_list)
 
-    if result_df.empty:
-        # Retourner un DataFrame vide avec la structure attendue
-        return pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours'])
+@app.class_definition(hide_code=True)
+class FolderWatcher:
+    """
+    Surveillance d'un dossier de flux R15 et d'un journal des ventes, avec anti-rebond.
+
+    Utilise watchdog s'il est installé (dépendance de développement), sinon un sondage
+    de la taille et de la date de modification des fichiers toutes les `poll_interval`
+    secondes. Les événements sont regroupés : `on_change` n'est appelé qu'après
+    `debounce` secondes sans nouvel événement (copie d'un lot de ZIP en cours), avec
+    l'ensemble des chemins modifiés.
+
+    Les fichiers et dossiers cachés (dont le cache `.acc_cache` écrit dans le dossier
+    R15) et les fichiers temporaires `.tmp` sont ignorés, de même que les simples
+    ouvertures et lectures de fichiers (seules les créations, modifications,
+    déplacements, suppressions et fermetures après écriture comptent) : l'ingestion
+    déclenchée par une modification ne se redéclenche pas elle-même.
+
+    La boucle tourne dans un thread de `thread_class` (mo.Thread dans le notebook,
+    pour que `on_change` puisse mettre à jour un mo.state) et s'arrête avec stop(),
+    ou quand la cellule qui l'a lancée est ré-exécutée.
+    """
 
-    return result_df
+    def __init__(
+        self,
+        folder: Optional[Path],
+        files: Sequence[Path] = (),
+        on_change: Optional[Callable[[set], None]] = None,
+        debounce: float = 2.0,
+        poll_interval: float = 1.0,
+        thread_class: type = threading.Thread,
+    ):
+        self.folder = Path(folder).expanduser().resolve() if folder else None
+        self.files = {Path(path).expanduser().resolve() for path in files}
+        self.on_change = on_change or (lambda changed: None)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.thread_class = thread_class
+        self.backend = 'watchdog' if importlib.util.find_spec('watchdog') else 'sondage'
+        self._pending = set()
+        self._last_event = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._snapshot = {}
+
+    def watches(self, path: Path) -> bool:
+        """Vrai si `path` est un fichier surveillé (hors fichiers cachés et temporaires)."""
+        path = Path(path)
+        if path in self.files:
+            return True
+        if self.folder is None or path.suffix == '.tmp' or not path.is_relative_to(self.folder):
+            return False
+        return not any(part.startswith('.') for part in path.relative_to(self.folder).parts)
+
+    def notify(self, path: Path) -> None:
+        """Enregistre une modification ; l'appel à on_change attend la fin de la rafale."""
+        path = Path(path)
+        if self.watches(path):
+            with self._lock:
+                self._pending.add(path)
+                self._last_event = time.monotonic()
+
+    def _scan(self) -> dict:
+        """Taille et date de modification de chaque fichier surveillé."""
+        paths = set(self.files)
+        if self.folder is not None and self.folder.is_dir():
+            paths.update(path for path in self.folder.rglob('*') if path.is_file() and self.watches(path))
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _poll(self) -> None:
+        snapshot = self._scan()
+        for path in snapshot.keys() | self._snapshot.keys():
+            if snapshot.get(path) != self._snapshot.get(path):
+                self.notify(path)
+        self._snapshot = snapshot
+
+    def start(self) -> 'FolderWatcher':
+        """Démarre la surveillance (observateur watchdog ou sondage) et le thread d'anti-rebond."""
+        if self.backend == 'watchdog':
+            from watchdog.events import (
+                EVENT_TYPE_CLOSED,
+                EVENT_TYPE_CREATED,
+                EVENT_TYPE_DELETED,
+                EVENT_TYPE_MODIFIED,
+                EVENT_TYPE_MOVED,
+                FileSystemEventHandler,
+            )
+            from watchdog.observers import Observer
+
+            watcher = self
+            # Écritures seulement : une lecture du journal ou des flux émet 'opened' et
+            # 'closed_no_write', qui relanceraient le pipeline à chaque chargement
+            ecritures = {EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CLOSED}
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if not event.is_directory and event.event_type in ecritures:
+                        watcher.notify(Path(os.fsdecode(event.src_path)))
+                        if getattr(event, 'dest_path', None):
+                            watcher.notify(Path(os.fsdecode(event.dest_path)))
+
+            self._observer = Observer()
+            if self.folder is not None and self.folder.is_dir():
+                self._observer.schedule(Handler(), str(self.folder), recursive=True)
+            for parent in {path.parent for path in self.files if path.parent.is_dir()}:
+                if self.folder is None or not parent.is_relative_to(self.folder):
+                    self._observer.schedule(Handler(), str(parent), recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            self._snapshot = self._scan()
+        self.thread_class(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _run(self) -> None:
+        thread = threading.current_thread()
+        while not self._stop.is_set() and not getattr(thread, 'should_exit', False):
+            self._stop.wait(self.poll_interval if self.backend == 'sondage' else min(self.debounce, 0.5))
+            if self.backend == 'sondage':
+                self._poll()
+            with self._lock:
+                pret = self._pending and time.monotonic() - self._last_event >= self.debounce
+                changed, self._pending = (self._pending, set()) if pret else (set(), self._pending)
+            if changed:
+                self.on_change(changed)
+        self.stop()
 
 
 @app.cell(hide_code=True)
@@ -211,6 +3119,34 @@ def donnees_r15_section():
     return
 
 
+@app.cell(hide_code=True)
+def _():
+    # Registre des périmètres ($ACC_WORKSPACE) et données déjà chargées, conservés entre les exécutions
+    workspace = Workspace.default()
+    # Dernier périmètre enregistré : les listes de périmètres sont recréées quand il change
+    get_dernier_perimetre, set_dernier_perimetre = mo.state(None)
+    return get_dernier_perimetre, set_dernier_perimetre, workspace
+
+
+@app.cell(hide_code=True)
+def _():
+    # Compteurs de modifications des données surveillées : chaque incrément recharge
+    # uniquement les cellules qui lisent la source modifiée (R15 ou journal)
+    get_r15_version, set_r15_version = mo.state(0)
+    get_journal_version, set_journal_version = mo.state(0)
+    return get_journal_version, get_r15_version, set_journal_version, set_r15_version
+
+
+@app.cell(hide_code=True)
+def _(get_dernier_perimetre, workspace):
+    perimetre_dropdown = mo.ui.dropdown(
+        options={'Sélection manuelle des fichiers': None, **{_nom: _nom for _nom in workspace.noms}},
+        value=get_dernier_perimetre() if get_dernier_perimetre() in workspace.noms else 'Sélection manuelle des fichiers',
+        label="Périmètre ACC",
+    )
+    return (perimetre_dropdown,)
+
+
 @app.cell(hide_code=True)
 def _():
     folder_picker = mo.ui.file_browser(
@@ -222,27 +3158,208 @@ def _():
 
 
 @app.cell(hide_code=True)
-def _(folder_picker):
-    folder_picker
+def _():
+    # Défini avant le chargement R15 pour que le journal soit préchargé en même temps
+    journal_picker = mo.ui.file_browser(
+        initial_path=Path('~/data/ACC/').expanduser(),
+        selection_mode="file",
+        restrict_navigation=False,
+        label="Sélectionnez le fichier Journal des ventes détaillés (.xlsx)",
+        filetypes=[".xlsx", ".xls"]
+    )
+    return (journal_picker,)
+
+
+@app.cell(hide_code=True)
+def _():
+    rebuild_cache_button = mo.ui.run_button(label="Reconstruire le cache R15")
+    incremental_switch = mo.ui.switch(label="Ingestion incrémentale (historique des flux déjà reçus)")
+    workers_input = mo.ui.number(
+        start=1,
+        stop=os.cpu_count() or 1,
+        value=max(1, min(int(os.environ.get('ACC_WORKERS', os.cpu_count() or 1)), os.cpu_count() or 1)),
+        label="Processus d'analyse des fichiers R15",
+    )
+    float32_switch = mo.ui.switch(label="Énergies EA en float32 (mémoire réduite)")
+    validation_mode_dropdown = mo.ui.dropdown(
+        options={
+            'Complète': 'complet',
+            'Échantillon aléatoire (100 000 lignes)': 'echantillon',
+            'Premières lignes (100 000)': 'entete',
+        },
+        value='Complète',
+        label="Validation Pandera",
+    )
+    profile_switch = mo.ui.switch(label="Profilage cProfile des étapes (plus lent)")
+    watch_switch = mo.ui.switch(label="Surveiller le dossier R15 et le journal (ingestion automatique)")
+    return (
+        float32_switch,
+        incremental_switch,
+        profile_switch,
+        rebuild_cache_button,
+        validation_mode_dropdown,
+        watch_switch,
+        workers_input,
+    )
+
+
+@app.cell(hide_code=True)
+def _(
+    float32_switch,
+    folder_picker,
+    incremental_switch,
+    perimetre_dropdown,
+    profile_switch,
+    rebuild_cache_button,
+    validation_mode_dropdown,
+    watch_switch,
+    workers_input,
+):
+    mo.vstack([
+        perimetre_dropdown,
+        *([] if perimetre_dropdown.value else [folder_picker]),
+        incremental_switch, watch_switch, rebuild_cache_button, workers_input,
+        float32_switch, validation_mode_dropdown, profile_switch,
+    ])
     return
 
 
 @app.cell
-def _(folder_picker):
-    mo.stop(not folder_picker.value, mo.md("⚠️ **Veuillez sélectionner un dossier contenant les fichiers R15 à traiter**"))
+def _(profile_switch):
+    # Mesures par étape, ajoutées au journal JSON-lines $ACC_PERF_LOG s'il est défini
+    # (aucun fichier écrit sinon : le dossier de données peut être un volume partagé)
+    profiler = PipelineProfiler(os.environ.get('ACC_PERF_LOG'), profile=profile_switch.value)
+    return (profiler,)
 
-    r15 = process_flux('R15_ACC', folder_picker.value[0].path)
 
-    # Convertir toutes les colonnes commençant par 'EA' en numérique
-    ea_columns = [col for col in r15.columns if col.startswith('EA')]
-    for col in ea_columns:
-        r15[col] = pd.to_numeric(r15[col], errors='coerce')
+@app.cell
+def _(
+    float32_switch,
+    folder_picker,
+    get_r15_version,
+    incremental_switch,
+    perimetre_dropdown,
+    profiler,
+    rebuild_cache_button,
+    watch_switch,
+    workers_input,
+    workspace,
+):
+    # Chargement R15 lancé en arrière-plan dès que le dossier est connu : le journal des
+    # ventes (cellule suivante) se charge en même temps, la cellule d'après attend le résultat.
+    # Mémoire du workspace, sinon cache (reconstruit si les fichiers de flux ont changé) ;
+    # en ingestion incrémentale, seuls les fichiers nouveaux ou modifiés sont analysés.
+    # En mode surveillance, chaque lot de fichiers reçu ré-exécute cette cellule (get_r15_version)
+    # et seul ce lot est ingéré dans l'historique.
+    get_r15_version()
+    if perimetre_dropdown.value:
+        r15_folder = workspace.perimetre(perimetre_dropdown.value)['r15']
+    else:
+        r15_folder = folder_picker.value[0].path if folder_picker.value else None
+    r15_incremental = incremental_switch.value or watch_switch.value
+    r15_progress = {}
+    r15_future = r15_folder and workspace.prefetch(
+        'load_r15', r15_folder, incremental=r15_incremental, force=rebuild_cache_button.value,
+        float32=float32_switch.value, max_workers=workers_input.value,
+        on_progress=lambda done, total: r15_progress.update(done=done, total=total), profiler=profiler,
+    )
+    return r15_future, r15_incremental, r15_progress
+
+
+@app.cell
+def journal_prefetch(get_journal_version, journal_picker, perimetre_dropdown, profiler, workspace):
+    # Journal des ventes préchargé en arrière-plan, en même temps que le R15 (mémoire du
+    # workspace, sinon cache Arrow) ; rechargé à chaque nouvelle version du fichier en mode surveillance
+    get_journal_version()
+    if perimetre_dropdown.value:
+        _path = workspace.perimetre(perimetre_dropdown.value)['journal']
+    else:
+        _path = journal_picker.value[0].path if journal_picker.value else None
+    # Nom affiché : le sélecteur de fichier est vide quand le journal vient d'un périmètre
+    journal_name = Path(_path).name if _path else None
+    journal_future = _path and workspace.prefetch('load_journal', _path, profiler=profiler)
+    return journal_future, journal_name
+
+
+@app.cell
+def _(r15_future, r15_incremental, r15_progress):
+    mo.stop(not r15_future, mo.md("⚠️ **Veuillez sélectionner un dossier contenant les fichiers R15 à traiter**"))
+
+    with mo.status.spinner(title="Chargement des données R15…") as _spinner:
+        while not r15_future.done():
+            try:
+                r15_future.result(timeout=0.5)
+            except TimeoutError:
+                pass
+            if r15_progress:
+                _spinner.update(subtitle=f"{r15_progress['done']}/{r15_progress['total']} fichiers analysés")
+        _loaded, r15_load_seconds = r15_future.result()
+    r15, r15_store, energy_cube = _loaded['r15'], _loaded['r15_store'], _loaded['energy_cube']
+    # Mode surveillance : relevés reçus et retirés depuis le chargement précédent
+    r15_changes, r15_generation, r15_debut_acc = _loaded['changes'], _loaded['generation'], _loaded['debut_acc']
+
+    if _loaded['source'] == 'memoire':
+        print(f"⚡ Périmètre déjà chargé (mémoire du workspace) : {len(r15)} lignes")
+    elif r15_incremental:
+        print(f"📥 Ingestion incrémentale : {_loaded['nb_nouveaux_fichiers']} nouveau(x) fichier(s), {len(r15)} lignes dans l'historique")
+    else:
+        print(f"{'⚡ Cache R15 utilisé' if _loaded['source'] == 'cache' else '🔄 Fichiers R15 analysés, cache mis à jour'} : {len(r15)} lignes")
+    return (
+        energy_cube,
+        r15,
+        r15_changes,
+        r15_debut_acc,
+        r15_generation,
+        r15_load_seconds,
+        r15_store,
+    )
+
+
+@app.cell
+def _(profiler, r15, r15_load_seconds, validation_mode_dropdown):
+    # Validation Pandera des relevés typés : toutes les erreurs collectées en une passe
+    with profiler.stage('validation_r15', len(r15)) as _mesure:
+        _, r15_failures, _seconds = validate_frame(r15, 'R15Model', validation_mode_dropdown.value)
+        _mesure['lignes_sortie'] = len(r15_failures)
+    r15_validation = {
+        'schema': 'R15Model',
+        'mode': validation_mode_dropdown.value,
+        'lignes': len(r15),
+        'erreurs': len(r15_failures),
+        'duree_ms': round(_seconds * 1000, 1),
+        'part_chargement_pct': round(100 * _seconds / r15_load_seconds, 1) if r15_load_seconds else None,
+    }
+    mo.vstack([
+        mo.md(f"✅ **R15Model** : relevés valides ({r15_validation['duree_ms']} ms)") if r15_failures.empty
+        else mo.md(f"⚠️ **R15Model** : {len(r15_failures)} anomalies ({r15_validation['duree_ms']} ms)"),
+        *([] if r15_failures.empty else [r15_failures]),
+    ])
+    return (r15_validation,)
+
+
+@app.cell(hide_code=True)
+def _(r15):
+    # Valeurs non vides que le typage (type_r15) n'a pas pu convertir : devenues NaN / NaT
+    r15_conversions = pd.Series(r15.attrs.get('conversions', {}), dtype='int64', name='valeurs_invalides')
+    r15_conversions = r15_conversions.rename_axis('colonne').reset_index()
+    _total = int(r15_conversions['valeurs_invalides'].sum())
+    (
+        mo.md("✅ **Typage R15** : toutes les valeurs ont été converties") if _total == 0
+        else mo.accordion({
+            f"⚠️ Typage R15 : {_total} valeurs invalides rendues manquantes (NaN / NaT)": r15_conversions
+        })
+    )
+    return (r15_conversions,)
 
-    # Convertir Date_Releve en format date
-    if 'Date_Releve' in r15.columns:
-        r15['Date_Releve'] = pd.to_datetime(r15['Date_Releve'], errors='coerce', utc=True)
 
-    return (r15,)
+@app.cell(hide_code=True)
+def _(r15):
+    r15_memory = memory_report(r15)
+    mo.accordion({
+        f"💾 Mémoire R15 : {r15_memory['memoire_mo'].sum():.1f} Mo "
+        f"(représentation texte/float64 estimée : {r15_memory['memoire_objet_mo'].sum():.1f} Mo)": r15_memory
+    })
+    return
 
 
 @app.cell(hide_code=True)
@@ -254,8 +3371,10 @@ def donnees_r15_display():
     Les données R15 ont été chargées avec succès ! Le tableau ci-dessous présente un échantillon des données traitées :
 
     **Points clés :**
-    - Toutes les colonnes énergétiques (EA) ont été converties en format numérique
+    - Toutes les colonnes énergétiques (EA) ont été converties en format numérique (float64)
     - Les dates sont normalisées en UTC pour éviter les problèmes de timezone
+    - Les valeurs impossibles à convertir sont comptées par colonne (voir « Typage R15 » ci-dessus)
+    - Les identifiants répétés sont stockés en catégories et le flag ACC en entier (0 = ACC active)
     - Les données sont prêtes pour l'analyse des flux d'autoconsommation
 
     **Navigation :** Utilisez les contrôles du tableau pour explorer les différentes colonnes et périodes.
@@ -266,7 +3385,7 @@ def donnees_r15_display():
 
 @app.cell
 def _(r15):
-    r15
+    paged_table(r15, "Relevés R15")
     return
 
 
@@ -279,7 +3398,7 @@ def debut_acc_info():
     Le système identifie automatiquement la date de début de l'autoconsommation collective en analysant les données R15.
 
     **Comment ça fonctionne :**
-    - Recherche de la première occurrence du flag `Autoconsommation_Collective = '0'`
+    - Recherche de la première occurrence du flag `Autoconsommation_Collective = 0`
     - Cette date marque le commencement officiel de l'ACC
     - Toutes les analyses ultérieures utiliseront cette date comme référence
 
@@ -290,8 +3409,9 @@ def debut_acc_info():
 
 
 @app.cell
-def _(r15):
-    debut_acc = r15[r15['Autoconsommation_Collective'] == '0']['Date_Releve'].min()
+def _(r15_debut_acc):
+    # Premier relevé ACC de R15Store ; en mode surveillance, min(début précédent, relevés reçus)
+    debut_acc = r15_debut_acc
     debut_acc
     return (debut_acc,)
 
@@ -343,28 +3463,30 @@ def _(date_regularisation_picker):
 
 
 @app.cell
-def _(date_regularisation_picker, debut_acc, r15):
+def _(date_regularisation_picker, debut_acc, energy_cube, profiler, r15, r15_store):
 
     # Convertir la date de régularisation en datetime avec timezone UTC (cohérent avec les autres dates)
     date_regularisation = pd.to_datetime(date_regularisation_picker.value, utc=True)
 
-    # Filtrer les données R15
-    r15_filtered = r15[
-        (r15['Date_Releve'] >= debut_acc) & 
-        (r15['Date_Releve'] <= date_regularisation) &
-        (r15['Autoconsommation_Collective'] == '0')
-    ].copy()
+    # Filtrer les données R15 : recherche dichotomique dans le bloc ACC trié, sans copie
+    with profiler.stage('filtrage_r15', len(r15)) as _mesure:
+        r15_filtered = r15_store.slice(debut_acc, date_regularisation)
+        _mesure['lignes_sortie'] = len(r15_filtered)
 
     # Afficher un résumé du filtrage
     print(f"Période filtrée : de {debut_acc.date()} à {date_regularisation.date()}")
     print(f"Nombre de lignes après filtrage : {len(r15_filtered)} (sur {len(r15)} lignes totales)")
 
+    # Totaux d'énergie de la période : deux recherches dans le cube, sans parcourir les relevés
+    totaux_periode = energy_cube.total(debut_acc, date_regularisation).drop('nb_lignes_r15')
+    print("Énergie sur la période : " + ", ".join(f"{col} = {val:,.0f}" for col, val in totaux_periode.items()))
+
     return date_regularisation, r15_filtered
 
 
 @app.cell
 def _(r15_filtered):
-    r15_filtered
+    paged_table(r15_filtered, "Relevés R15 de la période")
     return
 
 
@@ -396,70 +3518,106 @@ def journal_ventes_section():
 
 
 @app.cell(hide_code=True)
-def _():
-    journal_picker = mo.ui.file_browser(
-        initial_path=Path('~/data/ACC/').expanduser(),
-        selection_mode="file",
-        restrict_navigation=False,
-        label="Sélectionnez le fichier Journal des ventes détaillés (.xlsx)",
-        filetypes=[".xlsx", ".xls"]
+def _(journal_picker, perimetre_dropdown, workspace):
+    (
+        mo.md(f"📒 Journal du périmètre **{perimetre_dropdown.value}** : `{workspace.perimetre(perimetre_dropdown.value)['journal']}`")
+        if perimetre_dropdown.value else journal_picker
     )
-    return (journal_picker,)
+    return
 
 
 @app.cell(hide_code=True)
-def _(journal_picker):
-    journal_picker
+def _(
+    folder_picker,
+    journal_picker,
+    perimetre_dropdown,
+    set_journal_version,
+    set_r15_version,
+    watch_switch,
+    workspace,
+):
+    # Mode surveillance : un lot de fichiers R15 ou une nouvelle version du journal
+    # incrémente le compteur correspondant, ce qui recharge les seules cellules concernées.
+    # Le lot est ingéré dans l'historique en mémoire et inséré dans R15Store ; début ACC
+    # et agrégats par période sont mis à jour à partir des seuls relevés reçus.
+    mo.stop(not watch_switch.value)
+    if perimetre_dropdown.value:
+        _perimetre = workspace.perimetre(perimetre_dropdown.value)
+        _folder, _journal = _perimetre['r15'], _perimetre['journal']
+    else:
+        _folder = folder_picker.value[0].path if folder_picker.value else None
+        _journal = journal_picker.value[0].path if journal_picker.value else None
+    mo.stop(_folder is None and _journal is None, mo.md("👁️ Surveillance en attente d'un dossier R15 ou d'un journal"))
+
+    # Chemins liés en arguments par défaut : les variables _ de la cellule n'existent plus au rappel
+    def _on_change(
+        changed,
+        journal=Path(_journal).expanduser().resolve() if _journal else None,
+        folder=Path(_folder).expanduser().resolve() if _folder else None,
+    ):
+        if journal in changed:
+            set_journal_version(lambda version: version + 1)
+        if folder and any(path.is_relative_to(folder) for path in changed):
+            set_r15_version(lambda version: version + 1)
+
+    # Le thread s'arrête de lui-même quand cette cellule est ré-exécutée (mo.Thread.should_exit)
+    _watcher = FolderWatcher(_folder, [_journal] if _journal else [], _on_change, thread_class=mo.Thread).start()
+    mo.md(f"👁️ Surveillance active ({_watcher.backend}) : `{_folder}`" + (f" et `{_journal}`" if _journal else ""))
     return
 
 
 @app.cell
-def _(date_regularisation, debut_acc, journal_picker):
-    mo.stop(not journal_picker.value, mo.md("⚠️ **Veuillez sélectionner le fichier Journal des ventes détaillés**"))
+def _(journal_future):
+    mo.stop(not journal_future, mo.md("⚠️ **Veuillez sélectionner le fichier Journal des ventes détaillés**"))
 
-    # Charger le fichier Excel sélectionné
-    journal_ventes = pd.read_excel(journal_picker.value[0].path)
+    # Chargement lancé en arrière-plan avec celui du R15 : il est en général déjà terminé
+    with mo.status.spinner(title="Chargement du journal des ventes…"):
+        (journal_ventes_raw, journal_from_cache), journal_load_seconds = journal_future.result()
+    return journal_from_cache, journal_load_seconds, journal_ventes_raw
 
-    # Convertir DATEFACT en format date avec UTC (même approche que R15)
-    if 'DATEFACT' in journal_ventes.columns:
-        journal_ventes['DATEFACT'] = pd.to_datetime(journal_ventes['DATEFACT'], errors='coerce', utc=True)
-
-    # Validation simple des données
-    validation_messages = []
 
-    # Vérifier les colonnes essentielles
-    required_cols = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT']
-    missing_cols = [col for col in required_cols if col not in journal_ventes.columns]
-    if missing_cols:
-        validation_messages.append(f"⚠️ Colonnes manquantes : {missing_cols}")
-
-    # Vérifier les types et convertir
-    try:
-        journal_ventes['PUHT'] = pd.to_numeric(journal_ventes['PUHT'], errors='coerce')
-        invalid_puht = journal_ventes['PUHT'].isnull().sum()
-        if invalid_puht > 0:
-            validation_messages.append(f"⚠️ {invalid_puht} valeurs PUHT invalides converties en NaN")
-    except Exception:
-        validation_messages.append("⚠️ Problème de conversion PUHT")
+@app.cell
+def journal_ventes_validation(
+    date_regularisation,
+    debut_acc,
+    journal_from_cache,
+    journal_load_seconds,
+    journal_name,
+    journal_ventes_raw,
+    profiler,
+    validation_mode_dropdown,
+):
+    # Validation Pandera (lazy) : colonnes manquantes, types et valeurs invalides en une passe
+    with profiler.stage('validation_journal', len(journal_ventes_raw)) as _mesure:
+        journal_ventes_validated, journal_failures, _seconds = validate_frame(
+            journal_ventes_raw, 'JournalVentesModel', validation_mode_dropdown.value
+        )
+        _mesure['lignes_sortie'] = len(journal_failures)
+    journal_validation = {
+        'schema': 'JournalVentesModel',
+        'mode': validation_mode_dropdown.value,
+        'lignes': len(journal_ventes_raw),
+        'erreurs': len(journal_failures),
+        'duree_ms': round(_seconds * 1000, 1),
+        'part_chargement_pct': round(100 * _seconds / journal_load_seconds, 1) if journal_load_seconds else None,
+    }
 
     # Message final de validation
-    if not validation_messages:
+    if journal_failures.empty:
         validation_message = "✅ **Validation réussie** : Données prêtes pour l'analyse"
     else:
-        validation_message = "🔄 **Validation avec avertissements** :\n" + "\n".join(validation_messages)
-
-    journal_ventes_validated = journal_ventes
+        _resume = journal_failures.groupby(['column', 'check'], dropna=False).size()
+        validation_message = "🔄 **Validation avec avertissements** :\n" + "\n".join(
+            f"- ⚠️ {column} : {check} ({count} cas)" for (column, check), count in _resume.items()
+        )
 
-    # Filtrer les données du journal entre debut_acc et date_regularisation
-    journal_ventes_filtered = journal_ventes_validated[
-        (journal_ventes_validated['DATEFACT'] >= debut_acc) & 
-        (journal_ventes_validated['DATEFACT'] <= date_regularisation)
-    ].copy()
+    with profiler.stage('selection_conso', len(journal_ventes_validated)) as _mesure:
+        # Filtrer les données du journal entre debut_acc et date_regularisation
+        journal_ventes_filtered = filter_journal(journal_ventes_validated, debut_acc, date_regularisation)
 
-    # Filtrage des articles CONSO uniquement
-    journal_ventes_conso = journal_ventes_filtered[
-        journal_ventes_filtered['CODE_ARTICLE'].str.startswith('CONSO', na=False)
-    ].copy()
+        # Filtrage des articles CONSO uniquement
+        journal_ventes_conso = select_conso(journal_ventes_filtered)
+        _mesure['lignes_sortie'] = len(journal_ventes_conso)
 
     # Messages informatifs sur le filtrage
     nb_lignes_avant_filtrage_conso = len(journal_ventes_filtered)
@@ -469,7 +3627,9 @@ def _(date_regularisation, debut_acc, journal_picker):
     # Articles CONSO uniques identifiés
     articles_conso_uniques = sorted(journal_ventes_conso['CODE_ARTICLE'].unique()) if not journal_ventes_conso.empty else []
 
-    mo.md(f"""✅ **Fichier chargé:** {journal_picker.value[0].name}
+    journal_ventes = journal_ventes_conso
+
+    mo.md(f"""✅ **Fichier chargé:** {journal_name}{' (depuis le cache)' if journal_from_cache else ''}
 
     {validation_message}
 
@@ -484,9 +3644,7 @@ def _(date_regularisation, debut_acc, journal_picker):
     - **Articles CONSO identifiés:** {', '.join(articles_conso_uniques) if articles_conso_uniques else 'Aucun'}
 
     ✅ **Seuls les articles de consommation (CONSO_*) seront analysés pour les changements de prix**""")
-
-    journal_ventes = journal_ventes_conso
-    return (journal_ventes,)
+    return journal_ventes, journal_validation
 
 
 @app.cell(hide_code=True)
@@ -517,7 +3675,7 @@ def journal_ventes_display():
 
 @app.cell
 def _(journal_ventes):
-    journal_ventes
+    paged_table(journal_ventes, "Journal des ventes (articles CONSO de la période)")
     return
 
 
@@ -547,25 +3705,13 @@ def groupement_donnees_section():
 
 
 @app.cell
-def _(journal_ventes):
+def _(journal_ventes, profiler):
     mo.stop(journal_ventes is None, mo.md("⚠️ **En attente du chargement du journal des ventes**"))
 
-    # Grouper et sommer par CONTRAT, PÉRIODE et NOM_ARTICLE
-    # Colonnes de groupby
-    groupby_cols = ['CONTRAT', 'PÉRIODE', 'CODE_ARTICLE', 'PUHT']
-
-    # Colonnes numériques à sommer (exclure PDS_CONTRAT et les colonnes de groupby)
-    _numeric_cols = [col for col in journal_ventes.columns 
-                    if journal_ventes[col].dtype in ['int64', 'float64'] 
-                    and col not in ['PDS_CONTRAT'] + groupby_cols]
-
-    # Créer le dictionnaire d'agrégation
-    agg_dict = {col: 'sum' for col in _numeric_cols}
-    # Pour PDS_CONTRAT, prendre la première valeur (devrait être la même pour un contrat)
-    if 'PDS_CONTRAT' in journal_ventes.columns:
-        agg_dict['PDS_CONTRAT'] = 'first'
-
-    journal_grouped = journal_ventes.groupby(groupby_cols).agg(agg_dict).reset_index()
+    # Grouper et sommer par CONTRAT, PÉRIODE, CODE_ARTICLE et PUHT
+    with profiler.stage('groupement_journal', len(journal_ventes)) as _mesure:
+        journal_grouped = group_journal(journal_ventes)
+        _mesure['lignes_sortie'] = len(journal_grouped)
 
     mo.md(f"✅ **Données groupées:** {len(journal_grouped)} lignes (depuis {len(journal_ventes)} lignes originales)")
 
@@ -594,7 +3740,7 @@ def journal_grouped_display():
 
 @app.cell
 def _(journal_grouped):
-    journal_grouped
+    paged_table(journal_grouped, "Journal des ventes groupé")
     return
 
 
@@ -627,19 +3773,33 @@ def analyse_prix_section():
 
 
 @app.cell
-def _(journal_ventes):
+def _(journal_ventes, profiler, validation_mode_dropdown):
     mo.stop(journal_ventes is None, mo.md("⚠️ **En attente du chargement du journal des ventes**"))
 
     # Préparer les données avec les colonnes requises par le modèle Pandera
     journal_for_periods = journal_ventes[['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT']].copy()
 
     # Identifier les périodes de prix distinctes
-    price_periods = identify_price_periods(journal_for_periods)
+    with profiler.stage('periodes_prix', len(journal_for_periods)) as _mesure:
+        price_periods = identify_price_periods(journal_for_periods)
+        _mesure['lignes_sortie'] = len(price_periods)
+    with profiler.stage('validation_periodes', len(price_periods)) as _mesure:
+        _, periods_failures, _seconds = validate_frame(price_periods, 'PricePeriodModel', validation_mode_dropdown.value)
+        _mesure['lignes_sortie'] = len(periods_failures)
+    periods_validation = {
+        'schema': 'PricePeriodModel',
+        'mode': validation_mode_dropdown.value,
+        'lignes': len(price_periods),
+        'erreurs': len(periods_failures),
+        'duree_ms': round(_seconds * 1000, 1),
+        'part_chargement_pct': None,
+    }
 
     # Statistiques résumées
     total_contrats = price_periods['CONTRAT'].nunique() if not price_periods.empty else 0
     total_articles = price_periods['CODE_ARTICLE'].nunique() if not price_periods.empty else 0
     total_periods = len(price_periods)
+    grilles = price_periods.attrs.get('grilles', {'groupes': 0, 'grilles': 0, 'ratio': 0})
 
     # Analyse des changements de prix par contrat
     if not price_periods.empty:
@@ -662,11 +3822,22 @@ def _(journal_ventes):
     - **{total_articles}** articles différents  
     - **{total_periods}** périodes de prix identifiées
     - **{nb_articles_changes}** articles avec changements de prix
+    - **{grilles['grilles']}** grilles tarifaires distinctes pour {grilles['groupes']} combinaisons contrat-article (périodes calculées une fois par grille, ×{grilles['ratio']})
+    - {'✅ Périodes conformes à PricePeriodModel' if periods_failures.empty else f"⚠️ {periods_failures['index'].nunique()} périodes non conformes à PricePeriodModel (ex. deux prix facturés le même jour)"}
 
     Les périodes de prix ont été identifiées en détectant les changements de PUHT dans la séquence chronologique pour chaque combinaison CONTRAT-CODE_ARTICLE.
     """)
 
-    return (price_periods,)
+    return periods_validation, price_periods
+
+
+@app.cell(hide_code=True)
+def _(journal_validation, periods_validation, r15_validation):
+    # Durée de chaque validation Pandera, et part du temps de chargement correspondant
+    mo.accordion({
+        "⏱️ Validation Pandera par schéma": pd.DataFrame([r15_validation, journal_validation, periods_validation])
+    })
+    return
 
 
 @app.cell(hide_code=True)
@@ -702,59 +3873,111 @@ def _(price_periods):
     return
 
 
-@app.cell
-def _(price_periods, r15_filtered):
-    # Regrouper les données R15 par période de prix
-
-    # Vérifier qu'on a les données nécessaires
-    if r15_filtered.empty or price_periods.empty:
-        print("⚠️ Données manquantes pour le regroupement par période")
-        r15_by_period = pd.DataFrame()
-    else:
-        # Créer une liste pour stocker les résultats
-        period_aggregations = []
-
-        # Pour chaque période de prix identifiée
-        for _, period in price_periods.iterrows():
-            # Filtrer les données R15 pour cette période
-            mask = (
-                (r15_filtered['Date_Releve'] >= period['date_debut']) & 
-                (r15_filtered['Date_Releve'] <= period['date_fin'])
-            )
-            r15_period = r15_filtered[mask]
+@app.cell(hide_code=True)
+def _():
+    mapping_picker = mo.ui.file_browser(
+        initial_path=Path('~/data/ACC/').expanduser(),
+        selection_mode="file",
+        restrict_navigation=False,
+        label="Correspondance CONTRAT → PRM (.csv, optionnel : sinon PDS_CONTRAT / CONTRAT)",
+        filetypes=[".csv"]
+    )
+    mapping_picker
+    return (mapping_picker,)
 
-            if not r15_period.empty:
-                # Identifier les colonnes numériques (notamment celles commençant par EA)
-                numeric_cols = r15_period.select_dtypes(include=['float64', 'int64']).columns.tolist()
 
-                # Calculer les sommes pour les colonnes numériques
-                aggregation = {col: r15_period[col].sum() for col in numeric_cols}
+@app.cell
+def _(journal_ventes_raw, mapping_picker, perimetre_dropdown, profiler, r15, workspace):
+    # Correspondance contrat → PRM : CSV explicite (celui du périmètre, sinon celui choisi),
+    # sinon PDS_CONTRAT ou CONTRAT égaux à un pdl R15
+    _mapping_path = workspace.perimetre(perimetre_dropdown.value)['mapping'] if perimetre_dropdown.value else None
+    if _mapping_path is None and mapping_picker.value:
+        _mapping_path = mapping_picker.value[0].path
+    with profiler.stage('correspondance_prm', len(journal_ventes_raw)) as _mesure:
+        mapping_csv = pd.read_csv(_mapping_path, dtype=str) if _mapping_path else None
+        contract_prm = build_contract_prm_map(journal_ventes_raw, r15['pdl'], mapping_csv)
+        _mesure['lignes_sortie'] = len(contract_prm)
+
+    nb_contrats = journal_ventes_raw['CONTRAT'].nunique()
+    nb_contrats_associes = contract_prm['CONTRAT'].nunique()
+    mo.md(
+        f"""
+    **Correspondance contrat → PRM** : {nb_contrats_associes}/{nb_contrats} contrats associés
+    à {contract_prm['pdl'].nunique()} PRM.
+    {"" if nb_contrats_associes else "⚠️ Aucune correspondance : l'agrégation portera sur l'ensemble du périmètre."}
+    """
+    )
+    return (contract_prm,)
 
-                # Ajouter les informations de la période
-                aggregation['CONTRAT'] = period['CONTRAT']
-                aggregation['CODE_ARTICLE'] = period['CODE_ARTICLE']
-                aggregation['PUHT'] = period['PUHT']
-                aggregation['date_debut'] = period['date_debut']
-                aggregation['date_fin'] = period['date_fin']
-                aggregation['duree_jours'] = period['duree_jours']
-                aggregation['nb_lignes_r15'] = len(r15_period)
 
-                period_aggregations.append(aggregation)
+@app.cell(hide_code=True)
+def _():
+    # Totaux par période du dernier regroupement : en mode surveillance, seuls les relevés
+    # reçus depuis y sont ajoutés
+    get_period_totals, set_period_totals = mo.state(None)
+    return get_period_totals, set_period_totals
 
-        # Créer le DataFrame final
-        if period_aggregations:
-            r15_by_period = pd.DataFrame(period_aggregations)
 
-            # Réorganiser les colonnes pour mettre les infos de période en premier
-            info_cols = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours', 'nb_lignes_r15']
-            numeric_cols = [col for col in r15_by_period.columns if col not in info_cols]
-            r15_by_period = r15_by_period[info_cols + numeric_cols]
+@app.cell
+def _(
+    contract_prm,
+    date_regularisation,
+    debut_acc,
+    get_period_totals,
+    price_periods,
+    profiler,
+    r15_changes,
+    r15_filtered,
+    r15_generation,
+    set_period_totals,
+):
+    # Regrouper l'énergie ACC par période de prix (jointure d'intervalles sur les relevés
+    # filtrés, déjà triés par date) : par PRM du contrat si une correspondance existe,
+    # sinon sur tout le périmètre
+    _mapping = contract_prm if not contract_prm.empty else None
+    _precedent = get_period_totals()
+    _memes_periodes = (
+        _precedent is not None and _precedent['fin'] == date_regularisation
+        and _precedent['periodes'].equals(price_periods) and _precedent['correspondance'].equals(contract_prm)
+    )
+    if _memes_periodes and _precedent['generation'] == r15_generation and _precedent['debut'] == debut_acc:
+        _totals, _lignes = _precedent['totaux'], 0
+    elif _memes_periodes and r15_changes and _precedent['generation'] == r15_changes['depuis']:
+        # Mode surveillance : totaux précédents + relevés reçus - relevés retirés
+        _totals = update_period_totals(
+            _precedent['totaux'], price_periods, _mapping, r15_changes['ajoutes'], r15_changes['retires'],
+            debut_acc, _precedent['debut'], date_regularisation,
+        )
+        _lignes = len(r15_changes['ajoutes']) + len(r15_changes['retires'])
+    else:
+        _totals, _lignes = None, len(r15_filtered)
+    with profiler.stage('agregation_r15', _lignes) as _mesure:
+        if _totals is None:
+            _totals = r15_period_totals(r15_filtered, price_periods, _mapping)
+        r15_by_period = periods_with_totals(price_periods, _totals)
+        _mesure['lignes_sortie'] = len(r15_by_period)
+    set_period_totals({
+        'generation': r15_generation, 'debut': debut_acc, 'fin': date_regularisation,
+        'periodes': price_periods, 'correspondance': contract_prm, 'totaux': _totals,
+    })
 
-            print(f"✅ Regroupement effectué : {len(r15_by_period)} périodes avec données R15")
-            print(f"📊 Colonnes numériques agrégées : {', '.join(numeric_cols[:5])}{'...' if len(numeric_cols) > 5 else ''}")
-        else:
-            r15_by_period = pd.DataFrame()
-            print("⚠️ Aucune correspondance trouvée entre les périodes de prix et les données R15")
+    if r15_filtered.empty or price_periods.empty:
+        print("⚠️ Données manquantes pour le regroupement par période")
+    elif contract_prm.empty:
+        print("⚠️ Aucune correspondance contrat → PRM : chaque période somme tout le périmètre")
+    elif r15_by_period.empty:
+        print("⚠️ Aucune correspondance trouvée entre les périodes de prix et les données R15")
+    else:
+        numeric_cols = r15_filtered.select_dtypes(include=['float64', 'float32', 'int64']).columns.tolist()
+        print(f"✅ Regroupement effectué : {len(r15_by_period)} périodes avec données R15")
+        print(f"📊 Colonnes numériques agrégées : {', '.join(numeric_cols[:5])}{'...' if len(numeric_cols) > 5 else ''}")
+    # Correspondance partielle : les périodes des contrats sans PRM n'ont aucun relevé
+    _sans_prm = unmapped_contracts(price_periods, contract_prm)
+    if _sans_prm:
+        print(
+            f"⚠️ {len(_sans_prm)} contrat(s) sans PRM associé, absents du regroupement : "
+            f"{', '.join(map(str, _sans_prm[:10]))}{'…' if len(_sans_prm) > 10 else ''}"
+        )
 
     r15_by_period
     return (r15_by_period,)
@@ -767,5 +3990,245 @@ def _(r15_by_period):
     return
 
 
+@app.cell(hide_code=True)
+def flux_energie_section():
+    mo.md(
+        r"""
+    ## 📈 Flux d'Énergie ACC
+
+    Énergie autoconsommée et alloproduite par jour, lue dans le cube d'énergie, avec les
+    paliers de prix de l'article choisi en arrière-plan.
+
+    - **Vue d'ensemble** : toute la période, réduite par LTTB (Largest-Triangle-Three-Buckets)
+    - **Zoom** : sélectionner une plage sur la vue d'ensemble recalcule le détail côté serveur
+      sur cette seule plage, à la même résolution maximale
+
+    Chaque graphique reçoit au plus le nombre de points choisi, quelle que soit la longueur de l'historique.
+    """
+    )
+    return
+
+
+@app.cell
+def _(energy_cube, price_periods):
+    flux_prm_dropdown = mo.ui.dropdown(
+        options={'Tout le périmètre': None, **{_pdl: _pdl for _pdl in energy_cube.jour['pdl'].unique()}},
+        value='Tout le périmètre',
+        searchable=True,
+        label="PRM",
+    )
+    flux_article_dropdown = mo.ui.dropdown(
+        options={'Tous les articles': None, **{_code: _code for _code in sorted(price_periods['CODE_ARTICLE'].unique())}},
+        value='Tous les articles',
+        label="Paliers de prix de l'article",
+    )
+    flux_points_slider = mo.ui.slider(500, 5_000, step=500, value=2_000, label="Points max par graphique")
+    mo.hstack([flux_prm_dropdown, flux_article_dropdown, flux_points_slider], justify='start')
+    return flux_article_dropdown, flux_points_slider, flux_prm_dropdown
+
+
+@app.cell
+def _(date_regularisation, debut_acc, energy_cube, flux_points_slider, flux_prm_dropdown):
+    _flows = energy_flows(
+        energy_cube, debut_acc, date_regularisation, flux_prm_dropdown.value, flux_points_slider.value
+    )
+    flux_overview = mo.ui.altair_chart(
+        energy_flow_chart(_flows, titre="Vue d'ensemble : sélectionner une plage pour zoomer", zoom=True),
+        legend_selection=False,
+    )
+    flux_overview
+    return (flux_overview,)
+
+
+@app.cell
+def _(
+    date_regularisation,
+    debut_acc,
+    energy_cube,
+    flux_article_dropdown,
+    flux_overview,
+    flux_points_slider,
+    flux_prm_dropdown,
+    price_periods,
+):
+    # Plage du zoom : bornes de la sélection (ms epoch ou ISO), sinon toute la période
+    _zoom = (flux_overview.selections or {}).get('zoom', {}).get('jour')
+    if _zoom and len(_zoom) == 2:
+        _bornes = [pd.to_datetime(_v, unit='ms', utc=True) if isinstance(_v, (int, float)) else pd.to_datetime(_v, utc=True) for _v in _zoom]
+        _debut = max(_bornes[0].tz_convert('Europe/Paris').normalize(), debut_acc)
+        _fin = min(_bornes[1].tz_convert('Europe/Paris').normalize() + pd.Timedelta(days=1), date_regularisation)
+    else:
+        _debut, _fin = debut_acc, date_regularisation
+
+    _flows = energy_flows(energy_cube, _debut, _fin, flux_prm_dropdown.value, flux_points_slider.value)
+    _bands = price_bands(price_periods, flux_article_dropdown.value, _debut, _fin)
+    mo.vstack([
+        energy_flow_chart(_flows, _bands, titre=f"Détail du {_debut:%d/%m/%Y} au {_fin:%d/%m/%Y}"),
+        mo.md(f"{len(_flows)} points affichés, {len(_bands)} paliers de prix"),
+    ])
+    return
+
+
+@app.cell(hide_code=True)
+def simulation_section():
+    mo.md(
+        r"""
+    ## 🧮 Simulation de Scénarios Tarifaires
+
+    Montants facturés (PUHT × énergie autoconsommée de l'article) par contrat pour des
+    grilles de prix alternatives et des dates de régularisation antérieures, sans
+    relancer le notebook :
+
+    - **Grilles** : tous les PUHT des périodes multipliés par un facteur, de −v % à +v %
+    - **Dates** : la date de régularisation reculée de 0 à n mois, à grille inchangée
+
+    Les énergies par période sont lues une fois dans le cube, puis toutes les grilles
+    sont évaluées d'un coup (`simulate_tariffs`).
+    """
+    )
+    return
+
+
+@app.cell
+def _():
+    simulation_variation_slider = mo.ui.slider(0, 50, value=10, label="Variation des PUHT (± %)")
+    simulation_grilles_slider = mo.ui.slider(3, 501, step=2, value=101, label="Nombre de grilles")
+    simulation_mois_slider = mo.ui.slider(0, 24, value=12, label="Dates de régularisation antérieures (mois)")
+    mo.hstack([simulation_variation_slider, simulation_grilles_slider, simulation_mois_slider], justify='start')
+    return simulation_grilles_slider, simulation_mois_slider, simulation_variation_slider
+
+
+@app.cell
+def _(
+    contract_prm,
+    date_regularisation,
+    debut_acc,
+    energy_cube,
+    price_periods,
+    profiler,
+    simulation_grilles_slider,
+    simulation_mois_slider,
+    simulation_variation_slider,
+):
+    _facteurs = 1 + np.linspace(-1, 1, simulation_grilles_slider.value) * simulation_variation_slider.value / 100
+    _fins = [date_regularisation - pd.DateOffset(months=_m) for _m in range(simulation_mois_slider.value + 1)]
+    _mapping = contract_prm if not contract_prm.empty else None
+    with profiler.stage('simulation_tarifs', len(price_periods)) as _mesure:
+        # Grilles (K, P) en tableau : une colonne par grille, repérée par sa position
+        # (des facteurs égaux, à variation nulle, resteraient des scénarios distincts)
+        _montants = simulate_tariffs(
+            energy_cube, price_periods,
+            np.outer(_facteurs, price_periods['PUHT'].to_numpy(dtype=np.float64)),
+            _mapping, debut_acc, [date_regularisation],
+        )
+        _par_date = simulate_tariffs(energy_cube, price_periods, price_periods['PUHT'], _mapping, debut_acc, _fins)
+        _mesure['lignes_sortie'] = _montants.size + _par_date.size
+
+    _grilles = pd.DataFrame({'facteur_prix': _facteurs, 'montant_total': _montants.sum().to_numpy()})
+    _dates = pd.DataFrame({'date_regularisation': _fins, 'montant_total': _par_date.sum().to_numpy()})
+    simulation_contrats = pd.DataFrame({
+        'actuel': _montants.iloc[:, len(_facteurs) // 2],
+        'grille_min': _montants.iloc[:, 0],
+        'grille_max': _montants.iloc[:, -1],
+        f'au_{_fins[-1]:%d/%m/%Y}': _par_date.iloc[:, -1],
+    }).reset_index()
+
+    mo.vstack([
+        mo.hstack([
+            simulation_chart(_grilles, 'facteur_prix:Q', 'Facteur appliqué aux PUHT', f'{len(_facteurs)} grilles'),
+            simulation_chart(
+                _dates, 'date_regularisation:T', 'Date de régularisation', f'{len(_fins)} dates de régularisation'
+            ),
+        ]),
+        paged_table(simulation_contrats, "Montants par contrat"),
+    ])
+    return (simulation_contrats,)
+
+
+@app.cell(hide_code=True)
+def espace_travail_section():
+    mo.md(
+        r"""
+    ## 🗂️ Espace de Travail Multi-Périmètres
+
+    Chaque opération d'autoconsommation collective est enregistrée comme un périmètre
+    (dossier R15, journal des ventes, correspondance CONTRAT → PRM optionnelle) dans le
+    registre `$ACC_WORKSPACE` (par défaut `~/data/ACC/perimetres.csv`, au format du
+    manifeste d'`acc_batch.py`). Chaque périmètre garde ses propres caches à côté de ses
+    données ; les derniers périmètres ouverts restent en mémoire, si bien que revenir à
+    l'un d'eux depuis la liste « Périmètre ACC » est immédiat tant que ses fichiers n'ont pas changé.
+
+    La synthèse ne lit que les cubes d'énergie des périmètres sélectionnés.
+    """
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _():
+    perimetre_nom_input = mo.ui.text(placeholder="ex. Résidence des Lilas", label="Nom du périmètre")
+    perimetre_register_button = mo.ui.run_button(label="Enregistrer la sélection manuelle comme périmètre")
+    mo.hstack([perimetre_nom_input, perimetre_register_button], justify='start')
+    return perimetre_nom_input, perimetre_register_button
+
+
+@app.cell(hide_code=True)
+def _(
+    date_regularisation_picker,
+    folder_picker,
+    journal_picker,
+    mapping_picker,
+    perimetre_nom_input,
+    perimetre_register_button,
+    set_dernier_perimetre,
+    workspace,
+):
+    mo.stop(not perimetre_register_button.value)
+    mo.stop(
+        not perimetre_nom_input.value.strip() or not folder_picker.value or not journal_picker.value,
+        mo.md("⚠️ **Nom, dossier R15 et journal des ventes sont requis pour enregistrer un périmètre**"),
+    )
+    workspace.register(
+        perimetre_nom_input.value.strip(),
+        folder_picker.value[0].path,
+        journal_picker.value[0].path,
+        mapping_picker.value[0].path if mapping_picker.value else None,
+        # Date de régularisation retenue par acc_batch.py pour ce périmètre
+        date_regularisation=date_regularisation_picker.value,
+    )
+    set_dernier_perimetre(perimetre_nom_input.value.strip())
+    mo.md(f"✅ Périmètre **{perimetre_nom_input.value.strip()}** enregistré dans `{workspace.registry}`")
+    return
+
+
+@app.cell(hide_code=True)
+def _(get_dernier_perimetre, workspace):
+    get_dernier_perimetre()
+    perimetres_multiselect = mo.ui.multiselect(options=workspace.noms, label="Périmètres à comparer")
+    perimetres_multiselect
+    return (perimetres_multiselect,)
+
+
+@app.cell
+def _(perimetres_multiselect, workspace):
+    mo.stop(not perimetres_multiselect.value)
+    workspace.summary(perimetres_multiselect.value)
+    return
+
+
+@app.cell(hide_code=True)
+def _(journal_grouped, journal_validation, profiler, r15_by_period, r15_validation):
+    # Dépend des dernières sorties de chaque branche : s'exécute après toutes les étapes mesurées
+    _mesures = profiler.summary()
+    _contenu = [_mesures]
+    if profiler.hottest_profile:
+        _etape, _texte = profiler.hottest_profile
+        _contenu += [mo.md(f"**Profil cProfile de l'étape la plus lente : `{_etape}`**"), mo.plain_text(_texte)]
+    mo.accordion({
+        f"⏱️ Instrumentation : {len(_mesures)} étapes, {_mesures['mur_s'].sum():.2f} s": mo.vstack(_contenu)
+    })
+    return
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,271 @@
+"""
+Exécution en lot de la régularisation ACC, sans l'interface Marimo.
+
+Enchaîne les mêmes étapes que le notebook `acc.py` (chargement R15 typé, détection
+du début ACC, filtrage, sélection des articles CONSO, groupement, identification des
+périodes de prix et agrégation R15 par période) et écrit `price_periods` et
+`r15_by_period` sur disque. L'agrégation se fait par PRM du contrat dès qu'une
+correspondance contrat → PRM est trouvée (CSV `--mapping`, sinon PDS_CONTRAT ou
+CONTRAT égaux à un pdl R15), sinon sur l'ensemble du périmètre.
+
+Usage :
+    # Un seul périmètre
+    python acc_batch.py --r15 ~/data/ACC/R15 --journal ~/data/ACC/journal.xlsx \\
+        --date 2024-06-30 --output resultats/
+
+    # Plusieurs périmètres, traités en parallèle
+    python acc_batch.py --manifest perimetres.csv --output resultats/ --jobs 4
+
+Le manifeste est un fichier CSV avec les colonnes `nom`, `r15`, `journal` et
+`date_regularisation`, et optionnellement `mapping` ; les chemins relatifs sont résolus depuis le dossier du
+manifeste. Chaque périmètre est écrit dans `<output>/<nom>/`, et un rapport des
+durées par étape est écrit dans `<output>/rapport.json`.
+
+Avec `--streaming`, les relevés R15 ne sont jamais chargés en entier : le cache Parquet
+est construit par lots de fichiers (`--files-per-chunk`) puis parcouru par morceaux,
+si bien que la mémoire ne dépend plus de la longueur de l'historique.
+
+Les mesures de chaque étape (temps mur et CPU, hausse du pic mémoire, volumes) sont
+ajoutées au journal JSON-lines `--perf-log` ; avec `--profile`, le profil cProfile
+de l'étape la plus lente est écrit dans `<output>/<nom>/profil.txt`.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from acc import (
+    PipelineProfiler,
+    aggregate_r15_by_period,
+    aggregate_r15_parquet,
+    build_contract_prm_map,
+    detect_debut_acc,
+    filter_journal,
+    filter_r15,
+    group_journal,
+    identify_price_periods,
+    iter_r15_parquet,
+    load_journal_ventes,
+    load_r15_cached,
+    r15_parquet_cached,
+    select_conso,
+    unmapped_contracts,
+)
+
+
+def write_frame(df: pd.DataFrame, path: Path, fmt: str) -> None:
+    """Écrit un DataFrame au format Parquet ou CSV (extension ajoutée à `path`)."""
+    if fmt == 'csv':
+        df.to_csv(path.with_suffix('.csv'), index=False)
+    else:
+        df.to_parquet(path.with_suffix('.parquet'), index=False)
+
+
+def run_perimetre(
+    nom: str,
+    r15_folder: Path,
+    journal_path: Path,
+    date_regularisation: str,
+    output: Path,
+    fmt: str = 'parquet',
+    workers: int = 1,
+    mapping_path: Path | None = None,
+    perf_log: Path | None = None,
+    profile: bool = False,
+    streaming: bool = False,
+    files_per_chunk: int = 20,
+) -> dict:
+    """
+    Exécute la régularisation d'un périmètre et écrit ses résultats dans `output/nom`.
+
+    Avec `streaming`, les relevés R15 ne sont jamais chargés en entier : le cache
+    Parquet est (re)construit par lots de `files_per_chunk` fichiers, puis parcouru
+    par morceaux pour le début ACC, la liste des PRM et l'agrégation par période.
+
+    Returns:
+        dict: Rapport du périmètre (statut, durée de chaque étape en secondes,
+            volumes traités, ou message d'erreur)
+    """
+    profiler = PipelineProfiler(perf_log, profile=profile, session=f'{nom}@{time.strftime("%Y-%m-%dT%H:%M:%S")}')
+
+    def durees():
+        return {record['etape']: round(record['mur_s'], 3) for record in profiler.records.values()}
+
+    try:
+        date_fin = pd.to_datetime(date_regularisation, utc=True)
+        if streaming:
+            with profiler.stage('chargement_r15') as mesure:
+                r15_path, _, conversions = r15_parquet_cached(r15_folder, files_per_chunk=files_per_chunk)
+                nb_lignes_r15 = pq.ParquetFile(r15_path).metadata.num_rows
+                mesure['lignes_sortie'] = nb_lignes_r15
+            with profiler.stage('debut_acc', nb_lignes_r15) as mesure:
+                # Un seul parcours des colonnes utiles : début ACC, PRM et relevés ACC de la période.
+                # debut_acc étant le premier relevé ACC, seule la borne de fin filtre réellement.
+                debuts, prms, nb_lignes_r15_filtrees = [], set(), 0
+                for chunk in iter_r15_parquet(r15_path, ['pdl', 'Date_Releve', 'Autoconsommation_Collective']):
+                    debuts.append(detect_debut_acc(chunk))
+                    prms.update(chunk['pdl'].astype(str).unique())
+                    nb_lignes_r15_filtrees += len(filter_r15(chunk, pd.Timestamp.min.tz_localize('UTC'), date_fin))
+                debut_acc = pd.Series(debuts, dtype='datetime64[ns, UTC]').min()
+                r15_pdl = pd.Series(sorted(prms), dtype=str)
+                mesure['lignes_sortie'] = nb_lignes_r15_filtrees
+        else:
+            with profiler.stage('chargement_r15') as mesure:
+                r15, _ = load_r15_cached(r15_folder, max_workers=workers)
+                conversions = r15.attrs.get('conversions', {})
+                nb_lignes_r15 = len(r15)
+                mesure['lignes_sortie'] = nb_lignes_r15
+            with profiler.stage('debut_acc', len(r15)):
+                debut_acc = detect_debut_acc(r15)
+                r15_pdl = r15['pdl']
+            with profiler.stage('filtrage_r15', len(r15)) as mesure:
+                r15_filtered = filter_r15(r15, debut_acc, date_fin)
+                nb_lignes_r15_filtrees = len(r15_filtered)
+                mesure['lignes_sortie'] = nb_lignes_r15_filtrees
+        with profiler.stage('chargement_journal') as mesure:
+            journal, _ = load_journal_ventes(journal_path)
+            mesure['lignes_sortie'] = len(journal)
+        with profiler.stage('selection_conso', len(journal)) as mesure:
+            journal_conso = select_conso(filter_journal(journal, debut_acc, date_fin))
+            mesure['lignes_sortie'] = len(journal_conso)
+        with profiler.stage('groupement_journal', len(journal_conso)) as mesure:
+            journal_grouped = group_journal(journal_conso)
+            mesure['lignes_sortie'] = len(journal_grouped)
+        with profiler.stage('periodes_prix', len(journal_conso)) as mesure:
+            price_periods = identify_price_periods(journal_conso[['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT']])
+            mesure['lignes_sortie'] = len(price_periods)
+        with profiler.stage('correspondance_prm', len(journal)) as mesure:
+            mapping = pd.read_csv(mapping_path, dtype=str) if mapping_path else None
+            contract_prm = build_contract_prm_map(journal, r15_pdl, mapping)
+            contrats_sans_prm = unmapped_contracts(price_periods, contract_prm)
+            mesure['lignes_sortie'] = len(contract_prm)
+        with profiler.stage('agregation_r15', len(price_periods)) as mesure:
+            if streaming:
+                r15_by_period = aggregate_r15_parquet(
+                    r15_path, price_periods, contract_prm if not contract_prm.empty else None, debut_acc, date_fin
+                )
+            else:
+                r15_by_period = aggregate_r15_by_period(
+                    r15_filtered, price_periods, contract_prm if not contract_prm.empty else None
+                )
+            mesure['lignes_sortie'] = len(r15_by_period)
+        with profiler.stage('ecriture', len(r15_by_period)):
+            out = output / nom
+            out.mkdir(parents=True, exist_ok=True)
+            write_frame(price_periods, out / 'price_periods', fmt)
+            write_frame(r15_by_period, out / 'r15_by_period', fmt)
+        if profiler.hottest_profile:
+            etape_lente, texte = profiler.hottest_profile
+            (out / 'profil.txt').write_text(f"Étape la plus lente : {etape_lente}\n\n{texte}")
+    except Exception as e:
+        return {'nom': nom, 'statut': 'erreur', 'erreur': f'{type(e).__name__}: {e}', 'durees_s': durees()}
+
+    return {
+        'nom': nom,
+        'statut': 'ok',
+        'debut_acc': str(debut_acc),
+        'nb_lignes_r15': nb_lignes_r15,
+        'nb_lignes_r15_filtrees': nb_lignes_r15_filtrees,
+        'valeurs_r15_invalides': conversions,
+        'nb_lignes_journal_groupe': len(journal_grouped),
+        'nb_periodes': len(price_periods),
+        'nb_grilles_tarifaires': price_periods.attrs.get('grilles', {}).get('grilles', 0),
+        'nb_contrats_associes_prm': int(contract_prm['CONTRAT'].nunique()),
+        'contrats_sans_prm': [str(contrat) for contrat in contrats_sans_prm],
+        'durees_s': durees(),
+        'duree_totale_s': round(sum(durees().values()), 3),
+    }
+
+
+def read_manifest(path: Path) -> list[dict]:
+    """Lit un manifeste CSV de périmètres (nom, r15, journal, date_regularisation[, mapping])."""
+    manifest = pd.read_csv(path, dtype=str)
+    missing = {'nom', 'r15', 'journal', 'date_regularisation'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Colonnes manquantes dans le manifeste : {sorted(missing)}")
+
+    base = path.parent
+    return [
+        {
+            'nom': row['nom'],
+            'r15_folder': base / Path(row['r15']).expanduser(),
+            'journal_path': base / Path(row['journal']).expanduser(),
+            'date_regularisation': row['date_regularisation'],
+            'mapping_path': base / Path(row['mapping']).expanduser() if pd.notna(row.get('mapping')) else None,
+        }
+        for _, row in manifest.iterrows()
+    ]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Régularisation ACC en lot, sans interface Marimo.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--r15', type=Path, help="Dossier des fichiers de flux R15")
+    source.add_argument('--manifest', type=Path, help="Manifeste CSV de périmètres à traiter")
+    parser.add_argument('--journal', type=Path, help="Fichier Excel du journal des ventes détaillés")
+    parser.add_argument('--date', help="Date de régularisation (AAAA-MM-JJ)")
+    parser.add_argument('--mapping', type=Path, help="CSV de correspondance CONTRAT → pdl (optionnel)")
+    parser.add_argument('--nom', default='perimetre', help="Nom du périmètre (dossier de sortie)")
+    parser.add_argument('--output', type=Path, required=True, help="Dossier de sortie")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--jobs', type=int, default=1, help="Périmètres traités en parallèle")
+    parser.add_argument('--workers', type=int, default=1, help="Processus d'analyse R15 par périmètre")
+    parser.add_argument('--perf-log', type=Path, help="Journal JSON-lines des mesures par étape")
+    parser.add_argument('--profile', action='store_true', help="Profil cProfile de l'étape la plus lente")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Relevés R15 traités par morceaux, sans charger l'historique en mémoire")
+    parser.add_argument('--files-per-chunk', type=int, default=20,
+                        help="Fichiers de flux R15 analysés par lot en mode --streaming")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        if not args.journal or not args.date:
+            parser.error("--journal et --date sont requis avec --r15")
+        jobs = [{
+            'nom': args.nom,
+            'r15_folder': args.r15.expanduser(),
+            'journal_path': args.journal.expanduser(),
+            'date_regularisation': args.date,
+            'mapping_path': args.mapping.expanduser() if args.mapping else None,
+        }]
+
+    options = {
+        'output': args.output, 'fmt': args.format, 'workers': args.workers,
+        'perf_log': args.perf_log, 'profile': args.profile,
+        'streaming': args.streaming, 'files_per_chunk': args.files_per_chunk,
+    }
+    start = time.perf_counter()
+    if args.jobs <= 1:
+        rapports = [run_perimetre(**job, **options) for job in jobs]
+    else:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            futures = [executor.submit(run_perimetre, **job, **options) for job in jobs]
+            rapports = [future.result() for future in as_completed(futures)]
+        rapports.sort(key=lambda r: r['nom'])
+
+    for rapport in rapports:
+        if rapport['statut'] == 'ok':
+            print(f"✅ {rapport['nom']} : {rapport['nb_periodes']} périodes en {rapport['duree_totale_s']} s")
+            if rapport['contrats_sans_prm']:
+                print(f"   ⚠️ {len(rapport['contrats_sans_prm'])} contrat(s) sans PRM associé, absents de r15_by_period")
+        else:
+            print(f"❌ {rapport['nom']} : {rapport['erreur']}")
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    (args.output / 'rapport.json').write_text(json.dumps({
+        'duree_totale_s': round(time.perf_counter() - start, 3),
+        'perimetres': rapports,
+    }, indent=2, ensure_ascii=False))
+
+    return 0 if all(r['statut'] == 'ok' for r in rapports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+Banc d'essai des étapes du pipeline ACC sur des données synthétiques.
+
+Génère des relevés R15 bruts (texte, comme en sortie de process_flux) et un journal
+des ventes réalistes, puis chronomètre séparément chaque étape du notebook : typage
+R15, détection du début ACC, filtrage par dates, groupement du journal,
+identification des périodes de prix, agrégation R15 par période, construction du
+cube d'énergie et totaux par période lus dans le cube (simulations), et série
+réduite des flux d'énergie affichée en graphique.
+
+Usage :
+    python acc_bench.py --preset 1m --output bench.json
+    python acc_bench.py --prms 500 --years 3 --contracts 800 --price-changes 6
+    python acc_bench.py --preset 1m --compare bench.json   # compare à un run précédent
+
+Les préréglages vont de 1k à 10M lignes R15 (`--preset 1k|100k|1m|10m`).
+
+Avec `--startup`, mesure plutôt le démarrage à froid de `marimo run acc.py` : délai
+jusqu'à la réponse du serveur, jusqu'au noyau prêt, puis jusqu'à la fin de la première
+exécution des cellules (page d'accueil interactive). `--no-bytecode` ignore le
+bytecode précompilé, comme une image construite sans `poetry install --compile` :
+    python acc_bench.py --startup --repeat 5 --output demarrage.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from acc import (
+    EnergyCube,
+    R15Store,
+    aggregate_r15_by_period,
+    detect_debut_acc,
+    energy_flows,
+    filter_r15,
+    group_journal,
+    identify_price_periods,
+    select_conso,
+    type_r15,
+)
+
+# Nombre de lignes R15 ≈ prms × years × 365
+PRESETS = {
+    '1k': {'prms': 3, 'years': 1, 'contracts': 5},
+    '100k': {'prms': 100, 'years': 3, 'contracts': 150},
+    '1m': {'prms': 550, 'years': 5, 'contracts': 800},
+    '10m': {'prms': 2750, 'years': 10, 'contracts': 4000},
+}
+
+
+def generate_r15(prms: int, years: int, start: str = '2015-01-01', seed: int = 0) -> pd.DataFrame:
+    """
+    Relevés R15 quotidiens bruts (colonnes texte), comme renvoyés par process_flux.
+
+    Chaque PRM entre dans l'ACC (flag '0') à une date aléatoire de la première année.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, periods=years * 365, freq='D', tz='Europe/Paris')
+    n = prms * len(days)
+
+    day_idx = np.tile(np.arange(len(days)), prms)
+    prm_idx = np.repeat(np.arange(prms), len(days))
+    entree_acc = rng.integers(0, min(365, len(days)), prms)
+
+    day_str = np.array(days.strftime('%Y-%m-%dT%H:%M:%S%z').str.replace(r'(\d{2})(\d{2})$', r'\1:\2', regex=True))
+    prm_str = np.array([f'{14000000000000 + i}' for i in range(prms)])
+
+    df = pd.DataFrame({
+        'pdl': prm_str[prm_idx],
+        'Id_Affaire': np.array([f'A{i:06d}' for i in range(prms)])[prm_idx],
+        'Date_Releve': day_str[day_idx],
+        'Statut_Releve': 'INITIAL',
+        'Type_Compteur': 'CCB',
+        'Nature_Index': 'REEL',
+        'Autoconsommation_Collective': np.where(day_idx >= entree_acc[prm_idx], '0', '1'),
+        'Unité': 'kWh',
+    })
+    for classe in ['Autoconsommee', 'Alloproduite']:
+        for poste in ['HP', 'HC']:
+            df[f'EA_{classe}_{poste}'] = rng.integers(0, 50_000, n).astype(str)
+    return df
+
+
+def generate_journal(
+    contracts: int,
+    years: int,
+    articles: int = 2,
+    price_changes: int = 4,
+    start: str = '2015-01-01',
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Journal des ventes mensuel typé (DATEFACT en UTC, PUHT numérique).
+
+    Chaque article CONSO suit une grille tarifaire commune à tous les contrats, avec
+    `price_changes` changements de prix répartis sur l'historique ; un article
+    d'abonnement est ajouté pour exercer le filtrage CONSO.
+    """
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(start, periods=years * 12, freq='MS', tz='UTC')
+    codes = [f'CONSO_{poste}' for poste in ['HP', 'HC', 'BASE', 'HPH', 'HCH', 'HPB', 'HCB'][:articles]] + ['ABONNEMENT']
+
+    # Grille tarifaire par article : paliers de prix sur l'historique
+    paliers = np.sort(rng.choice(np.arange(1, len(months)), size=min(price_changes, len(months) - 1), replace=False))
+    grille = {
+        code: np.round(0.15 + rng.random(len(paliers) + 1) * 0.1, 4)[np.searchsorted(paliers, np.arange(len(months)), side='right')]
+        for code in codes
+    }
+
+    contrat_idx = np.repeat(np.arange(contracts), len(months) * len(codes))
+    month_idx = np.tile(np.repeat(np.arange(len(months)), len(codes)), contracts)
+    code_idx = np.tile(np.arange(len(codes)), contracts * len(months))
+    n = len(contrat_idx)
+
+    puht = np.empty(n)
+    for i, code in enumerate(codes):
+        mask = code_idx == i
+        puht[mask] = grille[code][month_idx[mask]]
+
+    quantite = rng.integers(0, 2_000, n).astype(float)
+    return pd.DataFrame({
+        'CONTRAT': np.array([f'C{i:06d}' for i in range(contracts)])[contrat_idx],
+        'CODE_ARTICLE': np.array(codes)[code_idx],
+        'PUHT': puht,
+        'DATEFACT': months[month_idx] + pd.to_timedelta(rng.integers(0, 10, n), unit='D'),
+        'PÉRIODE': months[month_idx].strftime('%m/%Y'),
+        'PDS_CONTRAT': rng.choice([6, 9, 12, 36], contracts)[contrat_idx],
+        'QUANTITE': quantite,
+        'MONTANT_HT': quantite * puht,
+    })
+
+
+def timed(fn, repeat: int, setup=None):
+    """Meilleur temps (s) sur `repeat` exécutions, et le résultat de la dernière."""
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        result = fn(arg) if setup else fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def git_version() -> str | None:
+    """Version du dépôt (git describe), None hors dépôt git."""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment() -> dict:
+    """Versions de Python et des bibliothèques, architecture."""
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def run(prms: int, years: int, contracts: int, articles: int, price_changes: int, repeat: int) -> dict:
+    """Génère les données et chronomètre chaque étape ; renvoie le rapport JSON."""
+    r15_raw = generate_r15(prms, years)
+    journal = generate_journal(contracts, years, articles, price_changes)
+    date_regularisation = pd.Timestamp('2015-01-01', tz='UTC') + pd.DateOffset(years=years) - pd.Timedelta(days=1)
+    stages = {}
+
+    def record(name, seconds, rows_in, rows_out):
+        stages[name] = {'secondes': round(seconds, 6), 'lignes_entree': rows_in, 'lignes_sortie': rows_out}
+
+    t, r15 = timed(type_r15, repeat, setup=r15_raw.copy)
+    record('typage_r15', t, len(r15_raw), len(r15))
+
+    t, debut_acc = timed(lambda: detect_debut_acc(r15), repeat)
+    record('debut_acc', t, len(r15), 1)
+
+    t, store = timed(lambda: R15Store(r15), repeat)
+    record('construction_store', t, len(r15), len(store))
+
+    t, r15_filtered = timed(lambda: filter_r15(r15, debut_acc, date_regularisation), repeat)
+    record('filtrage_r15_masque', t, len(r15), len(r15_filtered))
+
+    t, r15_slice = timed(lambda: store.slice(debut_acc, date_regularisation), repeat)
+    record('filtrage_r15_store', t, len(store), len(r15_slice))
+
+    journal_conso = select_conso(journal)
+    t, journal_grouped = timed(lambda: group_journal(journal_conso), repeat)
+    record('groupement_journal', t, len(journal_conso), len(journal_grouped))
+
+    journal_for_periods = journal_conso[['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT']]
+    t, price_periods = timed(lambda: identify_price_periods(journal_for_periods), repeat)
+    record('periodes_prix', t, len(journal_for_periods), len(price_periods))
+
+    t, r15_by_period = timed(lambda: aggregate_r15_by_period(r15_slice, price_periods), repeat)
+    record('agregation_r15', t, len(r15_slice), len(r15_by_period))
+
+    t, cube = timed(lambda: EnergyCube.from_r15(r15), repeat)
+    record('construction_cube', t, len(r15), len(cube.jour))
+
+    t, _ = timed(lambda: cube.period_totals(price_periods, None, debut_acc, [date_regularisation]), repeat)
+    record('agregation_cube', t, len(cube.jour), len(price_periods))
+
+    t, flows = timed(lambda: energy_flows(cube, debut_acc, date_regularisation), repeat)
+    record('flux_energie', t, len(cube.jour), len(flows))
+
+    return {
+        'version': git_version(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environnement': environment(),
+        'parametres': {
+            'prms': prms, 'years': years, 'contracts': contracts,
+            'articles': articles, 'price_changes': price_changes, 'repeat': repeat,
+        },
+        'etapes': stages,
+    }
+
+
+def startup_once(notebook: Path, bytecode: bool = True, timeout: float = 120) -> dict:
+    """
+    Démarre `marimo run` dans un nouveau processus et chronomètre son démarrage à froid.
+
+    Simule le navigateur : attend la page, ouvre la session websocket, demande
+    l'instanciation du notebook et attend la fin de la première exécution des cellules.
+    Renvoie les délais (s) depuis le lancement du processus.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ)
+    cache = None
+    if not bytecode:
+        # Préfixe de cache vide et non écrit : tous les modules sont recompilés depuis les sources
+        cache = tempfile.TemporaryDirectory()
+        env.update(PYTHONDONTWRITEBYTECODE='1', PYTHONPYCACHEPREFIX=cache.name)
+    url = f'127.0.0.1:{port}'
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'marimo', 'run', str(notebook), '--headless', '--port', str(port), '--no-token'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if server.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError(f"marimo run n'a pas démarré (code {server.returncode})")
+            try:
+                page = urllib.request.urlopen(f'http://{url}/', timeout=1).read().decode()
+                break
+            except OSError:
+                time.sleep(0.02)
+        times = {'serveur': time.perf_counter() - start}
+        token = re.search(r'marimo-server-token data-token="([^"]+)"', page).group(1)
+        session = f's_{uuid.uuid4().hex[:6]}'
+
+        async def session_run() -> int:
+            import websockets
+
+            async with websockets.connect(f'ws://{url}/ws?session_id={session}', max_size=None) as ws:
+                while True:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+                    if message['op'] == 'kernel-ready':
+                        times['noyau'] = time.perf_counter() - start
+                        request = urllib.request.Request(
+                            f'http://{url}/api/kernel/instantiate',
+                            data=json.dumps({'object_ids': [], 'values': [], 'auto_run': True}).encode(),
+                            headers={'Content-Type': 'application/json', 'Marimo-Session-Id': session,
+                                     'Marimo-Server-Token': token},
+                        )
+                        await asyncio.to_thread(urllib.request.urlopen, request)
+                        cells = len(message['data']['cell_ids'])
+                    elif message['op'] == 'completed-run':
+                        times['page'] = time.perf_counter() - start
+                        return cells
+
+        times['cellules'] = asyncio.run(session_run())
+        return times
+    finally:
+        server.terminate()
+        server.wait()
+        if cache:
+            cache.cleanup()
+
+
+def run_startup(notebook: Path, repeat: int, bytecode: bool = True) -> dict:
+    """Démarrages à froid répétés ; rapport JSON au même format que run (médiane par étape)."""
+    runs = [startup_once(notebook, bytecode) for _ in range(repeat)]
+    stages = {
+        f'demarrage_{name}': {
+            'secondes': round(statistics.median(r[name] for r in runs), 6),
+            'min': round(min(r[name] for r in runs), 6),
+            'max': round(max(r[name] for r in runs), 6),
+        }
+        for name in ('serveur', 'noyau', 'page')
+    }
+    stages['demarrage_page']['cellules'] = runs[0]['cellules']
+    return {
+        'version': git_version(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environnement': environment(),
+        'parametres': {'startup': str(notebook.name), 'bytecode': bytecode, 'repeat': repeat},
+        'etapes': stages,
+    }
+
+
+def compare(current: dict, reference: dict) -> None:
+    """Affiche le ratio de durée par étape entre le run courant et un run de référence."""
+    print(f"\nComparaison avec {reference.get('version')} ({reference.get('date')}) :")
+    if current['parametres'] != reference.get('parametres'):
+        print("  ⚠️  Paramètres différents : les durées ne sont pas directement comparables")
+    for name, stage in current['etapes'].items():
+        ref = reference['etapes'].get(name)
+        if not ref:
+            print(f"  {name:<22} nouvelle étape")
+            continue
+        ratio = stage['secondes'] / ref['secondes'] if ref['secondes'] else float('inf')
+        flag = '⚠️ ' if ratio > 1.2 else ''
+        print(f"  {name:<22} {ref['secondes']:>10.4f} s → {stage['secondes']:>10.4f} s  (×{ratio:.2f}) {flag}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Banc d'essai du pipeline ACC sur données synthétiques.")
+    parser.add_argument('--preset', choices=PRESETS, help="Taille prédéfinie (lignes R15)")
+    parser.add_argument('--prms', type=int, default=100, help="Nombre de points de livraison R15")
+    parser.add_argument('--years', type=int, default=3, help="Années d'historique")
+    parser.add_argument('--contracts', type=int, default=150, help="Nombre de contrats du journal")
+    parser.add_argument('--articles', type=int, default=2, help="Nombre d'articles CONSO")
+    parser.add_argument('--price-changes', type=int, default=4, help="Changements de prix par article")
+    parser.add_argument('--repeat', type=int, default=3, help="Répétitions par étape (meilleur temps retenu)")
+    parser.add_argument('--startup', action='store_true', help="Mesure le démarrage à froid de marimo run acc.py")
+    parser.add_argument('--no-bytecode', action='store_true', help="Démarrage sans bytecode précompilé (avec --startup)")
+    parser.add_argument('--output', type=Path, help="Fichier JSON de résultats")
+    parser.add_argument('--compare', type=Path, help="Résultats JSON de référence à comparer")
+    args = parser.parse_args(argv)
+
+    params = {'prms': args.prms, 'years': args.years, 'contracts': args.contracts}
+    if args.preset:
+        params.update(PRESETS[args.preset])
+
+    if args.startup:
+        result = run_startup(Path(__file__).parent / 'acc.py', args.repeat, bytecode=not args.no_bytecode)
+        for name, stage in result['etapes'].items():
+            print(f"{name:<22} {stage['secondes']:>10.4f} s  (min {stage['min']:.4f}, max {stage['max']:.4f})")
+    else:
+        result = run(**params, articles=args.articles, price_changes=args.price_changes, repeat=args.repeat)
+        for name, stage in result['etapes'].items():
+            print(f"{name:<22} {stage['secondes']:>10.4f} s  ({stage['lignes_entree']} → {stage['lignes_sortie']} lignes)")
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.compare:
+        compare(result, json.loads(args.compare.read_text()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
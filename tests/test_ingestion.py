@@ -0,0 +1,125 @@
+"""
+Ingestion incrémentale R15 : un historique mis à jour en mémoire doit être celui
+qu'on relirait de zéro depuis les parties, y compris après la modification d'un fichier.
+
+Les fichiers de flux sont remplacés par des CSV lus à la place de process_xml_files.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import electriflux.simple_reader
+import pandas as pd
+import pytest
+
+import acc
+from acc import R15Store, Workspace, filter_r15, ingest_r15_incremental, r15_period_totals, update_period_totals
+
+
+def releves(pdl: str, jours: list[int], valeur: float) -> str:
+    lignes = [f"{pdl},2023-01-{jour:02d}T00:00:00+01:00,0,{valeur + jour}" for jour in jours]
+    return "\n".join(["pdl,Date_Releve,Autoconsommation_Collective,EA_HP", *lignes]) + "\n"
+
+
+@pytest.fixture
+def flux(tmp_path, monkeypatch):
+    def process_xml_files(files, *args):
+        frames = [pd.read_csv(path, dtype=str) for path in files]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    monkeypatch.setattr(electriflux.simple_reader, 'process_xml_files', process_xml_files)
+    monkeypatch.setattr(acc, 'list_r15_files', lambda folder: sorted(Path(folder).glob('*.csv')))
+    folder = tmp_path / 'R15'
+    folder.mkdir()
+    return folder
+
+
+def normalise(history: pd.DataFrame) -> list:
+    df = history[['pdl', 'Date_Releve', 'EA_HP']].astype({'pdl': str})
+    return df.sort_values(['pdl', 'Date_Releve']).values.tolist()
+
+
+def test_historique_en_memoire_identique_a_la_relecture(flux):
+    (flux / 'a.csv').write_text(releves('P1', [1, 2, 3], 10.0))
+    (flux / 'b.csv').write_text(releves('P2', [1, 2], 20.0))
+    history, nb = ingest_r15_incremental(flux)
+    assert nb == 2 and len(history) == 5
+
+    # Nouveau fichier qui remplace un relevé de P1 et en ajoute un
+    (flux / 'c.csv').write_text(releves('P1', [3, 4], 100.0))
+    history, nb = ingest_r15_incremental(flux, history=history)
+    assert nb == 1
+    assert normalise(history) == normalise(ingest_r15_incremental(flux)[0])
+    assert history.loc[history['pdl'].astype(str).eq('P1'), 'EA_HP'].tolist().count(103.0) == 1
+
+    # Fichier modifié : le relevé qu'il ne contient plus quitte l'historique
+    (flux / 'a.csv').write_text(releves('P1', [2, 3], 10.0))
+    history, nb = ingest_r15_incremental(flux, history=history)
+    assert nb == 1
+    relu = ingest_r15_incremental(flux)[0]
+    assert normalise(history) == normalise(relu)
+    assert len(history) == 5
+    assert pd.Timestamp('2022-12-31 23:00', tz='UTC') not in set(history.loc[history['pdl'].astype(str).eq('P1'), 'Date_Releve'])
+
+
+def test_fichier_modifie_sans_autre_source(flux):
+    # Relevé présent dans deux fichiers : retiré de l'un, il reste porté par l'autre
+    (flux / 'a.csv').write_text(releves('P1', [1, 2], 10.0))
+    (flux / 'b.csv').write_text(releves('P1', [2], 50.0))
+    history, _ = ingest_r15_incremental(flux)
+    (flux / 'b.csv').write_text(releves('P1', [], 0.0))
+    history, _ = ingest_r15_incremental(flux, history=history)
+    assert normalise(history) == normalise(ingest_r15_incremental(flux)[0])
+    assert sorted(history['EA_HP'].tolist()) == [11.0, 12.0]
+
+
+def test_sessions_concurrentes(flux):
+    (flux / 'a.csv').write_text(releves('P1', [1, 2], 10.0))
+    ingest_r15_incremental(flux)
+    (flux / 'b.csv').write_text(releves('P2', [1, 2], 20.0))
+
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(lambda _: ingest_r15_incremental(flux)[0], range(2)))
+
+    manifest = json.loads((flux / '.acc_cache' / 'r15_history' / 'manifest.json').read_text())
+    assert len(set(manifest['parts'])) == len(manifest['parts'])
+    assert set(manifest['files']) == {'a.csv', 'b.csv'}
+    for history in [*results, ingest_r15_incremental(flux)[0]]:
+        assert len(history) == 4
+
+
+def test_surveillance_mise_a_jour_par_delta(flux, tmp_path):
+    (flux / 'a.csv').write_text(releves('P1', [5, 6, 7], 10.0))
+    (flux / 'b.csv').write_text(releves('P2', [5, 6], 20.0).replace(',0,', ',1,', 1))
+    workspace = Workspace(tmp_path / 'perimetres.csv')
+    first = workspace.load_r15(flux, incremental=True)
+    assert first['changes'] is None
+
+    periods = pd.DataFrame({
+        'CONTRAT': ['C1', 'C1'],
+        'CODE_ARTICLE': ['CONSO_HP'] * 2,
+        'PUHT': [0.1, 0.2],
+        'date_debut': pd.to_datetime(['2022-12-01', '2023-01-05'], utc=True),
+        'date_fin': pd.to_datetime(['2023-01-04 12:00', '2023-01-31 00:00'], utc=True),
+        'duree_jours': [35, 27],
+    })
+    fin = pd.Timestamp('2023-01-31', tz='UTC')
+    totals = r15_period_totals(filter_r15(first['r15'], first['debut_acc'], fin), periods)
+
+    # Relevé ACC plus ancien que le début, relevé remplacé, et fichier corrigé
+    (flux / 'c.csv').write_text(releves('P1', [2, 6], 100.0))
+    (flux / 'b.csv').write_text(releves('P2', [6], 30.0))
+    second = workspace.load_r15(flux, incremental=True)
+    changes = second['changes']
+    assert changes is not None and changes['depuis'] == first['generation']
+
+    reference = R15Store(ingest_r15_incremental(flux)[0])
+    assert normalise(second['r15']) == normalise(reference.frame)
+    assert second['r15_store'].frame['Date_Releve'].equals(reference.frame['Date_Releve'])
+    assert second['debut_acc'] == reference.debut_acc == pd.Timestamp('2023-01-01 23:00', tz='UTC')
+
+    updated = update_period_totals(
+        totals, periods, None, changes['ajoutes'], changes['retires'], second['debut_acc'], first['debut_acc'], fin,
+    )
+    expected = r15_period_totals(reference.slice(reference.debut_acc, fin), periods)
+    pd.testing.assert_frame_equal(updated, expected, check_dtype=False)
@@ -0,0 +1,46 @@
+"""
+Cellules du journal des ventes quand il provient d'un périmètre du workspace.
+
+Le sélecteur de fichier reste alors vide : le nom affiché doit venir du chemin résolu.
+"""
+from types import SimpleNamespace
+
+import pandas as pd
+
+from acc import PipelineProfiler, Workspace, journal_prefetch, journal_ventes_validation
+
+
+def test_journal_du_perimetre_sans_selecteur(tmp_path):
+    workspace = Workspace(tmp_path / 'perimetres.csv', cache_dir=tmp_path / 'cache')
+    workspace.register('Nord', tmp_path / 'nord' / 'R15', 'nord/journal.xlsx')
+    (tmp_path / 'nord').mkdir()
+    pd.DataFrame({
+        'CONTRAT': ['C1', 'C1'],
+        'CODE_ARTICLE': ['CONSO_HP', 'ABONNEMENT'],
+        'PUHT': [0.2, 5.0],
+        'DATEFACT': pd.to_datetime(['2023-02-01', '2023-02-01']),
+        'QUANTITE': [10.0, 1.0],
+    }).to_excel(tmp_path / 'nord' / 'journal.xlsx', index=False)
+
+    _, prefetch = journal_prefetch.run(
+        get_journal_version=lambda: 0,
+        journal_picker=SimpleNamespace(value=()),
+        perimetre_dropdown=SimpleNamespace(value='Nord'),
+        profiler=PipelineProfiler(),
+        workspace=workspace,
+    )
+    assert prefetch['journal_name'] == 'journal.xlsx'
+    (journal, from_cache), seconds = prefetch['journal_future'].result()
+
+    output, defs = journal_ventes_validation.run(
+        date_regularisation=pd.Timestamp('2023-12-31', tz='UTC'),
+        debut_acc=pd.Timestamp('2023-01-01', tz='UTC'),
+        journal_from_cache=from_cache,
+        journal_load_seconds=seconds,
+        journal_name=prefetch['journal_name'],
+        journal_ventes_raw=journal,
+        profiler=PipelineProfiler(),
+        validation_mode_dropdown=SimpleNamespace(value='complet'),
+    )
+    assert 'journal.xlsx' in output.text
+    assert defs['journal_ventes']['CODE_ARTICLE'].tolist() == ['CONSO_HP']
@@ -0,0 +1,70 @@
+"""
+Équivalence de identify_price_periods avec l'implémentation d'origine par groupby.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from acc import identify_price_periods
+
+
+def identify_price_periods_groupby(df: pd.DataFrame) -> pd.DataFrame:
+    """Implémentation d'origine (boucle sur les groupes CONTRAT-CODE_ARTICLE), servant de référence."""
+    if df.empty:
+        return pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours'])
+
+    df_sorted = df.sort_values(['CONTRAT', 'CODE_ARTICLE', 'DATEFACT']).copy()
+    periods_list = []
+    for (contrat, article), group in df_sorted.groupby(['CONTRAT', 'CODE_ARTICLE']):
+        price_changes = group['PUHT'] != group['PUHT'].shift(1)
+        price_changes.iloc[0] = True
+        change_indices = group[price_changes].index
+        for i, start_idx in enumerate(change_indices):
+            date_debut = group.loc[start_idx, 'DATEFACT']
+            puht = group.loc[start_idx, 'PUHT']
+            if i < len(change_indices) - 1:
+                date_fin = group.loc[change_indices[i + 1], 'DATEFACT'] - pd.Timedelta(days=1)
+            else:
+                date_fin = group['DATEFACT'].iloc[-1]
+            periods_list.append({
+                'CONTRAT': contrat,
+                'CODE_ARTICLE': article,
+                'PUHT': puht,
+                'date_debut': date_debut,
+                'date_fin': date_fin,
+                'duree_jours': (date_fin - date_debut).days + 1,
+            })
+
+    result_df = pd.DataFrame(periods_list)
+    if result_df.empty:
+        return pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours'])
+    return result_df
+
+
+def journal_aleatoire(rng: np.random.Generator, manquants: bool) -> pd.DataFrame:
+    """Journal aléatoire : peu de dates distinctes (égalités), clés et dates éventuellement manquantes."""
+    n = int(rng.integers(1, 200))
+    contrats = ['C1', 'C2', 'C3', None] if manquants else ['C1', 'C2', 'C3', 'C4']
+    df = pd.DataFrame({
+        'CONTRAT': rng.choice(contrats, n),
+        'CODE_ARTICLE': rng.choice(['CONSO_A', 'CONSO_B'], n),
+        'PUHT': rng.choice([0.1, 0.2, np.nan] if manquants else [0.1, 0.2, 0.3], n),
+        'DATEFACT': pd.to_datetime('2022-01-01', utc=True) + pd.to_timedelta(rng.integers(0, 60, n), 'D'),
+    })
+    if manquants:
+        df.loc[rng.random(n) < 0.05, 'DATEFACT'] = pd.NaT
+    df.index = rng.permutation(n)
+    return df
+
+
+@pytest.mark.parametrize('graine', range(300))
+def test_identique_a_groupby(graine):
+    rng = np.random.default_rng(graine)
+    df = journal_aleatoire(rng, manquants=graine % 3 == 0)
+    pd.testing.assert_frame_equal(identify_price_periods(df), identify_price_periods_groupby(df))
+
+
+def test_journal_vide():
+    vide = pd.DataFrame(columns=['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'DATEFACT'])
+    assert identify_price_periods(vide).empty
+    assert list(identify_price_periods(vide).columns) == list(identify_price_periods_groupby(vide).columns)
@@ -0,0 +1,117 @@
+"""
+Équivalence de l'agrégation R15 par période avec un filtrage période par période.
+
+Les relevés aléatoires comptent plusieurs relevés par PRM et par jour, des dates
+manquantes et des énergies manquantes ; les périodes ont des bornes en milieu de journée.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from acc import EnergyCube, aggregate_r15_by_period, aggregate_r15_parquet, filter_r15, identify_price_periods
+
+INFO_COLS = ['CONTRAT', 'CODE_ARTICLE', 'PUHT', 'date_debut', 'date_fin', 'duree_jours']
+DEBUT = pd.Timestamp('2022-01-01', tz='UTC')
+
+
+def aggregate_par_masque(r15: pd.DataFrame, price_periods: pd.DataFrame, contract_prm=None) -> pd.DataFrame:
+    """Référence : un masque booléen sur tous les relevés pour chaque période."""
+    numeric_cols = r15.select_dtypes(include=['float64', 'float32', 'int64']).columns.tolist()
+    lignes = []
+    for _, period in price_periods.iterrows():
+        mask = (r15['Date_Releve'] >= period['date_debut']) & (r15['Date_Releve'] <= period['date_fin'])
+        if contract_prm is not None:
+            mask &= r15['pdl'].isin(contract_prm.loc[contract_prm['CONTRAT'] == period['CONTRAT'], 'pdl'])
+        releves = r15[mask]
+        if not releves.empty:
+            lignes.append({
+                **period[INFO_COLS].to_dict(),
+                'nb_lignes_r15': len(releves),
+                **{col: releves[col].sum() for col in numeric_cols},
+            })
+    if not lignes:
+        return pd.DataFrame()
+    return pd.DataFrame(lignes)
+
+
+def releves_aleatoires(rng: np.random.Generator, plusieurs_par_jour: bool) -> pd.DataFrame:
+    """Relevés de 3 PRM sur 120 jours ; avec `plusieurs_par_jour`, jusqu'à 4 relevés par jour."""
+    n = int(rng.integers(1, 400))
+    jours = rng.integers(0, 120, n)
+    heures = rng.integers(0, 24, n) if plusieurs_par_jour else np.full(n, 23)
+    r15 = pd.DataFrame({
+        'pdl': rng.choice(['P1', 'P2', 'P3'], n),
+        'Date_Releve': DEBUT + pd.to_timedelta(jours * 24 + heures, 'h'),
+        'Autoconsommation_Collective': pd.array(rng.choice([0, 0, 0, 1], n), dtype='Int8'),
+        'EA_Autoconsommee_HP': np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 100),
+        'EA_Alloproduite_HP': rng.integers(0, 50, n).astype(np.float64),
+    })
+    if plusieurs_par_jour:
+        r15.loc[rng.random(n) < 0.05, 'Date_Releve'] = pd.NaT
+    else:
+        r15 = r15.drop_duplicates(['pdl', 'Date_Releve'])
+    return r15.sample(frac=1, random_state=int(rng.integers(1 << 30))).reset_index(drop=True)
+
+
+def periodes_aleatoires(rng: np.random.Generator) -> pd.DataFrame:
+    """Périodes de prix de deux contrats, bornées en milieu de journée une fois sur deux."""
+    journal = pd.DataFrame({
+        'CONTRAT': rng.choice(['C1', 'C2'], 40),
+        'CODE_ARTICLE': 'CONSO_HP',
+        'PUHT': rng.choice([0.1, 0.2], 40),
+        'DATEFACT': DEBUT + pd.to_timedelta(rng.integers(0, 130, 40), 'D')
+        + pd.to_timedelta(rng.choice([0, 12], 40), 'h'),
+    })
+    return identify_price_periods(journal)
+
+
+@pytest.mark.parametrize('avec_correspondance', [False, True])
+@pytest.mark.parametrize('graine', range(100))
+def test_identique_au_filtrage_par_periode(graine, avec_correspondance):
+    rng = np.random.default_rng(graine)
+    r15 = releves_aleatoires(rng, plusieurs_par_jour=True)
+    periods = periodes_aleatoires(rng)
+    mapping = pd.DataFrame({'CONTRAT': ['C1', 'C1', 'C2'], 'pdl': ['P1', 'P2', 'P3']}) if avec_correspondance else None
+    debut, fin = DEBUT + pd.Timedelta(days=5, hours=6), DEBUT + pd.Timedelta(days=100, hours=12)
+
+    filtered = filter_r15(r15, debut, fin)
+    attendu = aggregate_par_masque(filtered, periods, mapping)
+    obtenu = aggregate_r15_by_period(filtered, periods, mapping)
+    pd.testing.assert_frame_equal(obtenu, attendu, check_dtype=False, rtol=1e-9)
+    # Relevés déjà triés par date (vue d'un R15Store) : même résultat
+    trie = filtered.sort_values('Date_Releve', kind='stable')
+    pd.testing.assert_frame_equal(aggregate_r15_by_period(trie, periods, mapping), obtenu, check_dtype=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize('graine', range(50))
+def test_cube_exact_avec_un_releve_par_jour(graine):
+    rng = np.random.default_rng(graine)
+    r15 = releves_aleatoires(rng, plusieurs_par_jour=False)
+    periods = periodes_aleatoires(rng)
+    mapping = pd.DataFrame({'CONTRAT': ['C1', 'C1', 'C2'], 'pdl': ['P1', 'P2', 'P3']})
+    debut, fin = DEBUT + pd.Timedelta(days=5, hours=6), DEBUT + pd.Timedelta(days=100, hours=12)
+
+    cube = EnergyCube.from_r15(r15)
+    for contract_prm in [None, mapping]:
+        totaux = cube.period_totals(periods, contract_prm, debut, [fin])[0]
+        attendu = aggregate_r15_by_period(filter_r15(r15, debut, fin), periods, contract_prm)
+        garde = totaux[:, 0] > 0
+        assert garde.sum() == len(attendu)
+        if len(attendu):
+            np.testing.assert_allclose(totaux[garde], attendu[cube.value_cols].to_numpy(dtype=np.float64), rtol=1e-9)
+
+
+@pytest.mark.parametrize('graine', range(30))
+def test_flux_parquet_identique_en_memoire(graine, tmp_path):
+    """Mode --streaming d'acc_batch : mêmes totaux que l'agrégation en mémoire."""
+    rng = np.random.default_rng(graine)
+    r15 = releves_aleatoires(rng, plusieurs_par_jour=True)
+    periods = periodes_aleatoires(rng)
+    mapping = pd.DataFrame({'CONTRAT': ['C1', 'C1', 'C2'], 'pdl': ['P1', 'P2', 'P3']})
+    debut, fin = DEBUT + pd.Timedelta(days=5, hours=6), DEBUT + pd.Timedelta(days=100, hours=12)
+    r15.to_parquet(tmp_path / 'r15.parquet', index=False)
+
+    for contract_prm in [None, mapping]:
+        attendu = aggregate_r15_by_period(filter_r15(r15, debut, fin), periods, contract_prm)
+        obtenu = aggregate_r15_parquet(tmp_path / 'r15.parquet', periods, contract_prm, debut, fin, batch_size=37)
+        pd.testing.assert_frame_equal(obtenu, attendu, check_dtype=False, rtol=1e-9)
@@ -0,0 +1,30 @@
+"""
+Registre des périmètres : un manifeste d'acc_batch.py enregistré dans le workspace
+doit rester lisible par acc_batch.py après chaque ajout.
+"""
+import pandas as pd
+
+from acc import Workspace
+from acc_batch import read_manifest
+
+
+def test_registre_reste_un_manifeste_acc_batch(tmp_path):
+    registry = tmp_path / 'perimetres.csv'
+    pd.DataFrame({
+        'nom': ['Nord'],
+        'r15': ['nord/R15'],
+        'journal': ['nord/journal.xlsx'],
+        'date_regularisation': ['2024-06-30'],
+        'commentaire': ['pilote'],
+    }).to_csv(registry, index=False)
+
+    workspace = Workspace(registry)
+    workspace.register('Sud', 'sud/R15', 'sud/journal.xlsx', date_regularisation='2024-12-31')
+    # Remplacé sans date : la date et les autres colonnes du périmètre sont conservées
+    workspace.register('Nord', 'nord/R15', 'nord/journal_2024.xlsx')
+
+    perimetres = {p['nom']: p for p in read_manifest(registry)}
+    assert perimetres['Nord']['date_regularisation'] == '2024-06-30'
+    assert perimetres['Nord']['journal_path'] == tmp_path / 'nord' / 'journal_2024.xlsx'
+    assert perimetres['Sud']['date_regularisation'] == '2024-12-31'
+    assert pd.read_csv(registry, dtype=str).set_index('nom').loc['Nord', 'commentaire'] == 'pilote'